@@ -5,16 +5,37 @@
 #import datetime
 import time
 import os
+import re
+import threading
+import glob
+import json
+import hashlib
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager, ExitStack
 from io import BytesIO
 
 import pandas as pd
 import numpy as np
 import pyodbc
-from sqlalchemy import create_engine, exc, URL, text
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, event, exc, make_url, URL, text
 import streamlit as st
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import datetime ,timedelta
+from datos import (salud_medidores, resumen_por_dia, resumen_vacio, resumen_desde_celdas, normalizar_resumen,
+                   extremos_franjas, CANALES_RESUMEN)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 
 # Constantes
@@ -23,6 +44,38 @@ QUERY = "SELECT * FROM {}.dbo.{} WHERE fecha like'{}'"
 POR_DIA = 'Por día'
 POR_RANGO_DIA = 'Por rango de días'
 
+# Cache columnar: <directorio>/cache/tabla=<table>/anio=<YYYY>/mes=<MM>/tabla_<table>_<día>.parquet
+CACHE = 'cache'
+COLUMNAS_DATOS = ["fecha", "vol_corregido", "flujo_corregido", "presion", "temperatura"]
+ESQUEMA_CACHE = pa.schema([("fecha", pa.timestamp("ms"))] + [(c, pa.float64()) for c in COLUMNAS_DATOS[1:]])
+MANIFIESTO = '_manifiesto.json'
+BLOQUEOS = '_bloqueos'
+RESUMEN = '_resumen.parquet'
+PATRON_CSV = re.compile(r'tabla_(.+)_(\d{4}-\d{2}-\d{2})\.csv$')
+
+# Conexión SQL: credenciales en SERVER, USER_SQL, PASSWORD y DATABASE. SQL_URL reemplaza la conexión completa
+# (por ejemplo "sqlite:///prueba.db" para probar sin el servidor)
+SQL_POOL_SIZE = 5
+SQL_MAX_OVERFLOW = 5
+SQL_POOL_RECYCLE = 1800  # segundos
+SQL_TIMEOUT = 120  # segundos por consulta
+
+# Carga en paralelo de las tablas de los medidores
+MAX_HILOS_CARGA = 3
+# Memoria máxima de los bloques diarios leídos de la cache (se puede cambiar con la variable MEMORIA_BLOQUES_MB)
+MEMORIA_BLOQUES_MB = 512
+# Días cerrados sin descargar cuyo resumen calculado en la base de datos se guarda en memoria
+MAX_DIAS_RESUMEN_SQL = 4000
+
+# Gráficas de series de tiempo: con más de UMBRAL_WEBGL puntos se dibujan con WebGL (Scattergl) en lugar de SVG.
+# MODO_WEBGL puede ser "auto", "siempre" o "nunca"; ambos se pueden cambiar con variables de entorno del mismo nombre
+MODO_WEBGL = "auto"
+UMBRAL_WEBGL = 20000
+
+# Día de producción: de las 6:00 a las 6:10 del día siguiente
+HORA_INICIO_DIA = 6
+MINUTOS_CIERRE = 10
+
 # ----------------------------------------------------------------------------------------------------------------------
 ### Funciones
 
@@ -130,26 +183,45 @@ def get_salud(df, datos_dias, periodo = 'day_planta', sel_dia_ini = None, sel_di
         salud_list = [np.round(salud_datos, 2)]
     
     else:
-        while sel_dia_ini <= sel_dia_fin:
-            df_filter = df.loc[(df.index >= str(sel_dia_ini) + ' 06:00:00') &
-                            (df.index <= str(sel_dia_ini + datetime.timedelta(days=1)) + ' 05:59:59')]
-
-            salud_dia = np.round((df_filter.shape[0] / datos_dias) * 100, 2)
-            salud_list.append(salud_dia)
-            # Avanzo un día
-            sel_dia_ini = sel_dia_ini + datetime.timedelta(days=1)
-        
+        # Ranuras de 1 día / datos_dias desde las 6:00; se cuentan las ranuras con datos de todos los días a la vez
+        cadencia = pd.Timedelta(days=1) / datos_dias
+        salud = salud_medidores({"datos": pd.DataFrame({"fecha": df.index})}, sel_dia_ini, sel_dia_fin,
+                                cadencias={"datos": cadencia})
+        salud_list = list(np.round(salud["dia"]["datos"].to_numpy(), 2))
         salud_datos = sum(salud_list) / len(salud_list)
 
     return salud_list, salud_datos
 
 
-def plot_on_off(fig, df, column, legend, rgb, visibility="legendonly", secondary_y=True, axis_y="y2", r=1, c=1):
+def usar_webgl(puntos, webgl=None):
+    '''
+    Indica si una gráfica se dibuja con WebGL según MODO_WEBGL y UMBRAL_WEBGL\n
+    :param puntos: total de puntos de la gráfica
+    :param webgl: opción de la gráfica: None usa el modo global, True o False lo reemplazan
+    '''
+    if webgl is not None:
+        return bool(webgl)
+    modo = os.environ.get("MODO_WEBGL", MODO_WEBGL)
+
+    return modo == "siempre" or (modo == "auto" and puntos > int(os.environ.get("UMBRAL_WEBGL", UMBRAL_WEBGL)))
+
+
+def dispersion(puntos, webgl=None):
+    '''
+    Clase de traza para una serie de tiempo: go.Scattergl con WebGL o go.Scatter (SVG)\n
+    :param puntos: total de puntos de la gráfica
+    :param webgl: opción de la gráfica (ver usar_webgl)
+    '''
+    return go.Scattergl if usar_webgl(puntos, webgl) else go.Scatter
+
+
+def plot_on_off(fig, df, column, legend, rgb, visibility="legendonly", secondary_y=True, axis_y="y2", r=1, c=1,
+                webgl=None):
     '''
-    Funcion para activar o desactivar trazos de la grafica
+    Funcion para activar o desactivar trazos de la grafica. webgl: None usa MODO_WEBGL, True o False lo reemplazan
     '''
 
-    fig.add_trace(go.Scatter(x=df.index, y=df[column],
+    fig.add_trace(dispersion(len(df), webgl)(x=df.index, y=df[column],
                              fill='tozeroy', mode="lines",
                              fillcolor=rgb,
                              line_color='rgba(0,0,0,0)',
@@ -163,11 +235,12 @@ def plot_on_off(fig, df, column, legend, rgb, visibility="legendonly", secondary
     return fig
 
 
-def plot_json(df, title, dict_graficas):
+def plot_json(df, title, dict_graficas, webgl=None):
     '''
     funcion para graficar a partir de archivos json.\n
     :param df: pandas dataframe traído de la base de dato SQL
     :param dict_graficas: json/dict con caracteristicas de la grafica.
+    :param webgl: None usa MODO_WEBGL según el total de puntos, True o False fuerzan el modo de todas las trazas
     
     :return fig: objeto figura para dibujarlo externamente de la función
     '''
@@ -176,16 +249,17 @@ def plot_json(df, title, dict_graficas):
     fig = make_subplots(rows=dict_graficas["rows"], cols=1,  specs=specs,
                         shared_xaxes=True, vertical_spacing=0.06,
                         )
+    webgl = usar_webgl(len(df) * (len(dict_graficas["on/off"]) + len(dict_graficas["trazos"])), webgl)
 
     # add trazos on/off
     for trazo in dict_graficas["on/off"]:
         fig = plot_on_off(fig, df, trazo["column"], trazo["legend"], trazo["rgb"],
                         trazo["visibility"], trazo["second_y"], trazo["axis_y"],
-                        trazo["r"], trazo["c"])
+                        trazo["r"], trazo["c"], webgl=webgl)
         
     # add trazos
     for trazo in dict_graficas["trazos"]:
-        fig.add_trace(go.Scatter(x=df.index, y=df[trazo["y"]],
+        fig.add_trace(dispersion(len(df), webgl)(x=df.index, y=df[trazo["y"]],
                             line=dict(color=trazo["color"], width=trazo["width"], dash=trazo["dash"]),  
                             mode=trazo["mode"], name=trazo["name"],
                             yaxis=trazo["yaxis"], visible=trazo["visible"],
@@ -201,21 +275,626 @@ def plot_json(df, title, dict_graficas):
 
     return fig
 # ----------------------------------------------------------------------------------------------------------------------
-## SQL
-@st.cache_data(show_spinner=True)
-def load_data(folder, filename):
+## Cache columnar
+def ventana_dia(day):
+    """
+    Ventana de tiempo de un día de producción, de las 6:00 del día a las 6:10 del día siguiente\n
+    :param day: día en STR ("2021-04-28") o date
+
+    :return ini: datetime de inicio de la ventana
+    :return fin: datetime de cierre de la ventana (excluido)
+    """
+    ini = pd.Timestamp(str(day)).to_pydatetime().replace(hour=HORA_INICIO_DIA, minute=0, second=0)
+    fin = ini + timedelta(days=1, minutes=MINUTOS_CIERRE)
+
+    return ini, fin
+
+
+def ruta_cache(directorio, table):
+    '''
+    Carpeta raíz de la cache columnar de una tabla\n
+    :param directorio: directorio donde se guardan los archivos
+    :param table: tabla de la base de datos
+    '''
+    return os.path.join(directorio, CACHE, 'tabla=' + table)
+
+
+def ruta_particion(directorio, table, day):
+    '''
+    Archivo parquet de un día dentro de la partición tabla/año/mes\n
+    :param directorio: directorio donde se guardan los archivos
+    :param table: tabla de la base de datos
+    :param day: día en STR ("2021-04-28")
+    '''
+    return os.path.join(ruta_cache(directorio, table), 'anio=' + day[:4], 'mes=' + day[5:7],
+                        'tabla_' + table + '_' + day + '.parquet')
+
+
+def ruta_temporal(ruta):
+    '''
+    Archivo temporal propio del proceso y del hilo para escribir ruta y luego renombrarlo con os.replace, así los
+    lectores nunca ven un archivo a medio escribir\n
+    :param ruta: ruta final del archivo
+    '''
+    return '{}.{}.{}.tmp'.format(ruta, os.getpid(), threading.get_ident())
+
+
+def tipar_datos(df):
+    '''
+    Deja el dataframe con el esquema de la cache: fecha como datetime64 y los canales como float\n
+    :param df: dataframe traído de SQL o de un csv
+
+    :return df: dataframe tipado con las columnas de COLUMNAS_DATOS
+    '''
+    df = df.reindex(columns=COLUMNAS_DATOS)
+    df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce").astype("datetime64[ms]")
+    for columna in COLUMNAS_DATOS[1:]:
+        if not pd.api.types.is_numeric_dtype(df[columna]):
+            # Algunos registros llegan con coma decimal
+            df[columna] = df[columna].astype(str).str.replace(",", ".")
+        df[columna] = pd.to_numeric(df[columna], errors="coerce").astype("float64")
+
+    return df.dropna(subset=["fecha"]).reset_index(drop=True)
+
+
+def dia_cerrado(day, momento):
     '''
-    Función que carga el archivo csv guardado al conectar con la base de datos y devuelve un dataframe\n
-    :param folder: Direccion de la carpeta 
-    :param filename: Nombre del archivo
+    Indica si la ventana del día de producción ya había cerrado en un momento dado\n
+    :param day: día en STR ("2021-04-28")
+    :param momento: datetime a evaluar
+    '''
+    return momento >= ventana_dia(day)[1]
+
+
+def guardar_particion(df, table, day, directorio, final, descargado=None, persistir=True, resumen=None):
+    '''
+    Guarda los datos de un día en su partición de la cache columnar y lo registra en el manifiesto y en el resumen
+    diario. En los metadatos del archivo quedan la última fecha guardada (marca de agua), la hora de descarga y si el
+    día ya está completo\n
+    :param df: dataframe con los datos del día
+    :param table: tabla de la base de datos
+    :param day: día en STR ("2021-04-28")
+    :param directorio: directorio donde se guardan los archivos
+    :param final: True si la descarga se hizo después del cierre de la ventana del día
+    :param descargado: datetime de la descarga
+    :param persistir: si es False el manifiesto solo se actualiza en memoria (para guardar varios días seguidos)
+    :param resumen: salida de resumen_por_dia que ya incluye el día (para no recalcularla en cada día de un tramo)
+    '''
+    ruta = ruta_particion(directorio, table, day)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    df = tipar_datos(df)
+    metadatos = {
+        "watermark": str(df["fecha"].max()) if len(df) else "",
+        "descargado": str(descargado or datetime.now()),
+        "final": "1" if final else "0",
+    }
+    tabla = pa.Table.from_pandas(df, schema=ESQUEMA_CACHE, preserve_index=False)
+    temporal = ruta_temporal(ruta)
+    pq.write_table(tabla.replace_schema_metadata(metadatos), temporal)
+    os.replace(temporal, ruta)
+    sha256 = checksum(ruta)
+
+    # El resumen se registra antes que la partición para que se guarde junto con el manifiesto
+    registrar_resumen(table, directorio, resumen_por_dia(df) if resumen is None else resumen, {day: sha256})
+    registrar_particion(table, day, directorio, {
+        "archivo": os.path.relpath(ruta, ruta_cache(directorio, table)),
+        "filas": len(df),
+        "fecha_min": str(df["fecha"].min()) if len(df) else "",
+        "fecha_max": metadatos["watermark"],
+        "bytes": os.path.getsize(ruta),
+        "sha256": sha256,
+        "descargado": metadatos["descargado"],
+        "final": final,
+    }, persistir=persistir)
+
+
+def checksum(ruta):
+    '''
+    SHA-256 del contenido de un archivo\n
+    :param ruta: ruta del archivo
+    '''
+    with open(ruta, 'rb') as archivo:
+        return hashlib.sha256(archivo.read()).hexdigest()
+
+
+def entrada_desde_archivo(ruta, raiz):
+    '''
+    Arma la entrada del manifiesto de una partición leyendo el archivo (para archivos sin registrar o de versiones
+    anteriores). Lanza una excepción de pyarrow si el archivo está dañado\n
+    :param ruta: ruta del archivo parquet
+    :param raiz: carpeta raíz de la cache de la tabla
+
+    :return entrada: diccionario con los datos de la partición
+    '''
+    metadatos = {k.decode(): v.decode() for k, v in (pq.read_schema(ruta).metadata or {}).items()}
+    fechas = pq.read_table(ruta, columns=["fecha"])["fecha"]
+    extremos = pc.min_max(fechas).as_py()
+
+    return {
+        "archivo": os.path.relpath(ruta, raiz),
+        "filas": len(fechas),
+        "fecha_min": str(extremos["min"] or ""),
+        "fecha_max": str(extremos["max"] or ""),
+        "bytes": os.path.getsize(ruta),
+        "sha256": checksum(ruta),
+        "descargado": metadatos.get("descargado", ""),
+        # Archivos sin metadatos: se completan una vez más con la marca de agua
+        "final": metadatos.get("final") == "1",
+    }
+
+
+## Manifiesto de la cache
+# Por tabla: {día: entrada}, con los días ordenados para buscar rangos con bisect
+_manifiestos = {}
+_manifiesto_lock = threading.RLock()
+# Por tabla: días que este proceso cambió en memoria desde la última escritura. Al guardar solo esos días se toman de
+# memoria; el resto se toma del archivo para no pisar lo que registraron otros procesos
+_cambios_manifiesto = {}
+
+
+def ruta_bloqueo_manifiesto(directorio, table):
+    '''
+    Archivo de bloqueo entre procesos para leer, fusionar y escribir el manifiesto y el resumen de una tabla\n
+    :param directorio: directorio donde se guardan los archivos
+    :param table: tabla de la base de datos
+    '''
+    return os.path.join(ruta_cache(directorio, table), BLOQUEOS, MANIFIESTO + '.lock')
+
+
+def leer_manifiesto(table, directorio):
+    '''
+    Lee del disco el manifiesto de una tabla\n
+    :param table: tabla de la base de datos
+    :param directorio: directorio donde se guardan los archivos
 
-    :return df: Dataframe
+    :return dias: diccionario {día: entrada}, vacío si no hay archivo
     '''
-    df = pd.read_csv(folder + filename, )
+    ruta = os.path.join(ruta_cache(directorio, table), MANIFIESTO)
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)["dias"]
+
+
+def cargar_manifiesto(table, directorio):
+    '''
+    Devuelve el manifiesto de una tabla. La primera vez en el proceso se lee el archivo y se concilia con las
+    particiones: se registran los archivos que falten, se recalculan las entradas cuyo tamaño no coincide y se borran
+    los archivos que no se pueden leer\n
+    :param table: tabla de la base de datos
+    :param directorio: directorio donde se guardan los archivos
+
+    :return manifiesto: diccionario con "dias" {día: entrada} y "orden" (lista ordenada de días)
+    '''
+    clave = (directorio, table)
+    with _manifiesto_lock:
+        if clave in _manifiestos:
+            return _manifiestos[clave]
+
+        raiz = ruta_cache(directorio, table)
+        dias = leer_manifiesto(table, directorio)
+
+        conciliados = {}
+        for ruta_parquet in glob.glob(os.path.join(raiz, 'anio=*', 'mes=*', '*.parquet')):
+            day = ruta_parquet[-18:-8]
+            entrada = dias.get(day)
+            if entrada is not None and entrada["bytes"] == os.path.getsize(ruta_parquet):
+                conciliados[day] = entrada
+                continue
+            try:
+                conciliados[day] = entrada_desde_archivo(ruta_parquet, raiz)
+            except (pa.ArrowException, OSError):
+                print('Partición dañada, se descargará de nuevo: {}'.format(ruta_parquet))
+                os.remove(ruta_parquet)
+
+        _manifiestos[clave] = {"dias": conciliados, "orden": sorted(conciliados)}
+        cambios = {day for day in set(dias) | set(conciliados) if dias.get(day) != conciliados.get(day)}
+        if cambios:
+            _cambios_manifiesto.setdefault(clave, set()).update(cambios)
+            guardar_manifiesto(table, directorio)
+
+        return _manifiestos[clave]
+
+
+def guardar_manifiesto(table, directorio):
+    '''
+    Escribe el manifiesto de una tabla en disco (archivo temporal + renombrar), junto con su resumen diario. Bajo el
+    bloqueo de la tabla se vuelve a leer el archivo y se fusiona: los días que cambió este proceso se toman de memoria
+    y el resto del disco, así no se pierden las entradas que guardaron otros procesos. La memoria queda con el
+    resultado de la fusión\n
+    :param table: tabla de la base de datos
+    :param directorio: directorio donde se guardan los archivos
+    '''
+    clave = (directorio, table)
+    with _manifiesto_lock, bloqueo_archivo(ruta_bloqueo_manifiesto(directorio, table)):
+        manifiesto = _manifiestos[clave]
+        cambios = _cambios_manifiesto.pop(clave, set())
+        dias = {day: entrada for day, entrada in leer_manifiesto(table, directorio).items() if day not in cambios}
+        dias.update({day: manifiesto["dias"][day] for day in cambios if day in manifiesto["dias"]})
+        manifiesto["dias"].clear()
+        manifiesto["dias"].update(dias)
+        manifiesto["orden"][:] = sorted(dias)
+
+        raiz = ruta_cache(directorio, table)
+        os.makedirs(raiz, exist_ok=True)
+        ruta = os.path.join(raiz, MANIFIESTO)
+        temporal = ruta_temporal(ruta)
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump({"tabla": table, "dias": dias}, archivo, indent=1)
+        os.replace(temporal, ruta)
+        escribir_resumen(table, directorio)
+
+
+def registrar_particion(table, day, directorio, entrada, persistir=True):
+    '''
+    Agrega o reemplaza la entrada de un día en el manifiesto. Si entrada es None el día se elimina\n
+    :param table: tabla de la base de datos
+    :param day: día en STR ("2021-04-28")
+    :param directorio: directorio donde se guardan los archivos
+    :param entrada: diccionario con filas, fecha_min, fecha_max, bytes, sha256, descargado y final
+    :param persistir: si es False el manifiesto solo se actualiza en memoria
+    '''
+    with _manifiesto_lock:
+        manifiesto = cargar_manifiesto(table, directorio)
+        _cambios_manifiesto.setdefault((directorio, table), set()).add(day)
+        if entrada is None:
+            if manifiesto["dias"].pop(day, None) is not None:
+                manifiesto["orden"].remove(day)
+        else:
+            if day not in manifiesto["dias"]:
+                manifiesto["orden"].insert(bisect_left(manifiesto["orden"], day), day)
+            manifiesto["dias"][day] = entrada
+        if persistir:
+            guardar_manifiesto(table, directorio)
+
+
+def dias_en_rango(table, ini, fin, directorio):
+    '''
+    Entradas del manifiesto de los días guardados dentro de un rango\n
+    :param table: tabla de la base de datos
+    :param ini: día inicial en STR
+    :param fin: día final en STR
+
+    :return entradas: diccionario {día: entrada} ordenado por día
+    '''
+    with _manifiesto_lock:
+        manifiesto = cargar_manifiesto(table, directorio)
+        orden = manifiesto["orden"]
+        return {day: manifiesto["dias"][day]
+                for day in orden[bisect_left(orden, ini):bisect_right(orden, fin)]}
+
+
+def estado_particion(table, day, directorio):
+    '''
+    Marca de agua y estado de un día según el manifiesto, sin tocar los archivos\n
+    :param table: tabla de la base de datos
+    :param day: día en STR ("2021-04-28")
+    :param directorio: directorio donde se guardan los archivos
+
+    :return estado: None si el día no está en la cache, si no diccionario con "watermark" (Timestamp o None),
+    "final" y "filas"
+    '''
+    entrada = dias_en_rango(table, day, day, directorio).get(day)
+    if entrada is None:
+        return None
+
+    return {"watermark": pd.Timestamp(entrada["fecha_max"]) if entrada["fecha_max"] else None,
+            "final": entrada["final"],
+            "filas": entrada["filas"]}
+
+
+def planificar_rango(table, ini, fin, directorio):
+    '''
+    Clasifica los días de un rango según el manifiesto\n
+    :param table: tabla de la base de datos
+    :param ini: día inicial en STR
+    :param fin: día final en STR
+    :param directorio: directorio donde se guardan los archivos
+
+    :return faltantes: días que no están en la cache
+    :return parciales: lista de (día, marca de agua) de los días incompletos, incluidos los vacíos sin cerrar
+    '''
+    entradas = dias_en_rango(table, ini, fin, directorio)
+    faltantes = [day for day in pd.date_range(ini, fin).strftime("%Y-%m-%d") if day not in entradas]
+    parciales = [(day, pd.Timestamp(entrada["fecha_max"]) if entrada["fecha_max"] else None)
+                 for day, entrada in entradas.items() if not entrada["final"]]
+
+    return faltantes, parciales
+
+
+def verificar_particiones(table, ini, fin, directorio):
+    '''
+    Revisa tamaño, checksum y lectura de las particiones de un rango. Las que no coinciden con el manifiesto o no se
+    pueden leer se borran para que se descarguen de nuevo\n
+    :param table: tabla de la base de datos
+    :param ini: día inicial en STR
+    :param fin: día final en STR
+    :param directorio: directorio donde se guardan los archivos
+
+    :return dañados: lista de días descartados
+    '''
+    raiz = ruta_cache(directorio, table)
+    dañados = []
+    for day, entrada in dias_en_rango(table, ini, fin, directorio).items():
+        ruta = os.path.join(raiz, entrada["archivo"])
+        try:
+            valido = (os.path.getsize(ruta) == entrada["bytes"] and checksum(ruta) == entrada["sha256"]
+                      and pq.read_metadata(ruta).num_rows == entrada["filas"])
+        except (pa.ArrowException, OSError):
+            valido = False
+        if not valido:
+            print('Partición dañada, se descargará de nuevo: {}'.format(ruta))
+            if os.path.exists(ruta):
+                os.remove(ruta)
+            registrar_particion(table, day, directorio, None)
+            dañados.append(day)
+
+    return dañados
+
+
+## Bloques diarios en memoria
+# Por (directorio, tabla, día): (sha256, dataframe, bytes). Todos los rangos se arman con los mismos bloques, así que
+# los rangos que se solapan no duplican datos. Se desalojan los menos usados al pasar MEMORIA_BLOQUES_MB
+_bloques = OrderedDict()
+_bloques_lock = threading.Lock()
+_bloques_estadisticas = {"aciertos": 0, "fallos": 0, "desalojos": 0, "bytes": 0}
+
+
+def bloque_dia(table, day, directorio, entrada):
+    '''
+    Datos de la partición de un día, desde memoria si el bloque guardado corresponde al mismo checksum del manifiesto
+    o leyendo el archivo parquet. Lanza una excepción de pyarrow si el archivo está dañado\n
+    :param table: tabla de la base de datos
+    :param day: día en STR ("2021-04-28")
+    :param directorio: directorio donde se guardan los archivos
+    :param entrada: entrada del manifiesto del día
+
+    :return df: dataframe del día (compartido, no modificar)
+    '''
+    clave = (directorio, table, day)
+    with _bloques_lock:
+        guardado = _bloques.get(clave)
+        if guardado is not None and guardado[0] == entrada["sha256"]:
+            _bloques.move_to_end(clave)
+            _bloques_estadisticas["aciertos"] += 1
+            return guardado[1]
+        _bloques_estadisticas["fallos"] += 1
+
+    ruta = os.path.join(ruta_cache(directorio, table), entrada["archivo"])
+    df = ds.dataset(ruta, format="parquet", schema=ESQUEMA_CACHE).to_table(columns=COLUMNAS_DATOS).to_pandas()
+    tamaño = int(df.memory_usage(deep=True).sum())
+    limite = float(os.environ.get("MEMORIA_BLOQUES_MB", MEMORIA_BLOQUES_MB)) * 2**20
+
+    with _bloques_lock:
+        # Versión anterior del mismo día (por ejemplo un día que se completó con su marca de agua)
+        anterior = _bloques.pop(clave, None)
+        if anterior is not None:
+            _bloques_estadisticas["bytes"] -= anterior[2]
+        if tamaño <= limite:
+            _bloques[clave] = (entrada["sha256"], df, tamaño)
+            _bloques_estadisticas["bytes"] += tamaño
+            while _bloques_estadisticas["bytes"] > limite:
+                _, (_, _, liberado) = _bloques.popitem(last=False)
+                _bloques_estadisticas["bytes"] -= liberado
+                _bloques_estadisticas["desalojos"] += 1
 
     return df
 
 
+def estadisticas_bloques():
+    '''
+    Aciertos, fallos, desalojos, bytes ocupados y número de bloques diarios en memoria\n
+    :return estadisticas: diccionario con los contadores
+    '''
+    with _bloques_lock:
+        return dict(_bloques_estadisticas, bloques=len(_bloques))
+
+
+def leer_rango(table, ini, fin, directorio):
+    '''
+    Arma los datos de un rango con los bloques diarios de la cache columnar. Solo se abren los archivos de los días
+    del rango según el manifiesto que no estén ya en memoria\n
+    :param table: tabla de la base de datos
+    :param ini: día inicial en STR ("2021-12-28")
+    :param fin: día final en STR ("2022-01-01")
+    :param directorio: directorio donde se guardan los archivos
+
+    :return df: dataframe tipado y ordenado por fecha
+    '''
+    bloques = [bloque_dia(table, day, directorio, entrada)
+               for day, entrada in dias_en_rango(table, ini, fin, directorio).items()]
+    if len(bloques) == 0:
+        return tipar_datos(pd.DataFrame())
+
+    fecha_ini, _ = ventana_dia(ini)
+    _, fecha_fin = ventana_dia(fin)
+    df = pd.concat(bloques, ignore_index=True)
+    df = df[(df["fecha"] >= fecha_ini) & (df["fecha"] < fecha_fin)]
+
+    # Los días consecutivos comparten los registros de 6:00 a 6:10
+    return df.drop_duplicates().sort_values("fecha").reset_index(drop=True)
+
+
+def migrar_csv_dia(table, day, directorio, persistir=True):
+    '''
+    Pasa a la cache columnar el csv de un día descargado con la versión anterior, si existe\n
+    :param table: tabla de la base de datos
+    :param day: día en STR ("2021-04-28")
+    :param directorio: directorio donde se guardan los archivos
+    :param persistir: si es False el manifiesto y el resumen solo se actualizan en memoria (para migrar varios días
+    y guardar una sola vez con guardar_manifiesto)
+
+    :return: True si se encontró y migró el csv
+    '''
+    ruta_csv = directorio + day[:-3] + '/tabla_' + table + '_' + day + '.csv'
+    if not os.path.exists(ruta_csv):
+        return False
+
+    # Sin hora de descarga, el día se toma completo si los datos llegan hasta el cierre de la ventana
+    df = tipar_datos(pd.read_csv(ruta_csv))
+    final = len(df) > 0 and df["fecha"].max() >= ventana_dia(day)[1] - timedelta(minutes=MINUTOS_CIERRE)
+    guardar_particion(df, table, day, directorio, final=final, persistir=persistir)
+    return True
+
+
+def migrar_csv_a_parquet(directorio):
+    '''
+    Migración única de las carpetas <directorio>YYYY-MM con csv diarios a la cache columnar\n
+    :param directorio: directorio donde se guardan los archivos (mismo prefijo usado por find_load)
+
+    :return migrados: cantidad de días migrados
+    '''
+    migrados = 0
+    tablas = set()
+    for ruta_csv in sorted(glob.glob(directorio + '[0-9][0-9][0-9][0-9]-[0-9][0-9]/tabla_*.csv')):
+        coincidencia = PATRON_CSV.search(os.path.basename(ruta_csv))
+        if coincidencia is None:
+            continue
+        table, day = coincidencia.groups()
+        if estado_particion(table, day, directorio) is not None:
+            continue
+        migrar_csv_dia(table, day, directorio, persistir=False)
+        tablas.add(table)
+        migrados += 1
+
+    # El manifiesto y el resumen de cada tabla se escriben una sola vez al final
+    for table in sorted(tablas):
+        guardar_manifiesto(table, directorio)
+
+    print('Días migrados a la cache columnar: {}'.format(migrados))
+    return migrados
+
+# ----------------------------------------------------------------------------------------------------------------------
+## Resumen diario de la cache
+# Por tabla: {día: fila de resumen_por_dia}. Comparte el candado del manifiesto y se guarda junto con él
+_resumenes = {}
+# Por tabla: días del resumen que este proceso cambió desde la última escritura (como en _cambios_manifiesto)
+_cambios_resumen = {}
+
+
+def leer_resumen(table, directorio):
+    '''
+    Lee del disco el resumen diario de una tabla\n
+    :param table: tabla de la base de datos
+    :param directorio: directorio donde se guardan los archivos
+
+    :return filas: diccionario {día: fila}, vacío si no hay archivo o está dañado
+    '''
+    ruta = os.path.join(ruta_cache(directorio, table), RESUMEN)
+    if not os.path.exists(ruta):
+        return {}
+    try:
+        return {fila["dia"]: fila for fila in pq.read_table(ruta).to_pandas().to_dict("records")}
+    except (pa.ArrowException, OSError):
+        print('Resumen diario dañado, se recalculará: {}'.format(ruta))
+        return {}
+
+
+def cargar_resumen(table, directorio):
+    '''
+    Devuelve el resumen diario persistente de una tabla, leyendo el archivo la primera vez en el proceso\n
+    :param table: tabla de la base de datos
+    :param directorio: directorio donde se guardan los archivos
+
+    :return resumen: diccionario {día: fila} donde cada fila guarda también el sha256 de la partición resumida
+    '''
+    clave = (directorio, table)
+    with _manifiesto_lock:
+        if clave not in _resumenes:
+            _resumenes[clave] = leer_resumen(table, directorio)
+
+        return _resumenes[clave]
+
+
+def guardar_resumen(table, directorio):
+    '''
+    Escribe el resumen diario de una tabla en disco bajo el bloqueo de la tabla, si está cargado\n
+    :param table: tabla de la base de datos
+    :param directorio: directorio donde se guardan los archivos
+    '''
+    with _manifiesto_lock, bloqueo_archivo(ruta_bloqueo_manifiesto(directorio, table)):
+        escribir_resumen(table, directorio)
+
+
+def escribir_resumen(table, directorio):
+    '''
+    Fusiona el resumen diario en memoria con el del disco y lo escribe (archivo temporal + renombrar). Los días que
+    cambió este proceso se toman de memoria y el resto del disco. Se llama con el candado del manifiesto y el bloqueo
+    de la tabla tomados\n
+    :param table: tabla de la base de datos
+    :param directorio: directorio donde se guardan los archivos
+    '''
+    clave = (directorio, table)
+    filas = _resumenes.get(clave)
+    if filas is None:
+        return
+    cambios = _cambios_resumen.pop(clave, set())
+    fusion = {day: fila for day, fila in leer_resumen(table, directorio).items() if day not in cambios}
+    fusion.update({day: filas[day] for day in cambios if day in filas})
+    filas.clear()
+    filas.update(fusion)
+
+    ruta = os.path.join(ruta_cache(directorio, table), RESUMEN)
+    df = pd.DataFrame([filas[day] for day in sorted(filas)])
+    temporal = ruta_temporal(ruta)
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), temporal)
+    os.replace(temporal, ruta)
+
+
+def registrar_resumen(table, directorio, resumen, sha256s):
+    '''
+    Agrega o reemplaza en memoria las filas de resumen de algunos días\n
+    :param table: tabla de la base de datos
+    :param directorio: directorio donde se guardan los archivos
+    :param resumen: dataframe de resumen_por_dia
+    :param sha256s: diccionario {día: sha256 de la partición de la que sale la fila}; los días que no están en
+    resumen quedan con una fila vacía (filas=0)
+    '''
+    # Partición sin registros del día: fila explícita con filas=0, así el día cuenta como resumido
+    vacios = [day for day in sha256s if pd.Timestamp(day) not in resumen.index]
+    if vacios:
+        resumen = pd.concat([resumen, resumen_vacio(vacios)]) if not resumen.empty else resumen_vacio(vacios)
+    with _manifiesto_lock:
+        filas = cargar_resumen(table, directorio)
+        _cambios_resumen.setdefault((directorio, table), set()).update(sha256s)
+        for day, sha256 in sha256s.items():
+            filas[day] = dict(resumen.loc[pd.Timestamp(day)].to_dict(), dia=day, sha256=sha256)
+
+
+def resumen_rango(table, ini, fin, directorio):
+    '''
+    Filas del resumen diario de los días completos (final) de la cache dentro de un rango. Las particiones que no
+    tienen fila o cuya fila corresponde a otro checksum se resumen de nuevo leyendo solo esos archivos\n
+    :param table: tabla de la base de datos
+    :param ini: día inicial en STR
+    :param fin: día final en STR
+    :param directorio: directorio donde se guardan los archivos
+
+    :return resumen: dataframe indexado por día (datetime64) con las columnas de resumen_por_dia
+    '''
+    entradas = {day: entrada for day, entrada in dias_en_rango(table, ini, fin, directorio).items() if entrada["final"]}
+    with _manifiesto_lock:
+        filas = cargar_resumen(table, directorio)
+        pendientes = {day: entrada["sha256"] for day, entrada in entradas.items()
+                      if filas.get(day, {}).get("sha256") != entrada["sha256"]}
+
+    if pendientes:
+        raiz = ruta_cache(directorio, table)
+        archivos = [os.path.join(raiz, entradas[day]["archivo"]) for day in pendientes]
+        crudos = ds.dataset(archivos, format="parquet", schema=ESQUEMA_CACHE).to_table(columns=COLUMNAS_DATOS)
+        registrar_resumen(table, directorio, resumen_por_dia(crudos.to_pandas().drop_duplicates()), pendientes)
+        guardar_resumen(table, directorio)
+
+    with _manifiesto_lock:
+        resumen = pd.DataFrame([filas[day] for day in entradas if day in filas])
+
+    if resumen.empty:
+        return resumen
+    resumen.index = pd.DatetimeIndex(pd.to_datetime(resumen.pop("dia")), name="dia")
+    return resumen.drop(columns="sha256")
+
+# ----------------------------------------------------------------------------------------------------------------------
+## SQL
 def add_day(day, add=1):
     """
     Función agrega o quita dias, teniendo en cuenta inicio de mes e inicio de año\n
@@ -232,189 +911,847 @@ def add_day(day, add=1):
     return str(ini_date), str(fin_date)
 
 
-def descarga_necesaria(filename, filenames,redownload):
-    return (filename in filenames and redownload is False)
+def agrupar_dias(dias):
+    """
+    Agrupa una lista de días en tramos de días consecutivos\n
+    :param dias: lista de días en STR ("2021-04-28")
+
+    :return tramos: lista de tuplas (día inicial, día final) en STR
+    """
+    if len(dias) == 0:
+        return []
+
+    fechas = pd.Series(pd.to_datetime(sorted(dias)))
+    grupo = (fechas.diff() != pd.Timedelta(days=1)).cumsum()
+    tramos = fechas.groupby(grupo).agg(["min", "max"])
+
+    return [(str(a.date()), str(b.date())) for a, b in zip(tramos["min"], tramos["max"])]
+
+
+def separar_dias(df, ini, fin):
+    """
+    Divide los datos de un tramo en los datos de cada día de producción. Los registros de 6:00 a 6:10 quedan en los
+    dos días, igual que al descargar día por día\n
+    :param df: dataframe tipado y ordenado por fecha
+    :param ini: día inicial del tramo en STR
+    :param fin: día final del tramo en STR
+
+    :return dias: diccionario {día: dataframe}
+    """
+    fechas = df["fecha"].to_numpy()
+    dias = {}
+    for day in pd.date_range(ini, fin).strftime("%Y-%m-%d"):
+        ini_dia, fin_dia = ventana_dia(day)
+        a, b = np.searchsorted(fechas, [np.datetime64(ini_dia), np.datetime64(fin_dia)], side="left")
+        dias[day] = df.iloc[a:b]
+
+    return dias
 
 
 # No poner cache en esta función para poder cargar los ultimos datos del día.
 def find_load(tipo, ini, fin, table, redownload, directorio):
     """
-    Función que busca y carga el archivo de datos si este ya ha sido descargado. En caso contrario lo descarga a través
-    de la función sql_connet\n
-    mejoras futuras: quitar tipo, ini = 0 if ini = 0 . ini = day.
+    Función que busca y carga los datos desde la cache columnar si ya han sido descargados. El manifiesto de la tabla
+    indica qué días faltan: se agrupan en tramos consecutivos y cada tramo se descarga con una sola consulta a través
+    de la función sql_connect_rango. Los días guardados antes del cierre de su ventana (por ejemplo el día actual) o
+    vacíos sin cerrar solo descargan los registros posteriores a su marca de agua con sql_connect_delta. Si alguna
+    partición está dañada se descarga de nuevo\n
     :param tipo: ["day_planta", "rango_planta"].
     :param ini: día inicial o unico día a analizar en el rango como STR ("2021-12-28").
     :param fin: día final a analizar como STR ("2022-01-01").
-    :param database: base de dato a la cual se debe conectar.
     :param table: tabla a la cual se debe conectar.
     :param redownload: TRUE or FALSE statement si es TRUE se omite la parte de buscar el archivo y se descarga nuevamente.
     :param directorio: directorio donde se guardan los archivos.
     
     :return pd_sql: dataframe con los datos buscados o descargados
     """
-    # Setting the folder where to search
-    directory = directorio + ini[:-3] + '/'
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-    filenames = os.listdir(directory)
+    if tipo == "day_planta":
+        fin = ini
 
-    # Crear el nombre del archivo
-    filename = 'tabla_' + table + '_' + ini + '.csv'
+    if redownload:
+        faltantes, parciales = list(pd.date_range(ini, fin).strftime("%Y-%m-%d")), list()
+    else:
+        faltantes, parciales = planificar_rango(table, ini, fin, directorio)
+        # Los csv de la versión anterior se pasan a la cache antes de planificar
+        if [day for day in faltantes if migrar_csv_dia(table, day, directorio, persistir=False)]:
+            guardar_manifiesto(table, directorio)
+            faltantes, parciales = planificar_rango(table, ini, fin, directorio)
 
-    if tipo == "day_planta":
-        # Añadir print para depuración
-        print(f"Debug - Filename: {filename}")
-        print(f"Debug - Filenames en directorio: {filenames}")
-        print(f"Debug - Descarga necesaria: {descarga_necesaria(filename, filenames, redownload)}")
-
-        if descarga_necesaria(filename, filenames, redownload):
-            pd_sql = load_data(folder=directory, filename=filename)
-            print(f"Debug - Datos cargados desde archivo: {len(pd_sql)}")
+    completar_cache(table, faltantes, parciales, directorio)
+
+    try:
+        pd_sql = leer_rango(table, ini, fin, directorio)
+    except (pa.ArrowException, OSError):
+        # Alguna partición está dañada: se descartan los días dañados y se descargan de nuevo
+        completar_cache(table, verificar_particiones(table, ini, fin, directorio), [], directorio)
+        pd_sql = leer_rango(table, ini, fin, directorio)
+
+    if len(pd_sql) == 0:
+        print(f"Advertencia: No se encontraron datos para {table} entre {ini} y {fin}")
+
+    return pd_sql
+
+
+## Descargas en vuelo
+# Un candado por (directorio, tabla, día) para que un solo hilo descargue cada día; los demás esperan su resultado.
+# Cada entrada guarda [candado, usos] y se elimina cuando ningún hilo la usa.
+# Entre procesos se usa además un archivo de bloqueo por tabla y mes en la carpeta BLOQUEOS de la cache
+_vuelos = {}
+_vuelos_lock = threading.Lock()
+
+
+@contextmanager
+def bloqueo_archivo(ruta, esperar=True):
+    '''
+    Bloqueo exclusivo de un archivo entre procesos (fcntl en Linux, msvcrt en Windows)\n
+    :param ruta: ruta del archivo de bloqueo (se crea si no existe)
+    :param esperar: si es False y el archivo ya está bloqueado se entrega False en lugar de esperar
+
+    :return: True si se obtuvo el bloqueo
+    '''
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    with open(ruta, 'a+') as archivo:
+        obtenido = False
+        try:
+            while not obtenido:
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(archivo, fcntl.LOCK_EX | (0 if esperar else fcntl.LOCK_NB))
+                    else:
+                        archivo.seek(0)
+                        msvcrt.locking(archivo.fileno(), msvcrt.LK_LOCK if esperar else msvcrt.LK_NBLCK, 1)
+                    obtenido = True
+                except OSError:
+                    # msvcrt.LK_LOCK se rinde después de 10 s: se sigue esperando
+                    if not esperar:
+                        break
+            yield obtenido
+        finally:
+            if obtenido:
+                if fcntl is not None:
+                    fcntl.flock(archivo, fcntl.LOCK_UN)
+                else:
+                    archivo.seek(0)
+                    msvcrt.locking(archivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _tomar_vuelo(clave):
+    '''
+    Entrega el candado de una descarga en vuelo y suma un uso a su entrada\n
+    :param clave: tupla (directorio, tabla, día)
+
+    :return candado: threading.Lock del día
+    '''
+    with _vuelos_lock:
+        vuelo = _vuelos.setdefault(clave, [threading.Lock(), 0])
+        vuelo[1] += 1
+        return vuelo[0]
+
+
+def _soltar_vuelo(clave):
+    '''
+    Resta un uso a la entrada de una descarga en vuelo y la elimina cuando ya nadie la usa\n
+    :param clave: tupla (directorio, tabla, día)
+    '''
+    with _vuelos_lock:
+        vuelo = _vuelos[clave]
+        vuelo[1] -= 1
+        if vuelo[1] == 0:
+            del _vuelos[clave]
+
+
+@contextmanager
+def vuelo_dias(table, dias, directorio):
+    '''
+    Reserva la descarga de unos días de una tabla en este proceso y entre procesos. Primero se toman los candados
+    de los días y después los archivos de bloqueo de sus meses, ambos en orden, para que dos descargas con días
+    en común no se bloqueen entre sí\n
+    :param table: tabla de la base de datos
+    :param dias: lista de días en STR
+    :param directorio: directorio donde se guardan los archivos
+
+    :return esperado: True si algún día lo estaba descargando otro hilo u otro proceso
+    '''
+    esperado = False
+    dias = sorted(set(dias))
+    with ExitStack() as pila:
+        for day in dias:
+            clave = (directorio, table, day)
+            candado = _tomar_vuelo(clave)
+            pila.callback(_soltar_vuelo, clave)
+            if not candado.acquire(blocking=False):
+                esperado = True
+                candado.acquire()
+            pila.callback(candado.release)
+
+        # Un solo archivo por mes: la carpeta de bloqueos no crece con cada día descargado
+        for mes in sorted({day[:7] for day in dias}):
+            ruta = os.path.join(ruta_cache(directorio, table), BLOQUEOS, table + '_' + mes + '.lock')
+            if not pila.enter_context(bloqueo_archivo(ruta, esperar=False)):
+                esperado = True
+                pila.enter_context(bloqueo_archivo(ruta))
+
+        if esperado:
+            _sumar_estadistica("descargas_esperadas")
+        yield esperado
+
+
+def sincronizar_particiones(table, dias, directorio):
+    '''
+    Registra en el manifiesto de este proceso las particiones que otro proceso guardó o actualizó en disco\n
+    :param table: tabla de la base de datos
+    :param dias: lista de días en STR
+    :param directorio: directorio donde se guardan los archivos
+    '''
+    raiz = ruta_cache(directorio, table)
+    cambios = False
+    for day in dias:
+        ruta = ruta_particion(directorio, table, day)
+        if not os.path.exists(ruta):
+            continue
+        entrada = dias_en_rango(table, day, day, directorio).get(day)
+        if entrada is not None and entrada["bytes"] == os.path.getsize(ruta) and entrada["sha256"] == checksum(ruta):
+            continue
+        try:
+            registrar_particion(table, day, directorio, entrada_desde_archivo(ruta, raiz), persistir=False)
+            cambios = True
+        except (pa.ArrowException, OSError):
+            continue
+    if cambios:
+        guardar_manifiesto(table, directorio)
+
+
+def completar_cache(table, faltantes, parciales, directorio):
+    """
+    Descarga los días que faltan en la cache (un tramo de días consecutivos por consulta) y completa los días
+    incompletos desde su marca de agua. Cada día se descarga una sola vez aunque varias sesiones o procesos lo pidan
+    al mismo tiempo: los que llegan después esperan y usan lo que quedó en la cache\n
+    :param table: tabla a la cual se debe conectar
+    :param faltantes: lista de días en STR que no están en la cache
+    :param parciales: lista de (día, marca de agua) de los días incompletos
+    :param directorio: directorio donde se guardan los archivos
+    """
+    dias = list(faltantes) + [day for day, _ in parciales]
+    if len(dias) == 0:
+        return
+
+    with vuelo_dias(table, dias, directorio):
+        # Otro proceso pudo haber guardado estos días antes (mientras se esperaba o en cualquier momento después de
+        # leer el manifiesto): con los días ya reservados se revisa el disco y se planifica de nuevo
+        sincronizar_particiones(table, dias, directorio)
+        estados = {day: estado_particion(table, day, directorio) for day in dias}
+        faltantes = [day for day in faltantes if estados[day] is None]
+        parciales = [(day, estado["watermark"]) for day, estado in estados.items()
+                     if estado is not None and not estado["final"]]
+
+        for ini_tramo, fin_tramo in agrupar_dias(faltantes):
+            sql_connect_rango(ini=ini_tramo, fin=fin_tramo, table=table, directorio=directorio)
+
+        for day, watermark in parciales:
+            sql_connect_delta(day=day, table=table, directorio=directorio, watermark=watermark)
+
+
+def cargar_tablas(cargar, tablas, max_workers=MAX_HILOS_CARGA, timeout=None, vacio=None):
+    """
+    Carga varias tablas en paralelo con un pool de hilos acotado. Un medidor lento o con error no bloquea a los demás\n
+    :param cargar: función que recibe el nombre de la tabla y devuelve su dataframe
+    :param tablas: lista de tablas a cargar
+    :param max_workers: máximo de tablas descargando al mismo tiempo
+    :param timeout: segundos máximos de espera del lote, las tablas que no terminen a tiempo se reportan como error
+    :param vacio: función que arma el resultado de una tabla con error (por defecto un dataframe vacío tipado)
+
+    :return resultado: diccionario con "datos" {tabla: dataframe}, "tiempos" {tabla: segundos} de las que terminaron y
+    "errores" {tabla: mensaje}. Las tablas con error quedan con el resultado de vacio()
+    """
+    resultado = {"datos": {}, "tiempos": {}, "errores": {}}
+    # Los hilos que superan el tiempo límite siguen corriendo: anotan aquí y no en el resultado ya entregado
+    tiempos = {}
+
+    def _tarea(table):
+        inicio = time.perf_counter()
+        try:
+            return cargar(table)
+        finally:
+            tiempos[table] = time.perf_counter() - inicio
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tablas))))
+    futuros = {table: executor.submit(_tarea, table) for table in tablas}
+    wait(futuros.values(), timeout=timeout)
+    # No esperar a las tablas que superaron el tiempo límite
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for table, futuro in futuros.items():
+        if futuro.done() and table in tiempos:
+            resultado["tiempos"][table] = tiempos[table]
+        if not futuro.done():
+            resultado["errores"][table] = "Tiempo límite de {} s superado".format(timeout)
+        elif futuro.exception() is not None:
+            resultado["errores"][table] = repr(futuro.exception())
         else:
-            pd_sql = sql_connect(day=str(ini), table=table, directorio=directorio)
-            print(f"Debug - Datos de SQL: {len(pd_sql)}")
-
-        # Añadir verificación adicional
-        if len(pd_sql) == 0:
-            print(f"Advertencia: No se encontraron datos para {table} en {ini}")
-
-    elif tipo == "rango_planta":
-        # Fecha Inicial
-        l_day_n = [int(x) for x in ini.split("-")]
-        ini_date = datetime(l_day_n[0], l_day_n[1], l_day_n[2]).date()
-        # Fecha Final
-        l_day_n = [int(x) for x in fin.split("-")]
-        day_date = datetime(l_day_n[0], l_day_n[1], l_day_n[2]).date()
-
-        # Lista df
-        lista_concat = list()
-        # Recorro los días de ese periodo de tiempo
-        while ini_date <= day_date:
-            filename = 'tabla_' + table + '_' + str(ini_date) + '.csv'
-
-            if descarga_necesaria(filename, filenames,redownload):
-                aux = load_data(folder=directory, filename=filename)
-            else:
-                aux = sql_connect(day=str(ini_date), table=table, directorio=directorio)
+            resultado["datos"][table] = futuro.result()
+            continue
+        print('Error cargando la tabla {}: {}'.format(table, resultado["errores"][table]))
+        resultado["datos"][table] = vacio() if vacio is not None else tipar_datos(pd.DataFrame())
 
+    return resultado
 
-            lista_concat.append(aux)
-            # Avanzo un día
-            ini_date = ini_date + timedelta(days=1)
 
-        pd_sql = pd.concat(lista_concat)
+def find_load_lote(tipo, ini, fin, tables, redownload, directorio, max_workers=MAX_HILOS_CARGA, timeout=None):
+    """
+    Versión de find_load para varias tablas a la vez, cada tabla se busca o descarga en su propio hilo\n
+    :param tables: lista de tablas a cargar
+    :param max_workers: máximo de tablas descargando al mismo tiempo
+    :param timeout: segundos máximos de espera del lote
+    (los demás parámetros son los de find_load)
 
-    return pd_sql
+    :return resultado: diccionario de cargar_tablas con "datos", "tiempos" y "errores"
+    """
+    return cargar_tablas(lambda table: find_load(tipo, ini, fin, table, redownload, directorio),
+                         tables, max_workers=max_workers, timeout=timeout)
 
 
 def sql_connect(day, table, directorio):
     """
-    Programa que permite conectar con una base de dato del servidor y devuelve la base de dato como un pandas dataframe\n
-    :param tipo: ["day_planta", "day"]
+    Programa que permite conectar con una base de dato del servidor y devuelve los datos de un día como un pandas
+    dataframe\n
     :param day: Día a descargar en  STR ("2021-04-28")
     :param table: tabla a la cual se debe conectar
     :param directorio: directorio donde se guardan los archivos
     
     :return pd_sql: pandas dataframe traído de la base de dato SQL
     """
-    # Connection keys
-    server = 'db-prd-iotgirardota.database.windows.net'
-    username = 'Securityof'
-    password = 'vpiDvO3YBzy5KOyF7vOb'
-    database = 'iotgirardota'
+    if isinstance(day, datetime):
+        day = day.strftime("%Y-%m-%d")
 
-    # Connecting to the sql database
-    connection_str = "DRIVER={ODBC Driver 18 for SQL Server};SERVER=%s;DATABASE=%s;UID=%s;PWD=%s;Encrypt=no" % (server, database, username, password)
-    connection_url = URL.create("mssql+pyodbc", query={"odbc_connect": connection_str})
+    return sql_connect_rango(ini=day, fin=day, table=table, directorio=directorio)
+
+
+def sql_connect_rango(ini, fin, table, directorio):
+    """
+    Descarga con una sola consulta los datos de un tramo de días consecutivos y guarda cada día en su partición de la
+    cache columnar\n
+    :param ini: día inicial del tramo en STR ("2021-04-28")
+    :param fin: día final del tramo en STR ("2021-04-30")
+    :param table: tabla a la cual se debe conectar
+    :param directorio: directorio donde se guardan los archivos
 
-    conn = create_engine(connection_url)
-    # ------------------------------------------------------------------------------------------------------------------
+    :return pd_sql: pandas dataframe tipado con los datos del tramo
+    """
+    # Ventana desde las 6:00 del día inicial hasta las 6:10 del día siguiente al final
+    ini_con_hora, _ = ventana_dia(ini)
+    _, fin_con_hora = ventana_dia(fin)
+
+    print('Consultando tabla: {} del {} al {}...      '.format(table, ini, fin))
+    descargado = datetime.now()
+    pd_sql = consultar_ventana(table, ini_con_hora, fin_con_hora)
+    if pd_sql is None:
+        return tipar_datos(pd.DataFrame())
+
+    # Guardando los datos en la cache columnar, los días con la ventana abierta quedan pendientes de completar
+    resumen = resumen_por_dia(pd_sql)
+    for day, aux in separar_dias(pd_sql, ini, fin).items():
+        guardar_particion(aux, table, day, directorio, final=dia_cerrado(day, descargado), descargado=descargado,
+                          persistir=False, resumen=resumen)
+    guardar_manifiesto(table, directorio)
 
-    pd_sql = pd.DataFrame()
-    print('Consultando tabla: {}...      '.format(table))
+    return pd_sql
+
+
+def sql_connect_delta(day, table, directorio, watermark=None):
+    """
+    Completa un día guardado antes del cierre de su ventana descargando solo los registros posteriores a la marca de
+    agua y uniéndolos a los que ya están en la cache\n
+    :param day: día en STR ("2021-04-28")
+    :param table: tabla a la cual se debe conectar
+    :param directorio: directorio donde se guardan los archivos
+    :param watermark: última fecha guardada del día (None si el día está vacío)
+
+    :return pd_sql: pandas dataframe tipado con los registros nuevos (el día completo si la partición no se pudo leer)
+    """
+    ini_con_hora, fin_con_hora = ventana_dia(day)
+
+    # Si la partición se borró o quedó corrupta no hay sobre qué unir el delta: se descarga el día completo
     try:
-        # Execute the query
-        with conn.begin() as connection:
-            ini = day
-            if isinstance(ini, datetime):
-                ini = ini.strftime("%Y-%m-%d")
+        guardado = pq.read_table(ruta_particion(directorio, table, day), columns=COLUMNAS_DATOS).to_pandas()
+    except (pa.ArrowException, OSError):
+        print('Partición ilegible: {} del {}, se descarga el día completo'.format(table, day))
+        return sql_connect_rango(ini=day, fin=day, table=table, directorio=directorio)
 
-            ini_dt = datetime.strptime(ini, "%Y-%m-%d")  # Convierte a datetime
+    print('Actualizando tabla: {} del {} desde {}...      '.format(table, day, watermark))
+    descargado = datetime.now()
+    pd_sql = consultar_ventana(table, ini_con_hora, fin_con_hora, watermark=watermark)
+    if pd_sql is None:
+        return tipar_datos(pd.DataFrame())
 
-            # Explícitamente configuramos las horas para 6am
-            ini_con_hora = ini_dt.replace(hour=6, minute=0,second=0)
-            fin_con_hora = (ini_dt + timedelta(days=1)).replace(hour=6, minute=10,second=0)
+    aux = pd.concat([guardado, pd_sql], ignore_index=True).drop_duplicates().sort_values("fecha", kind="stable")
+    guardar_particion(aux, table, day, directorio, final=dia_cerrado(day, descargado), descargado=descargado)
 
-            # Asegúrate de formatear con la hora incluida
-            ini_completo = ini_con_hora.strftime("%Y-%m-%d %H:%M:%S")
-            fin_completo = fin_con_hora.strftime("%Y-%m-%d %H:%M:%S")
+    return pd_sql
 
-            # Usa directamente las variables en la consulta
-            consulta = "SELECT * FROM {}.dbo.{} WHERE fecha >= '{}' AND fecha < '{}'".format(
-                database, table, ini_completo, fin_completo
-            )
 
-            # Para verificar la consulta (puedes imprimir esto para depuración)
-            pd_sql = pd.read_sql_query(consulta, connection)
+def consultar_ventana(table, ini, fin, watermark=None):
+    """
+    Consulta los registros de una tabla entre dos fechas\n
+    :param table: tabla a la cual se debe conectar
+    :param ini: datetime inicial (incluido)
+    :param fin: datetime final (excluido)
+    :param watermark: si se entrega, solo se traen los registros con fecha posterior
+
+    :return pd_sql: pandas dataframe tipado y ordenado por fecha, None si la consulta falló
+    """
+    condicion = "fecha >= :ini AND fecha < :fin"
+    parametros = {"ini": ini.strftime("%Y-%m-%d %H:%M:%S"),
+                  "fin": fin.strftime("%Y-%m-%d %H:%M:%S")}
+    if watermark is not None:
+        condicion += " AND fecha > :watermark"
+        parametros["watermark"] = pd.Timestamp(watermark).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+    try:
+        with conexion_sql() as connection:
+            consulta = text("SELECT * FROM {} WHERE {}".format(tabla_sql(connection.engine, table), condicion))
+            pd_sql = pd.read_sql_query(consulta, connection, params=parametros)
+
+    except (exc.TimeoutError, exc.OperationalError, pyodbc.OperationalError):
+        print("La consulta ha superado el tiempo límite.")
+        return None
 
+    return tipar_datos(pd_sql).sort_values("fecha", kind="stable").reset_index(drop=True)
+
+def expresiones_sql(dialecto, minutos_inicio):
+    """
+    Expresiones SQL que dependen del motor: día de producción, minuto dentro del día de producción y conversión de
+    los canales a número (algunos registros llegan con coma decimal)\n
+    :param dialecto: nombre del dialecto de SQLAlchemy ("mssql", "sqlite", ...)
+    :param minutos_inicio: minutos después de la medianoche en que empieza el día de producción
 
+    :return expresiones: diccionario con "dia", "minuto" y "numero" (plantilla con {col})
+    """
+    if dialecto == "mssql":
+        desplazada = "DATEADD(minute, -{}, fecha)".format(minutos_inicio)
+        return {
+            "dia": "CAST({} AS date)".format(desplazada),
+            "minuto": "(DATEPART(hour, {0}) * 60 + DATEPART(minute, {0}))".format(desplazada),
+            "numero": "COALESCE(TRY_CAST({col} AS float), TRY_CAST(REPLACE({col}, ',', '.') AS float))",
+        }
+
+    desplazada = "datetime(fecha, '-{} minutes')".format(minutos_inicio)
+    return {
+        "dia": "date({})".format(desplazada),
+        "minuto": "(CAST(strftime('%H', {0}) AS INTEGER) * 60 + CAST(strftime('%M', {0}) AS INTEGER))".format(desplazada),
+        "numero": "CAST(REPLACE({col}, ',', '.') AS REAL)",
+    }
+
+
+def sql_agregado(table, ini, fin, minutos_inicio=HORA_INICIO_DIA * 60):
+    """
+    Calcula en la base de datos el resumen diario de los días que no están en la cache, sin traer los registros
+    crudos. La consulta agrupa por día de producción y franja de 30 minutos y las filas se arman con
+    resumen_desde_celdas, así el resultado tiene el mismo formato que resumen_por_dia y se trata igual que el resumen
+    de la cache (normalización del contador incluida)\n
+    :param table: tabla a la cual se debe conectar
+    :param ini: día inicial en STR ("2021-04-28")
+    :param fin: día final en STR ("2021-06-30")
+    :param minutos_inicio: minutos después de la medianoche en que empieza el día de producción (360 = 6:00)
 
+    :return resumen: dataframe indexado por día con las columnas de resumen_por_dia, None si la consulta falló
+    """
+    # La ventana incluye las horas del último día de producción hasta el inicio del día siguiente
+    ini_con_hora = pd.Timestamp(ini) + pd.Timedelta(minutes=minutos_inicio)
+    fin_con_hora = pd.Timestamp(fin) + pd.Timedelta(days=1, minutes=minutos_inicio)
+    parametros = {"ini": ini_con_hora.strftime("%Y-%m-%d %H:%M:%S"),
+                  "fin": fin_con_hora.strftime("%Y-%m-%d %H:%M:%S")}
 
-    except (exc.TimeoutError, pyodbc.OperationalError):
+    print('Consultando resumen de la tabla: {} del {} al {}...      '.format(table, ini, fin))
+    try:
+        with conexion_sql() as connection:
+            expresion = expresiones_sql(connection.engine.dialect.name, minutos_inicio)
+            numero = lambda columna: expresion["numero"].format(col=columna)
+            canales = ",\n".join(
+                "MIN(NULLIF({0}, 0)) AS {0}_min, MAX(NULLIF({0}, 0)) AS {0}_max, "
+                "SUM(NULLIF({0}, 0)) AS {0}_suma, COUNT(NULLIF({0}, 0)) AS {0}_n".format(canal)
+                for canal in CANALES_RESUMEN)
+            consulta = """
+                WITH base AS (
+                    SELECT {dia} AS dia, {minuto} / 30 AS franja, fecha, {vol} AS vol, {presion} AS presion,
+                           {temperatura} AS temperatura, {flujo} AS flujo_corregido
+                    FROM {tabla} WHERE fecha >= :ini AND fecha < :fin
+                ),
+                volumen AS (
+                    SELECT dia, franja,
+                           FIRST_VALUE(vol) OVER (PARTITION BY dia, franja ORDER BY fecha) AS primero,
+                           FIRST_VALUE(vol) OVER (PARTITION BY dia, franja ORDER BY fecha DESC) AS ultimo,
+                           vol - LAG(vol) OVER (PARTITION BY dia ORDER BY fecha) AS diferencia
+                    FROM base WHERE vol <> 0
+                ),
+                celdas_volumen AS (
+                    SELECT dia, franja, MAX(primero) AS primero, MAX(ultimo) AS ultimo,
+                           SUM(diferencia) AS suma_dif, COUNT(diferencia) AS n_dif
+                    FROM volumen GROUP BY dia, franja
+                ),
+                celdas AS (
+                    SELECT dia, franja, COUNT(*) AS filas, MIN(fecha) AS fecha_min, MAX(fecha) AS fecha_max,
+                           {canales}
+                    FROM base GROUP BY dia, franja
+                )
+                SELECT c.*, v.primero, v.ultimo, v.suma_dif, v.n_dif
+                FROM celdas c LEFT JOIN celdas_volumen v ON v.dia = c.dia AND v.franja = c.franja
+                ORDER BY c.dia, c.franja
+            """.format(dia=expresion["dia"], minuto=expresion["minuto"], tabla=tabla_sql(connection.engine, table),
+                       vol=numero("vol_corregido"), presion=numero("presion"), temperatura=numero("temperatura"),
+                       flujo=numero("flujo_corregido"), canales=canales)
+            pd_sql = pd.read_sql_query(text(consulta), connection, params=parametros)
+
+    except (exc.TimeoutError, exc.OperationalError, pyodbc.OperationalError):
         print("La consulta ha superado el tiempo límite.")
-    finally:
-        conn.dispose()  # Close the connection
-
-    # Guardando los datos en archivos estaticos, # No guardar datos si el día seleccionado es el día actual del sistema
-    if day != str(datetime.today().date()):
-        # Checking and creating the folder
-        folder = day[:-3]
-        if not os.path.exists(directorio + folder):
-            os.makedirs(directorio + folder)
-        # Saving the raw data
-        pd_sql.to_csv(directorio + folder + '/tabla_' + table + '_' + day + '.csv', index=False)
+        return None
 
-    return pd_sql
+    return resumen_desde_celdas(pd_sql)
 
-def save_log():
+
+## Resúmenes de días sin descargar
+# Por (tabla, día): fila de sql_agregado de un día cuya ventana ya había cerrado al consultarlo (también los días sin
+# registros). Esos días no cambian, así que los rangos que se solapan no los vuelven a resumir en la base de datos
+_resumenes_sql = OrderedDict()
+_resumenes_sql_lock = threading.Lock()
+
+
+def resumen_sql(table, dias):
     '''
-    Función para guardar los logs de los usuarios que ingresan al sistema
+    Resumen diario de días que no están en la cache. Los días cerrados salen de memoria si ya se resumieron antes y los
+    demás se resumen con sql_agregado, un tramo consecutivo por consulta\n
+    :param table: tabla de la base de datos
+    :param dias: lista de días en STR
+
+    :return resumen: dataframe indexado por día con las columnas de resumen_por_dia (puede venir vacío)
     '''
-    day = str(datetime.date.today())
-    hora = str(datetime.datetime.now().time())
-    user = st.session_state.user_state['email']
-    
-    # Connection keys 
+    with _resumenes_sql_lock:
+        guardados = [_resumenes_sql[(table, day)] for day in dias if (table, day) in _resumenes_sql]
+        for fila in guardados:
+            _resumenes_sql.move_to_end((table, fila.index[0].strftime("%Y-%m-%d")))
+    faltantes = [day for day in dias if (table, day) not in _resumenes_sql]
+
+    partes = list(guardados)
+    for ini, fin in agrupar_dias(faltantes):
+        consultado = datetime.now()
+        resumen = sql_agregado(table, ini, fin)
+        if resumen is None:
+            continue
+
+        cerrados = pd.DatetimeIndex([day for day in pd.date_range(ini, fin).strftime("%Y-%m-%d")
+                                     if dia_cerrado(day, consultado)])
+        vacios = cerrados.difference(resumen.index)
+        if len(vacios):
+            resumen = resumen_vacio(vacios) if resumen.empty else pd.concat([resumen, resumen_vacio(vacios)]).sort_index()
+        partes.append(resumen)
+
+        with _resumenes_sql_lock:
+            for dia in cerrados:
+                _resumenes_sql[(table, dia.strftime("%Y-%m-%d"))] = resumen.loc[[dia]]
+            while len(_resumenes_sql) > MAX_DIAS_RESUMEN_SQL:
+                _resumenes_sql.popitem(last=False)
+
+    partes = [parte for parte in partes if not parte.empty]
+    return pd.concat(partes).sort_index() if partes else pd.DataFrame()
+
+
+def franjas_desde_resumen(resumen, columna, franja_inicio, arreglo=None):
+    '''
+    Arreglo (días x franjas) de una columna por franja del resumen con los días empezando en otra franja: cada fila
+    son las franjas desde franja_inicio de un día y las anteriores del día siguiente. Si el día siguiente no está en
+    el resumen (no tiene registros) sus franjas quedan vacías\n
+    :param resumen: dataframe de resumen_rango
+    :param columna: columna por franja ("primeros", "ultimos", "filas_franja", "suma_dif" o "n_dif")
+    :param franja_inicio: franja en que empieza el día (0 = 6:00, 1 = 6:30, ...)
+    :param arreglo: arreglo (días x franjas) ya armado para usar en lugar de la columna
+
+    :return dias: DatetimeIndex con los días del resumen
+    :return arreglo: arreglo (días x franjas)
+    '''
+    arreglo = np.stack(resumen[columna].to_numpy()).astype(float) if arreglo is None else arreglo
+    if franja_inicio == 0:
+        return resumen.index, arreglo
+
+    siguiente = resumen.index.get_indexer(resumen.index + pd.Timedelta(days=1))
+    vacio = np.full(arreglo.shape[1], np.nan if columna in ("primeros", "ultimos") else 0.0)
+    cola = np.vstack([arreglo, vacio])[siguiente, :franja_inicio]
+    return resumen.index, np.concatenate([arreglo[:, franja_inicio:], cola], axis=1)
+
+
+def agregado_desde_resumen(resumen, modo="diario", minutos_inicio=HORA_INICIO_DIA * 60):
+    '''
+    Arma desde el resumen diario (de la cache o de sql_agregado) los resúmenes que usa el tablero en rangos largos,
+    sin leer registros crudos\n
+    :param resumen: dataframe de resumen_rango o sql_agregado, ya normalizado con normalizar_resumen
+    :param modo: "diario": por día de producción filas, fecha_min, fecha_max, primer y último vol_corregido distinto
+    de cero, presión y temperatura medias. "media_hora": por día y franja de 30 minutos la suma y cantidad de las
+    diferencias de vol_corregido. "ocupacion": por día y franja con registros la cantidad de registros
+    :param minutos_inicio: minutos después de la medianoche en que empieza el día de producción (múltiplo de 30)
+
+    :return df: dataframe con una fila por día (o por día y franja)
+    '''
+    if resumen.empty:
+        return pd.DataFrame()
+
+    franja_inicio = (minutos_inicio - HORA_INICIO_DIA * 60) // 30
+    dias, primeros = franjas_desde_resumen(resumen, "primeros", franja_inicio)
+
+    if modo == "diario":
+        _, ultimos = franjas_desde_resumen(resumen, "ultimos", franja_inicio)
+        _, filas = franjas_desde_resumen(resumen, "filas_franja", franja_inicio)
+        primero, ultimo = extremos_franjas(primeros, ultimos)
+        df = pd.DataFrame({"dia": dias, "filas": filas.sum(axis=1).astype(int), "vol_primero": primero,
+                           "vol_ultimo": ultimo})
+        if franja_inicio == 0:
+            df["fecha_min"] = resumen["fecha_min"].to_numpy()
+            df["fecha_max"] = resumen["fecha_max"].to_numpy()
+            df["presion"] = resumen["presion_media"].to_numpy()
+            df["temperatura"] = resumen["temperatura_media"].to_numpy()
+        return df
+
+    elif modo == "media_hora":
+        # La diferencia entre el último registro de un día y el primero del siguiente va a la franja de ese primero
+        suma = np.stack(resumen["suma_dif"].to_numpy()).astype(float)
+        n = np.stack(resumen["n_dif"].to_numpy()).astype(float)
+        anterior = resumen.index.get_indexer(resumen.index - pd.Timedelta(days=1))
+        cruce = resumen["vol_primero"].to_numpy() - resumen["vol_ultimo"].to_numpy()[anterior]
+        cruce = np.where(anterior >= 0, cruce, np.nan)
+        filas_cruce = np.flatnonzero(~np.isnan(cruce))
+        franja_cruce = np.argmax(~np.isnan(primeros[filas_cruce]), axis=1)
+        suma[filas_cruce, franja_cruce] += cruce[filas_cruce]
+        n[filas_cruce, franja_cruce] += 1
+
+        _, suma = franjas_desde_resumen(resumen, "suma_dif", franja_inicio, suma)
+        _, n = franjas_desde_resumen(resumen, "n_dif", franja_inicio, n)
+        df = pd.DataFrame({"dia": np.repeat(dias, suma.shape[1]), "franja": np.tile(np.arange(suma.shape[1]), len(dias)),
+                           "suma": suma.ravel(), "n": n.ravel().astype(int)})
+        return df[df["n"] > 0].reset_index(drop=True)
+
+    elif modo == "ocupacion":
+        _, filas = franjas_desde_resumen(resumen, "filas_franja", franja_inicio)
+        df = pd.DataFrame({"dia": np.repeat(dias, filas.shape[1]), "franja": np.tile(np.arange(filas.shape[1]), len(dias)),
+                           "filas": filas.ravel().astype(int)})
+        return df[df["filas"] > 0].reset_index(drop=True)
+
+    raise ValueError("Modo de resumen desconocido: {}".format(modo))
+
+
+def agregados_tabla(table, ini, fin, directorio, consultas=(("diario", "diario", HORA_INICIO_DIA * 60 + 30),
+                                                          ("diario_6", "diario", HORA_INICIO_DIA * 60),
+                                                          ("media_hora", "media_hora", HORA_INICIO_DIA * 60),
+                                                          ("ocupacion", "ocupacion", HORA_INICIO_DIA * 60))):
+    '''
+    Resúmenes de una tabla para rangos largos. Los días completos que ya están en la cache salen del resumen diario
+    persistente; los demás salen de resumen_sql (de memoria o resumidos en la base de datos). Los reinicios y saltos
+    del contador se corrigen sobre el resumen con normalizar_resumen, igual que en el modo de registros crudos\n
+    :param table: tabla de la base de datos
+    :param ini: día inicial en STR
+    :param fin: día final en STR
+    :param directorio: directorio donde se guardan los archivos
+    :param consultas: tuplas (clave, modo, minutos_inicio) de los resúmenes a armar
+
+    :return agregados: diccionario {clave: dataframe de agregado_desde_resumen} y "correcciones" (dataframe de
+    normalizar_resumen)
+    '''
+    # El día siguiente al final hace falta para los días que empiezan después de las 6:00
+    fin_siguiente = add_day(fin)[1]
+    resumen = resumen_rango(table, ini, fin_siguiente, directorio)
+    faltantes = pd.date_range(ini, fin_siguiente).difference(resumen.index).strftime("%Y-%m-%d")
+    partes = [parte for parte in (resumen, resumen_sql(table, list(faltantes))) if not parte.empty]
+    resumen, correcciones = normalizar_resumen(pd.concat(partes) if partes else resumen)
+    dias_rango = pd.date_range(ini, fin)
+
+    fin_rango = pd.Timestamp(fin_siguiente) + pd.Timedelta(hours=HORA_INICIO_DIA)
+    agregados = {"correcciones": correcciones[correcciones["fecha"] < fin_rango].reset_index(drop=True)}
+    for clave, modo, minutos_inicio in consultas:
+        df = agregado_desde_resumen(resumen, modo, minutos_inicio)
+        agregados[clave] = df[df["dia"].isin(dias_rango)].reset_index(drop=True) if not df.empty else df
+
+    return agregados
+
+# ----------------------------------------------------------------------------------------------------------------------
+## Engine SQL compartido
+_engine = None
+_engine_lock = threading.Lock()
+_estadisticas_lock = threading.Lock()
+_estadisticas = {}
+
+
+def url_conexion():
+    """
+    Arma la URL de conexión con las credenciales de las variables de entorno\n
+    :return url: URL de SQLAlchemy
+    """
+    if os.environ.get("SQL_URL"):
+        return make_url(os.environ["SQL_URL"])
+
     server = os.environ.get("SERVER")
     username = os.environ.get("USER_SQL")
     password = os.environ.get("PASSWORD")
     database = os.environ.get("DATABASE")
 
-    # Connecting to the sql database
     connection_str = "DRIVER={ODBC Driver 18 for SQL Server};SERVER=%s;DATABASE=%s;UID=%s;PWD=%s;Encrypt=no" % (server, database, username, password)
-    connection_url = URL.create("mssql+pyodbc", query={"odbc_connect": connection_str})
+    return URL.create("mssql+pyodbc", query={"odbc_connect": connection_str})
+
+
+def _sumar_estadistica(nombre, valor=1):
+    with _estadisticas_lock:
+        _estadisticas[nombre] = _estadisticas.get(nombre, 0) + valor
+
+
+def _maximo_estadistica(nombre, valor):
+    with _estadisticas_lock:
+        _estadisticas[nombre] = max(_estadisticas.get(nombre, 0), valor)
+
+
+def crear_engine(url):
+    """
+    Crea un engine con pool de conexiones y registra los eventos para las estadísticas del pool.
+    El tamaño del pool, el reciclaje y el tiempo límite de consulta se pueden cambiar con las variables de entorno
+    SQL_POOL_SIZE, SQL_MAX_OVERFLOW, SQL_POOL_RECYCLE y SQL_TIMEOUT\n
+    :param url: URL de SQLAlchemy o STR
+
+    :return engine: engine de SQLAlchemy
+    """
+    url = make_url(url)
+    timeout = int(os.environ.get("SQL_TIMEOUT", SQL_TIMEOUT))
+    opciones = dict(pool_pre_ping=True,
+                    pool_recycle=int(os.environ.get("SQL_POOL_RECYCLE", SQL_POOL_RECYCLE)))
+    # SQLite en memoria no usa QueuePool
+    if not (url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")):
+        opciones.update(pool_size=int(os.environ.get("SQL_POOL_SIZE", SQL_POOL_SIZE)),
+                        max_overflow=int(os.environ.get("SQL_MAX_OVERFLOW", SQL_MAX_OVERFLOW)),
+                        pool_timeout=timeout)
+
+    engine = create_engine(url, **opciones)
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        _sumar_estadistica("conexiones_nuevas")
+        # Tiempo límite de consulta de pyodbc
+        if hasattr(dbapi_connection, "timeout"):
+            dbapi_connection.timeout = timeout
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        _sumar_estadistica("checkouts")
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        _sumar_estadistica("checkins")
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _antes(connection, cursor, statement, parameters, context, executemany):
+        connection.info["inicio_consulta"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _despues(connection, cursor, statement, parameters, context, executemany):
+        duracion = time.perf_counter() - connection.info.pop("inicio_consulta", time.perf_counter())
+        _sumar_estadistica("consultas")
+        _sumar_estadistica("tiempo_consultas_s", duracion)
+        _maximo_estadistica("max_consulta_s", duracion)
+
+    return engine
+
+
+def obtener_engine():
+    """
+    Devuelve el engine compartido por todo el proceso, creándolo la primera vez que se necesita\n
+    :return engine: engine de SQLAlchemy
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = crear_engine(url_conexion())
+
+    return _engine
+
+
+def reiniciar_engine(url=None):
+    """
+    Cierra las conexiones del engine compartido. Si se entrega una url el engine se recrea con ella (util para probar
+    contra una base SQLite local)\n
+    :param url: URL de SQLAlchemy o STR
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = crear_engine(url) if url is not None else None
+    with _estadisticas_lock:
+        _estadisticas.clear()
+    # Los resúmenes guardados son de la base anterior
+    with _resumenes_sql_lock:
+        _resumenes_sql.clear()
+
+
+@contextmanager
+def conexion_sql(transaccion=False):
+    """
+    Toma una conexión del pool del engine compartido y mide la espera hasta obtenerla\n
+    :param transaccion: si es True la conexión se abre dentro de una transacción (engine.begin)
+    """
+    engine = obtener_engine()
+    inicio = time.perf_counter()
+    with (engine.begin() if transaccion else engine.connect()) as connection:
+        espera = time.perf_counter() - inicio
+        _sumar_estadistica("espera_checkout_s", espera)
+        _maximo_estadistica("max_espera_checkout_s", espera)
+        yield connection
+
+
+def estadisticas_engine():
+    """
+    Estadísticas del pool de conexiones y de las consultas hechas por el engine compartido\n
+    :return estadisticas: diccionario con los contadores y el estado del pool
+    """
+    with _estadisticas_lock:
+        estadisticas = dict(_estadisticas)
+    if estadisticas.get("consultas"):
+        estadisticas["promedio_consulta_s"] = estadisticas.get("tiempo_consultas_s", 0) / estadisticas["consultas"]
+    if estadisticas.get("checkouts"):
+        estadisticas["promedio_espera_checkout_s"] = estadisticas.get("espera_checkout_s", 0) / estadisticas["checkouts"]
+    if _engine is not None:
+        estadisticas["pool"] = _engine.pool.status()
+
+    return estadisticas
+
 
-    conn = create_engine(connection_url)
+def tabla_sql(engine, table):
+    """
+    Nombre completo de la tabla según el motor de base de datos\n
+    :param engine: engine de SQLAlchemy
+    :param table: tabla de la base de datos
+    """
+    if engine.dialect.name == "mssql":
+        return "{}.dbo.{}".format(os.environ.get("DATABASE"), table)
+
+    return table
+
+
+def save_log():
+    '''
+    Función para guardar los logs de los usuarios que ingresan al sistema
+    '''
+    day = str(datetime.today().date())
+    hora = str(datetime.now().time())
+    user = st.session_state.user_state['email']
 
     print('Guardando log de usuario...      ')
-    try:
-        # Execute the query
-        with conn.begin() as connection:
-            # Usar text() para construir la consulta y parámetros para pasar valores
-            # escapear con [] la palabra reservada user de sql
-            query = text("""
-                INSERT INTO {}.dbo.log_uso (fecha, hora, [user]) 
-                VALUES (:fecha, :hora, :usuario)
-            """.format(database))
-
-            # Ejecutar la consulta con parámetros
-            connection.execute(query, {
-                "fecha": day,
-                "hora": hora,
-                "usuario": user
-            })
-    finally:
-        conn.dispose()
+    with conexion_sql(transaccion=True) as connection:
+        # Usar text() para construir la consulta y parámetros para pasar valores
+        # escapear con [] la palabra reservada user de sql
+        query = text("""
+            INSERT INTO {} (fecha, hora, [user]) 
+            VALUES (:fecha, :hora, :usuario)
+        """.format(tabla_sql(connection.engine, "log_uso")))
+
+        # Ejecutar la consulta con parámetros
+        connection.execute(query, {
+            "fecha": day,
+            "hora": hora,
+            "usuario": user
+        })
         
 def to_excel(df, name):
     """
@@ -1,24 +1,344 @@
 import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
 import pandas as pd
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime
 from Utils import *
-from datetime import time
-from datos import procesar_datos
+from datos import (procesar_datos, consumo_por_dia, salud_medidores, salud_desde_franjas, grillas_medidores,
+                   fechas_grilla, etiquetas_franjas, perfil_por_franja, indice_semanas, metrica_derivada,
+                   estadisticas_metricas, huella, tamano_objeto, reducir_serie)
 
 # Configurar estilo de página ------------------------------------------------------------------------------------------
 st.set_page_config(page_title="Análisis de Consumo de Gas", layout="wide", )
 
+# Rangos más largos que este número de días se resumen en la base de datos en lugar de traer los registros crudos
+DIAS_MODO_AGREGADO = 31
+
 #-----------------------------------------------------------------------------------------------------------------------
-@st.cache_data(ttl=600)
+# Sin st.cache_data por rango: find_load arma el rango con los bloques diarios en memoria de Utils (bloque_dia)
 def carga_datos(tipo,fecha_inicio,fecha_final,table,redownload):
     datos =find_load(tipo=tipo, ini=str(fecha_inicio), fin=str(fecha_final), table=table,
               redownload=redownload, directorio="./data")
     return datos
 
+
+def carga_datos_lote(tipo, fecha_inicio, fecha_final, tablas, redownload, timeout=None):
+    """
+    Carga en paralelo las tablas de los medidores con carga_datos.
+
+    Parámetros:
+    - tablas: lista de tablas a cargar ("gas_ERM", "gas_INT", "gas_H5")
+    - timeout: segundos máximos de espera del lote
+
+    Retorna:
+    - Diccionario con "datos", "tiempos" y "errores" por tabla
+    """
+    # Los hilos necesitan el contexto de la sesión para usar funciones de Streamlit
+    ctx = get_script_run_ctx()
+
+    def _cargar(table):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return carga_datos(tipo, fecha_inicio, fecha_final, table, redownload)
+
+    return cargar_tablas(_cargar, tablas, timeout=timeout)
+
+
+# Sin st.cache_data por rango: los días cerrados salen del resumen diario en memoria de Utils (cargar_resumen) y
+# solo los días abiertos o sin descargar se resumen en la base de datos
+def carga_agregados(fecha_inicio, fecha_final, tablas):
+    """
+    Resúmenes de cada tabla para rangos largos: por día de producción de 6:30 (consumo), por día de producción de
+    6:00 (registros y promedios por día de la semana) y por media hora. Salen del resumen diario de la cache y solo
+    los días que no están en ella se resumen en la base de datos.
+
+    Retorna:
+    - Diccionario con "datos" {tabla: {"diario", "diario_6", "media_hora", "ocupacion", "correcciones"}}, "tiempos"
+      y "errores" por tabla
+    """
+    ini, fin = str(fecha_inicio), str(fecha_final)
+
+    def _cargar(table):
+        return agregados_tabla(table, ini, fin, directorio="./data")
+
+    return cargar_tablas(_cargar, tablas,
+                         vacio=lambda: {"diario": pd.DataFrame(), "diario_6": pd.DataFrame(), "media_hora": pd.DataFrame(),
+                                        "ocupacion": pd.DataFrame(), "correcciones": pd.DataFrame()})
+
+
+def consumo_desde_agregado(df_agregado):
+    """
+    Convierte el resumen diario de la base de datos al formato de calcular_consumo_diario.
+
+    Retorna:
+    - DataFrame con columnas 'fecha_ajustada', 'vol_dias', 'fecha' y 'fecha_label'
+    """
+    if df_agregado is None or df_agregado.empty:
+        return pd.DataFrame(columns=["fecha_ajustada", "vol_dias", "fecha", "fecha_label"])
+
+    consumo_diario = pd.DataFrame({
+        "fecha_ajustada": df_agregado["dia"].dt.date,
+        "vol_dias": (df_agregado["vol_ultimo"] - df_agregado["vol_primero"]).fillna(0),
+    })
+    consumo_diario["fecha"] = pd.to_datetime(consumo_diario["fecha_ajustada"])
+    consumo_diario["fecha_label"] = etiqueta_fecha(consumo_diario["fecha"])
+    return consumo_diario
+
+
+def combinar_consumos(df_a, df_b, signo=1):
+    """
+    Suma (signo=1) o resta (signo=-1) dos tablas de consumo diario alineadas por día, como ByC = Interno + Horno y
+    PyP = ERM - Interno.
+    """
+    serie = df_a.set_index("fecha")["vol_dias"].add(signo * df_b.set_index("fecha")["vol_dias"], fill_value=0)
+    consumo_diario = serie.rename("vol_dias").rename_axis("fecha").reset_index()
+    consumo_diario["fecha_ajustada"] = consumo_diario["fecha"].dt.date
+    consumo_diario["fecha_label"] = etiqueta_fecha(consumo_diario["fecha"])
+    return consumo_diario[["fecha_ajustada", "vol_dias", "fecha", "fecha_label"]]
+
+
+def perfil_desde_agregado(df_media_hora):
+    """
+    Promedio de la diferencia de vol_corregido por media hora a partir del resumen de la base de datos.
+
+    Retorna:
+    - Serie indexada por franja (0 = 06:00, 1 = 06:30, ...)
+    """
+    if df_media_hora is None or df_media_hora.empty:
+        return pd.Series(dtype=float)
+
+    totales = df_media_hora.groupby("franja")[["suma", "n"]].sum()
+    return totales["suma"] / totales["n"].replace(0, np.nan)
+
+
+def datos_desde_agregados(agregados, fecha_inicio, fecha_final):
+    """
+    Arma las tablas diarias, la salud de datos y los perfiles por media hora del tablero a partir de los resúmenes de
+    carga_agregados, con las mismas claves que usa mostrar_tabs.
+
+    Parámetros:
+    - agregados: diccionario {tabla: {"diario", "diario_6", "media_hora", "ocupacion"}}
+
+    Retorna:
+    - Diccionario con las tablas diarias ("*_dia"), los consumos con día de 6:00 ("diarios_promedio"),
+      "perfiles", "salud" y "salud_dia"
+    """
+    erm, interno, horno = agregados["gas_ERM"], agregados["gas_INT"], agregados["gas_H5"]
+
+    data = {
+        "erm_dia": consumo_desde_agregado(erm["diario"]),
+        "interno_dia": consumo_desde_agregado(interno["diario"]),
+        "horno_dia": consumo_desde_agregado(horno["diario"]),
+    }
+    data["byc_dia"] = combinar_consumos(data["interno_dia"], data["horno_dia"])
+    data["pisos_dia"] = combinar_consumos(data["erm_dia"], data["interno_dia"], signo=-1)
+
+    erm_6 = consumo_desde_agregado(erm["diario_6"])
+    interno_6 = consumo_desde_agregado(interno["diario_6"])
+    horno_6 = consumo_desde_agregado(horno["diario_6"])
+    data["diarios_promedio"] = {
+        "Baños y Cocina": combinar_consumos(interno_6, horno_6),
+        "PyP": combinar_consumos(erm_6, interno_6, signo=-1),
+        "ERM": erm_6,
+        "Interno": interno_6,
+        "Horno 5": horno_6,
+    }
+
+    perfil_erm = perfil_desde_agregado(erm["media_hora"])
+    perfil_interno = perfil_desde_agregado(interno["media_hora"])
+    perfil_horno = perfil_desde_agregado(horno["media_hora"])
+    data["perfiles"] = {
+        "Baños y Cocina": perfil_interno.add(perfil_horno, fill_value=0),
+        "PyP": perfil_erm.sub(perfil_interno, fill_value=0),
+        "ERM": perfil_erm,
+        "Interno": perfil_interno,
+        "Horno 5": perfil_horno,
+    }
+
+    # Salud: con los resúmenes se conoce la cantidad de registros de cada franja de 30 minutos de cada medidor
+    salud = salud_desde_franjas({"ERM": erm["ocupacion"], "Interno": interno["ocupacion"], "Horno 5": horno["ocupacion"]},
+                                fecha_inicio, fecha_final, hasta=datetime.now())
+    data["salud"] = salud["general"].mean()
+    data["salud_dia"] = salud["dia"].mean(axis=1)
+
+    return data
+
+# Tablas de la base de datos que usa el tablero
+TABLAS_TABLERO = ["gas_ERM", "gas_INT", "gas_H5"]
+# Memoria máxima de los tableros compartidos entre sesiones (se puede cambiar con la variable MEMORIA_TABLEROS_MB)
+MEMORIA_TABLEROS_MB = 1024
+# Memoria máxima de las figuras guardadas en JSON (se puede cambiar con la variable MEMORIA_FIGURAS_MB)
+MEMORIA_FIGURAS_MB = 64
+
+## Tableros compartidos entre sesiones
+# Por huella de la consulta: registros descargados, datos procesados y memoria ocupada. Las sesiones que consultan
+# los mismos datos usan la misma entrada (de solo lectura) y cada sesión guarda solo la huella en st.session_state,
+# así la memoria crece con las consultas distintas y no con los usuarios
+_tableros = OrderedDict()
+_tableros_lock = threading.Lock()
+
+
+def huella_consulta(consulta):
+    """
+    Huella de una consulta: tablas, tipo, fechas y contenido de los registros descargados (o de los resúmenes).
+
+    Parámetros:
+    - consulta: diccionario con 'tipo', 'fecha_inicio', 'fecha_final', 'agregados' y los registros 'erm', 'interno'
+      y 'horno'
+
+    Retorna:
+    - texto hexadecimal de 32 caracteres
+    """
+    partes = [repr((tuple(TABLAS_TABLERO), consulta["tipo"], str(consulta["fecha_inicio"]), str(consulta["fecha_final"])))]
+    if consulta["agregados"] is not None:
+        partes += [huella(consulta["agregados"][tabla][modo])
+                   for tabla in sorted(consulta["agregados"]) for modo in sorted(consulta["agregados"][tabla])]
+    else:
+        partes += [huella(consulta[medidor]) for medidor in ("erm", "interno", "horno")]
+    return hashlib.blake2b("|".join(partes).encode(), digest_size=16).hexdigest()
+
+
+def registrar_consulta(consulta):
+    """
+    Guarda una consulta en los tableros compartidos. Si otra sesión ya tiene una consulta con el mismo contenido se
+    reutiliza esa entrada y se descartan los registros recibidos.
+
+    Parámetros:
+    - consulta: diccionario de huella_consulta
+
+    Retorna:
+    - huella de la consulta (lo único que debe guardar la sesión)
+    """
+    clave = huella_consulta(consulta)
+    with _tableros_lock:
+        if clave not in _tableros:
+            _tableros[clave] = {
+                "consulta": consulta,
+                "resultado": None,
+                "bytes": tamano_objeto([consulta[medidor] for medidor in ("erm", "interno", "horno")]
+                                       + [consulta["agregados"]]),
+                "descripcion": "{} {} a {}".format(consulta["tipo"], consulta["fecha_inicio"], consulta["fecha_final"]),
+                "usos": 0,
+            }
+        _tableros.move_to_end(clave)
+        _desalojar_tableros()
+    return clave
+
+
+def _desalojar_tableros():
+    # Se liberan las consultas usadas hace más tiempo hasta quedar dentro de la memoria (siempre queda la última)
+    limite = float(os.environ.get("MEMORIA_TABLEROS_MB", MEMORIA_TABLEROS_MB)) * 2**20
+    while len(_tableros) > 1 and sum(entrada["bytes"] for entrada in _tableros.values()) > limite:
+        _tableros.popitem(last=False)
+
+
+def tablero_disponible(clave):
+    """
+    Indica si la consulta de una sesión sigue en los tableros compartidos.
+    """
+    with _tableros_lock:
+        return clave in _tableros
+
+
+def estadisticas_tableros():
+    """
+    Memoria ocupada y usos de cada consulta de los tableros compartidos, de la más antigua a la más reciente.
+    """
+    with _tableros_lock:
+        return [{"huella": clave[:8], "consulta": entrada["descripcion"], "bytes": entrada["bytes"],
+                 "procesado": entrada["resultado"] is not None, "usos": entrada["usos"]}
+                for clave, entrada in _tableros.items()]
+
+
+def datos_tablero(clave):
+    """
+    Datos de mostrar_tabs de una consulta: medidores, tablas diarias, consumo total, salud de datos y correcciones de
+    contador. Se procesan la primera vez que alguna sesión los pide y luego todas las sesiones comparten el resultado,
+    así que los reruns que no envían el formulario no vuelven a procesar. El resultado no se debe modificar.
+
+    Parámetros:
+    - clave: huella de registrar_consulta (None si la sesión no ha consultado nada)
+
+    Retorna:
+    - (data, correcciones)
+    """
+    with _tableros_lock:
+        entrada = _tableros.get(clave)
+        if entrada is not None:
+            _tableros.move_to_end(clave)
+            entrada["usos"] += 1
+    if entrada is None:
+        return procesar_consulta(None)
+
+    if entrada["resultado"] is None:
+        resultado = procesar_consulta(entrada["consulta"])
+        with _tableros_lock:
+            if entrada["resultado"] is None:
+                entrada["resultado"] = resultado
+                entrada["bytes"] += tamano_objeto(list(resultado))
+                _desalojar_tableros()
+
+    return entrada["resultado"]
+
+
+def procesar_consulta(consulta):
+    """
+    Procesa una consulta y arma el diccionario de datos de mostrar_tabs.
+
+    Parámetros:
+    - consulta: diccionario de huella_consulta (None para un tablero vacío)
+
+    Retorna:
+    - (data, correcciones)
+    """
+    vacio = pd.DataFrame(columns=["fecha", "vol_corregido", "flujo_corregido", "presion", "temperatura"])
+    consulta = consulta or {"tipo": None, "fecha_inicio": None, "fecha_final": None, "agregados": None,
+                            "erm": vacio, "interno": vacio, "horno": vacio}
+
+    fecha_inicio, fecha_final = consulta["fecha_inicio"], consulta["fecha_final"]
+    agregados = consulta["agregados"]
+    df_erm, df_interno, df_horno, df_byc, df_pisos, correcciones = procesar_datos(consulta["erm"], consulta["interno"],
+                                                                                  consulta["horno"])
+
+    data = {
+        "byc": df_byc,
+        "pisos": df_pisos,
+        "erm": df_erm,
+        "interno": df_interno,
+        "horno": df_horno,
+    }
+    if agregados is not None:
+        data.update(datos_desde_agregados(agregados, fecha_inicio, fecha_final))
+        data["modo"] = "agregado"
+        # Correcciones de contador hechas sobre los resúmenes, con los mismos nombres de medidor que procesar_datos
+        correcciones = pd.concat([agregados[tabla]["correcciones"].assign(medidor=nombre)
+                                  for tabla, nombre in zip(TABLAS_TABLERO, ["erm", "interno", "horno"])
+                                  if not agregados[tabla]["correcciones"].empty] or [correcciones], ignore_index=True)
+    else:
+        # Las tablas diarias ya traen "fecha_label" ("Día-Mes") y vienen de la cache de métricas: no se modifican aquí
+        for nombre in ["byc", "pisos", "erm", "interno", "horno"]:
+            data[nombre + "_dia"] = calcular_consumo_diario(data[nombre])
+
+        if fecha_inicio is not None:
+            # Salud de los datos de los tres medidores en una sola pasada (métrica general y gráfica diaria)
+            salud_datos = salud_medidores({"ERM": df_erm, "Interno": df_interno, "Horno 5": df_horno},
+                                          fecha_inicio, fecha_final, hasta=datetime.now())
+            data["salud"] = salud_datos["general"].mean()
+            data["salud_dia"] = salud_datos["dia"].mean(axis=1)
+            data["salud_faltantes"] = salud_datos["faltantes"]
+
+    # Suma total de las secciones por día
+    data["total_dia"] = pd.DataFrame({"vol_dias": sum(data[nombre + "_dia"]["vol_dias"]
+                                                      for nombre in ["byc", "pisos", "erm", "interno", "horno"])})
+
+    return data, correcciones
+
 #-----------------------------------------------------------------------------------------------------------------------
 def conversion_energia(df):
 
@@ -28,37 +348,43 @@ def conversion_energia(df):
 
 
 #-----------------------------------------------------------------------------------------------------------------------
-def calcular_consumo_diario(df):
+def etiqueta_fecha(fechas):
+    """
+    Etiquetas "Día-Mes" como categoría ordenada según el orden de las fechas.
+    """
+    etiquetas = fechas.dt.strftime("%d-%m")
+    return pd.Categorical(etiquetas, categories=pd.unique(etiquetas), ordered=True)
+
+
+def _consumo_diario(df, inicio_dia):
+    # Consumo diario como diferencia entre último y primero del día ajustado
+    consumo = consumo_por_dia(df, inicio_dia)
+
+    consumo_diario = pd.DataFrame({
+        "fecha_ajustada": consumo.index.date,
+        "vol_dias": consumo["vol_corregido"].to_numpy(),
+    })
+
+    # Añadir etiquetas para gráficos
+    consumo_diario["fecha"] = pd.to_datetime(consumo.index)
+    consumo_diario["fecha_label"] = etiqueta_fecha(consumo_diario["fecha"])
+    return consumo_diario
+
+
+def calcular_consumo_diario(df, inicio_dia=pd.Timedelta(hours=6, minutes=30)):
     """
     Calcula el consumo diario a partir de un DataFrame con volumen acumulativo,
-    considerando días de 6am a 6am del día siguiente.
+    considerando días de 6:30am a 6:30am del día siguiente. El resultado se guarda en la cache de métricas
+    derivadas, así que las llamadas repetidas con los mismos datos no lo recalculan (no modificar el resultado).
 
     Parámetros:
     - df: DataFrame con columnas 'fecha' y 'vol_corregido'
+    - inicio_dia: hora de inicio del día de producción
 
     Retorna:
-    - DataFrame con columnas 'fecha_label' y 'vol_dias'
+    - DataFrame con columnas 'fecha_ajustada', 'vol_dias', 'fecha' y 'fecha_label'
     """
-    df = df.copy()
-    df["fecha"] = pd.to_datetime(df["fecha"])
-
-    # Ajustar el día para que empiece a las 6:30 a.m.
-    df["fecha_ajustada"] = df["fecha"].apply(
-        lambda x: x.date() if x.hour > 6 or (x.hour == 6 and x.minute >= 30)
-        else (x - pd.Timedelta(days=1)).date()
-    )
-
-    # Calcular consumo diario como diferencia entre último y primero del día ajustado
-    consumo_diario = df.groupby("fecha_ajustada").agg(
-        vol_dias=("vol_corregido", lambda x: x.iloc[-1] - x.iloc[0])
-    ).reset_index()
-
-    # Añadir etiquetas para gráficos
-    consumo_diario["fecha"] = pd.to_datetime(consumo_diario["fecha_ajustada"])
-    consumo_diario["fecha_label"] = consumo_diario["fecha"].dt.strftime("%d-%m")
-
-    print(consumo_diario)
-    return consumo_diario
+    return metrica_derivada("consumo_diario", _consumo_diario, df, inicio_dia=pd.Timedelta(inicio_dia))
 
 
 #-----------------------------------------------------------------------------------------------------------------------
@@ -74,47 +400,22 @@ def calcular_consumo_diario_promedio(df):
     Retorna:
     - DataFrame con columnas 'fecha_label' y 'vol_dias'
     """
-    df = df.copy()
-    df["fecha"] = pd.to_datetime(df["fecha"])
-
-    # Crear columna de día 6am-6am
-    df["fecha_ajustada"] = df["fecha"].apply(
-        lambda x: x.date() if x.hour >= 6 else (x - pd.Timedelta(days=1)).date()
-    )
-
-    # Calcular consumo diario: último - primero de cada día ajustado
-    consumo_diario = df.groupby("fecha_ajustada").agg(
-        vol_dias=("vol_corregido", lambda x: x.iloc[-1] - x.iloc[0])
-    ).reset_index()
-
-    consumo_diario["fecha"] = pd.to_datetime(consumo_diario["fecha_ajustada"])
-    consumo_diario["fecha_label"] = consumo_diario["fecha"].dt.strftime("%d-%m")
-    return consumo_diario
+    return calcular_consumo_diario(df, inicio_dia=pd.Timedelta(hours=6))
 
 def calcular_salud(df, fecha_inicio, fecha_fin):
     """
-    Calcula la salud general de los datos en un rango de fechas.
+    Calcula la salud general de los datos en un rango de fechas con salud_medidores.
 
     Parámetros:
-    - df: DataFrame con los datos
+    - df: DataFrame con los datos o diccionario {nombre: DataFrame} con varios medidores
     - fecha_inicio: Fecha de inicio del análisis
     - fecha_fin: Fecha final del análisis
 
     Retorna:
-    - Porcentaje de salud de los datos
+    - Porcentaje de salud de los datos (promedio de los medidores)
     """
-    # Convertir fecha_inicio y fecha_fin a datetime (inicio y fin del día)
-    fecha_inicio = datetime.combine(fecha_inicio, time(6, 0, 0))
-    fecha_fin = datetime.combine(fecha_fin, time(6, 0, 0)) + timedelta(days=1)
-
-    df = df[(df["fecha"] >= fecha_inicio) & (df["fecha"] <= fecha_fin)].copy()
-
-    dias = (fecha_fin.date() - fecha_inicio.date()).days
-
-    esperados = (dias) * 48
-    reales = len(df)
-    salud = (reales / esperados) * 100
-    return min(salud, 100)
+    medidores = df if isinstance(df, dict) else {"datos": df}
+    return salud_medidores(medidores, fecha_inicio, fecha_fin, hasta=datetime.now())["general"].mean()
 
 
 def calcular_salud_por_dia(df, fecha_inicio, fecha_fin):
@@ -123,53 +424,95 @@ def calcular_salud_por_dia(df, fecha_inicio, fecha_fin):
     considerando un día como el período desde las 6am hasta las 6am del día siguiente.
 
     Parámetros:
-    - df: DataFrame con los datos
+    - df: DataFrame con los datos o diccionario {nombre: DataFrame} con varios medidores
     - fecha_inicio: Fecha de inicio del análisis
     - fecha_fin: Fecha final del análisis
 
     Retorna:
-    - Serie con porcentaje de salud por día
+    - Serie con porcentaje de salud por día (promedio de los medidores)
     """
+    medidores = df if isinstance(df, dict) else {"datos": df}
+    return salud_medidores(medidores, fecha_inicio, fecha_fin, hasta=datetime.now())["dia"].mean(axis=1)
 
-    # Convertir fecha_inicio y fecha_fin a datetime con hora 6am
-    fecha_inicio = datetime.combine(fecha_inicio, time(6, 0, 0))
-    fecha_fin = datetime.combine(fecha_fin, time(6, 0, 0)) + timedelta(days=1)
-
-    # Crear un rango de todas las fechas (de 6am a 6am)
-    todas_fechas = pd.date_range(start=fecha_inicio, end=fecha_fin, freq='24h').date
-
-    # Filtrar datos para el rango de fechas solicitado
-    df_filtered = df[(df["fecha"] >= fecha_inicio) & (df["fecha"] <= fecha_fin)]
 
+## Cache de figuras
+# Por (gráfica, huella de los datos de entrada, parámetros): la figura serializada en JSON. Se comparte entre pestañas,
+# reruns y sesiones; al pasar MEMORIA_FIGURAS_MB se desalojan las usadas hace más tiempo
+_figuras = OrderedDict()
+_figuras_lock = threading.Lock()
+_figuras_estadisticas = {"aciertos": 0, "fallos": 0, "desalojos": 0, "bytes": 0}
 
-    if df_filtered.empty:
-        return pd.Series(index=todas_fechas[:-1], data=0)
 
-    # Crear columna para día de 6am-6am
-    df_filtered['fecha_laboral'] = df_filtered['fecha'].apply(
-        lambda x: x.date() if x.hour >= 6 else (x - timedelta(days=1)).date()
-    )
-
-
-    # Calcular frecuencia esperada de registros
-    registros_esperados = 96
-
-    # Contar registros por día de 6am-6am
-    conteo_por_dia = df_filtered.groupby('fecha_laboral').size()
-    # Crear serie de salud con todas las fechas, estableciendo 0 para días sin datos
-    salud_por_dia = pd.Series(index=todas_fechas[:-1], data=0)
+def huella_datos(valor):
+    """
+    Huella de los argumentos de una gráfica: DataFrames y Series por contenido, diccionarios, listas y tuplas
+    elemento a elemento y el resto (fechas, textos, números) por su repr.
+    """
+    if isinstance(valor, pd.DataFrame):
+        return huella(valor)
+    if isinstance(valor, pd.Series):
+        return huella(valor.to_frame())
+    if isinstance(valor, dict):
+        return "{" + ",".join("{!r}:{}".format(k, huella_datos(v)) for k, v in valor.items()) + "}"
+    if isinstance(valor, (list, tuple)):
+        return "(" + ",".join(huella_datos(v) for v in valor) + ")"
+    return repr(valor)
+
+
+def figura_cacheada(grafica, constructor, *args, **kwargs):
+    """
+    Devuelve constructor(*args, **kwargs) desde la cache de figuras o lo construye y lo guarda en JSON. Con un acierto
+    no se repite el trabajo de pandas ni la validación de Plotly: la figura se arma desde el JSON sin validar.
 
-    # Calcular salud: (cantidad real / cantidad esperada) * 100, limitando a 100%
-    for fecha in conteo_por_dia.index:
-        if fecha in salud_por_dia.index:
-            registros_reales = conteo_por_dia[fecha]
-            salud = min(100, (registros_reales / registros_esperados) * 100)
-            salud_por_dia[fecha] = salud
+    Parámetros:
+    - grafica: nombre de la gráfica (parte de la clave)
+    - constructor: función que devuelve una figura de Plotly o una tupla de figuras
+    - args, kwargs: argumentos del constructor (datos y parámetros de la gráfica)
 
-    return salud_por_dia
+    Retorna:
+    - figura (o tupla de figuras) de Plotly
+    """
+    clave = (grafica, hashlib.blake2b((huella_datos(args) + huella_datos(kwargs)).encode(), digest_size=16).hexdigest())
+    with _figuras_lock:
+        guardada = _figuras.get(clave)
+        if guardada is not None:
+            _figuras.move_to_end(clave)
+            _figuras_estadisticas["aciertos"] += 1
+        else:
+            _figuras_estadisticas["fallos"] += 1
+
+    if guardada is not None:
+        figuras = tuple(go.Figure(json.loads(texto), _validate=False) for texto in guardada[0])
+        return figuras if guardada[1] else figuras[0]
+
+    resultado = constructor(*args, **kwargs)
+    varias = isinstance(resultado, tuple)
+    textos = tuple(figura.to_json() for figura in (resultado if varias else (resultado,)))
+    tamaño = sum(len(texto) for texto in textos)
+    limite = float(os.environ.get("MEMORIA_FIGURAS_MB", MEMORIA_FIGURAS_MB)) * 2**20
+
+    with _figuras_lock:
+        if clave not in _figuras and tamaño <= limite:
+            _figuras[clave] = (textos, varias, tamaño)
+            _figuras_estadisticas["bytes"] += tamaño
+            while _figuras_estadisticas["bytes"] > limite:
+                _, (_, _, liberado) = _figuras.popitem(last=False)
+                _figuras_estadisticas["bytes"] -= liberado
+                _figuras_estadisticas["desalojos"] += 1
+
+    return resultado
+
+
+def estadisticas_figuras():
+    """
+    Aciertos, fallos, desalojos, bytes de JSON guardados y número de figuras de la cache de figuras.
+    """
+    with _figuras_lock:
+        return dict(_figuras_estadisticas, figuras=len(_figuras))
 
 
-def generar_grafico_total(df_byc, df_pisos, fecha_inicio, fecha_fin):
+def generar_grafico_total(df_byc, df_pisos, fecha_inicio, fecha_fin, df_byc_dia=None, df_pisos_dia=None,
+                          salud_datos=None):
     """
     Genera una gráfica de barras con un line chart de salud de datos en un eje Y secundario.
 
@@ -178,21 +521,22 @@ def generar_grafico_total(df_byc, df_pisos, fecha_inicio, fecha_fin):
     - df_pisos: DataFrame de Pisos y Paredes
     - fecha_inicio: Fecha de inicio del análisis
     - fecha_fin: Fecha final del análisis
+    - df_byc_dia, df_pisos_dia, salud_datos: consumos diarios y salud por día ya calculados (opcionales)
 
     Retorna:
     - fig: Figura de Plotly con gráfica de consumo y salud de datos
     """
     # Calcular consumo diario para cada DataFrame
-    df_byc_dia = calcular_consumo_diario(df_byc)
-    df_pisos_dia = calcular_consumo_diario(df_pisos)
+    if df_byc_dia is None:
+        df_byc_dia = calcular_consumo_diario(df_byc)
+    if df_pisos_dia is None:
+        df_pisos_dia = calcular_consumo_diario(df_pisos)
+    df_byc_dia = df_byc_dia.copy()
+    df_pisos_dia = df_pisos_dia.copy()
 
     # Crear rango de fechas completo
     fechas_completas = pd.date_range(start=fecha_inicio, end=fecha_fin)
 
-    # Convertir fecha_label a datetime sin modificar el año
-    df_byc_dia['fecha'] = pd.to_datetime(df_byc_dia['fecha'], errors='coerce')
-    df_pisos_dia['fecha'] = pd.to_datetime(df_pisos_dia['fecha'], errors='coerce')
-
 
     df_byc_dia_completo = pd.DataFrame({
         'fecha': fechas_completas,
@@ -222,7 +566,8 @@ def generar_grafico_total(df_byc, df_pisos, fecha_inicio, fecha_fin):
     df_pisos_dia_completo['vol_dias'] = df_pisos_dia_completo['vol_dias_y']
     df_pisos_dia_completo = df_pisos_dia_completo.drop(columns=['vol_dias_y'])
 
-    salud_datos = calcular_salud_por_dia(pd.concat([df_byc, df_pisos]), fecha_inicio, fecha_fin)
+    if salud_datos is None:
+        salud_datos = calcular_salud_por_dia({"byc": df_byc, "pisos": df_pisos}, fecha_inicio, fecha_fin)
 
     # Crear figura con dos ejes Y
     fig = go.Figure()
@@ -319,9 +664,33 @@ def generar_grafico_total(df_byc, df_pisos, fecha_inicio, fecha_fin):
 
 # ----------------------------------------------------------------------------------------------------------------------
 
-def fluctuacion(df_byc, df_pisos, df_erm, df_interno, df_horno, titulo="", key=None):
+def ventana_seleccionada(key):
     """
-    Función para visualizar la fluctuación de gas en diferentes secciones.
+    Ventana de tiempo elegida con la selección de caja de una gráfica de Streamlit (on_select="rerun").
+
+    Parámetros:
+        key: clave de la gráfica.
+
+    Retorna:
+        (desde, hasta) como Timestamp, o (None, None) si no hay selección.
+    """
+    estado = st.session_state.get(key) or {}
+    cajas = (estado.get("selection") or {}).get("box") or []
+    if not cajas or len(cajas[0].get("x", [])) < 2:
+        return None, None
+    desde, hasta = sorted(pd.to_datetime(cajas[0]["x"][:2]))
+    return desde, hasta
+
+
+AYUDA_VENTANA = ("Seleccione una ventana con la herramienta de caja para verla con todo el detalle; "
+                 "doble clic en la gráfica para volver al rango completo.")
+
+
+def fluctuacion(df_byc, df_pisos, df_erm, df_interno, df_horno, titulo="", key="fluctuacion", webgl=None):
+    """
+    Función para visualizar la fluctuación de gas en diferentes secciones. Cada traza se reduce a PUNTOS_GRAFICA
+    puntos (mínimo y máximo por cubeta de tiempo); al seleccionar una ventana con la caja se vuelve a dibujar solo esa
+    ventana con todo el detalle disponible.
 
     Parámetros:
         df_byc: DataFrame con las columnas 'fecha' y 'vol_corregido' para ByC.
@@ -330,33 +699,37 @@ def fluctuacion(df_byc, df_pisos, df_erm, df_interno, df_horno, titulo="", key=N
         df_interno: DataFrame con las columnas 'fecha' y 'vol_corregido' para Interno.
         df_horno: DataFrame con las columnas 'fecha' y 'vol_corregido' para Horno.
         titulo: Título de la gráfica.
-        key: Clave opcional para Streamlit.
+        key: Clave de la gráfica en Streamlit (guarda la ventana seleccionada).
+        webgl: None usa el modo global (MODO_WEBGL según el total de puntos), True o False lo reemplazan.
     """
 
-    # Calcular la diferencia para detectar fluctuaciones
-    for df in [df_byc, df_pisos, df_erm, df_interno, df_horno]:
-        # Calcular la diferencia entre vol_corregido
-        df["diferencia"] = df["vol_corregido"].diff().fillna(0)
-
-        # Eliminar filas duplicadas basadas en la columna "fecha_ajustada"
-        df.drop_duplicates(subset="fecha", keep="first", inplace=True)
+    # Consumo por ranura de 30 minutos sobre la misma grilla para todas las secciones (sin modificar los DataFrames)
+    grillas = metrica_derivada("grillas", grillas_medidores,
+                               {"ByC": df_byc, "PyP": df_pisos, "ERM": df_erm, "Interno": df_interno, "Horno": df_horno})
+    fechas = fechas_grilla(grillas["ByC"])
+    desde, hasta = ventana_seleccionada(key)
 
     fig = go.Figure()
 
     # Lista de trazas con colores específicos
     trazas = [
-        ("ByC", df_byc, "#05668D", True),   # Activo por defecto
-        ("PyP", df_pisos, "#f4e04d", False),
-        ("ERM", df_erm, "#02C39A", False),
-        ("Interno", df_interno, "#028090", False),
-        ("Horno", df_horno, "#00A896", False)
+        ("ByC", "#05668D", True),   # Activo por defecto
+        ("PyP", "#f4e04d", False),
+        ("ERM", "#02C39A", False),
+        ("Interno", "#028090", False),
+        ("Horno", "#00A896", False)
     ]
 
 
-    for nombre, df, color, visible in trazas:
-        fig.add_trace(go.Scatter(
-            x=df["fecha"],
-            y=df["diferencia"],
+    series = {nombre: reducir_serie(fechas, grillas[nombre]["consumo"].ravel(), desde=desde, hasta=hasta)
+              for nombre, _, _ in trazas}
+    traza = dispersion(sum(len(x) for x, _, _ in series.values()), webgl)
+
+    for nombre, color, visible in trazas:
+        x, y, _ = series[nombre]
+        fig.add_trace(traza(
+            x=x,
+            y=y,
             mode="lines",
             name=nombre,
             line=dict(color=color),
@@ -371,7 +744,8 @@ def fluctuacion(df_byc, df_pisos, df_erm, df_interno, df_horno, titulo="", key=N
         xaxis=dict(showgrid=True)
     )
 
-    st.plotly_chart(fig, key=key)
+    st.plotly_chart(fig, key=key, on_select="rerun", selection_mode="box")
+    st.caption(AYUDA_VENTANA)
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -422,13 +796,15 @@ def grafico_consumo_total(df_byc_dia, df_pisos_dia, df_erm_dia, df_interno_dia,
 # ----------------------------------------------------------------------------------------------------------------------
 
 
-def promedio_media_hora(dataframes, titulo,key=None):
+def promedio_media_hora(dataframes, titulo,key=None, perfiles=None):
     """
     Función para graficar el promedio de consumo de gas por cada media hora para todas las secciones en una sola gráfica.
+    Con los datos crudos se muestra además la banda entre los percentiles 10 y 90 de cada franja.
 
     Parámetros:
-        df_dict: Diccionario con los DataFrames de cada sección.
+        df_dict: Diccionario con los DataFrames de cada sección (no se modifican).
         titulo: Título de la gráfica.
+        perfiles: Diccionario opcional con el promedio por franja de media hora ya calculado (0 = 06:00).
     """
 
     fig = go.Figure()
@@ -441,41 +817,26 @@ def promedio_media_hora(dataframes, titulo,key=None):
         "Horno 5": "#00A896"
     }
 
-    for nombre, df in dataframes.items():
-        df["diferencia"] = df["vol_corregido"].diff()
-        df["fecha"] = pd.to_datetime(df["fecha"])
-        df["MediaHora"] = df["fecha"].dt.floor("30min").dt.strftime("%H:%M")
-
-        df_media_hora = df.groupby("MediaHora")["diferencia"].mean().reset_index()
-
-        # Orden personalizado dentro del bucle
-        orden_personalizado = [
-            '06:00', '06:30', '07:00', '07:30',
-            '08:00', '08:30', '09:00', '09:30',
-            '10:00', '10:30', '11:00', '11:30',
-            '12:00', '12:30', '13:00', '13:30',
-            '14:00', '14:30', '15:00', '15:30',
-            '16:00', '16:30', '17:00', '17:30',
-            '18:00', '18:30', '19:00', '19:30',
-            '20:00', '20:30', '21:00', '21:30',
-            '22:00', '22:30', '23:00', '23:30',
-            '00:00', '00:30', '01:00', '01:30',
-            '02:00', '02:30', '03:00', '03:30',
-            '04:00', '04:30', '05:00', '05:30'
-        ]
-
-        df_media_hora["MediaHora"] = pd.Categorical(
-            df_media_hora["MediaHora"],
-            categories=orden_personalizado,
-            ordered=True
-        )
+    # Franjas de 06:00 a 05:30 (código 0 = 06:00)
+    etiquetas = etiquetas_franjas()
+    if perfiles is not None:
+        estadisticas = {nombre: pd.DataFrame({"media": serie}).reindex(range(len(etiquetas)))
+                        for nombre, serie in perfiles.items()}
+    else:
+        estadisticas = metrica_derivada("perfil_por_franja", perfil_por_franja, dataframes)
 
-        # Es importante ordenar después de asignar la categoría
-        df_media_hora = df_media_hora.sort_values("MediaHora")
+    for nombre, perfil in estadisticas.items():
+        banda = None
+        if "p10" in perfil:
+            banda = dict(type="data", symmetric=False, array=(perfil["p90"] - perfil["media"]).to_numpy(),
+                         arrayminus=(perfil["media"] - perfil["p10"]).to_numpy(), thickness=1)
 
         fig.add_trace(go.Bar(
-            x=df_media_hora["MediaHora"],
-            y=df_media_hora["diferencia"],
+            x=etiquetas,
+            y=perfil["media"].to_numpy(),
+            error_y=banda,
+            customdata=perfil["mediana"].to_numpy() if "mediana" in perfil else None,
+            hovertemplate="%{x}: %{y:.1f} M³" + (" (mediana %{customdata:.1f})" if "mediana" in perfil else ""),
             name=nombre,
             marker_color=colores[nombre],
             visible=True if nombre == "Baños y Cocina" else "legendonly"
@@ -493,7 +854,7 @@ def promedio_media_hora(dataframes, titulo,key=None):
 
 #------------------------------------------------------------------------------------------------------
 
-def promedio_semana(df, nombre):
+def promedio_semana(df, nombre, df_diario=None):
     """
     Calcula el promedio de consumo por día de la semana utilizando el método
     calcular_consumo_diario().
@@ -501,12 +862,19 @@ def promedio_semana(df, nombre):
     Parámetros:
       - df: DataFrame con columnas 'fecha' y 'vol_corregido'.
       - nombre: Nombre con el que se renombrará la columna de consumo promedio.
+      - df_diario: consumo diario (día de 6:00 a 6:00) ya calculado (opcional).
 
     Retorna:
-      - DataFrame con columnas 'DiaSemana' y la columna renombrada con el promedio.
+      - DataFrame con columnas 'DiaSemana' y la columna renombrada con el promedio (compartido, no modificar).
     """
     # Se utiliza el método previamente definido para calcular el consumo diario.
-    df_diario = calcular_consumo_diario_promedio(df)
+    if df_diario is None:
+        df_diario = calcular_consumo_diario_promedio(df)
+    return metrica_derivada("promedio_semana", _promedio_semana, df_diario, nombre=nombre)
+
+
+def _promedio_semana(df_diario, nombre):
+    df_diario = df_diario.copy()
     # df_diario tiene columnas: "fecha", "vol_dias" y "fecha_label"
 
     # Extraer el nombre del día de la semana a partir de "fecha"
@@ -542,9 +910,10 @@ def promedio_semana(df, nombre):
 # Grafica para promedios_semana -----------------------------------------------------------------------------------------
 
 
-def generar_grafico(dataframes):
-    """Genera una gráfica con los promedios de cada categoría."""
-    df_promedios = [promedio_semana(df, nombre) for nombre, df in dataframes.items()]
+def generar_grafico(dataframes, diarios=None):
+    """Genera una gráfica con los promedios de cada categoría. diarios: consumos diarios ya calculados (opcional)."""
+    diarios = diarios or {}
+    df_promedios = [promedio_semana(df, nombre, diarios.get(nombre)) for nombre, df in dataframes.items()]
 
     # Fusionar todos los DataFrames
     merged_df = df_promedios[0]
@@ -580,127 +949,89 @@ def generar_grafico(dataframes):
 # ---------------------------------------------------------------------------------------------------------------------
 
 
-def comparar_semanas(df, titulo="Comparación Semanal de Consumo de Gas"):
-    # Asegurarse de que la columna "fecha" esté en formato datetime
-    df["fecha"] = pd.to_datetime(df["fecha"])
-
-    # Usar el método calcular_consumo_diario para obtener el consumo diario
-    df_diario = calcular_consumo_diario(df)
-
-    # Extraer día de la semana y semana (Año-Semana) del DataFrame procesado
-    df_diario["DiaSemana"] = df_diario["fecha"].dt.day_name()
-
-    # Mapeo de días de la semana en español
-    dias_español = {
-        "Monday": "Lunes", "Tuesday": "Martes", "Wednesday": "Miércoles",
-        "Thursday": "Jueves", "Friday": "Viernes", "Saturday": "Sábado", "Sunday": "Domingo"
-    }
-    df_diario["DiaSemana"] = df_diario["DiaSemana"].map(dias_español)
-    df_diario["Semana"] = df_diario["fecha"].dt.strftime("%Y-%U")
-
-    # Mapeo de número de mes a nombre del mes
-    meses = {
-        1: "Enero", 2: "Febrero", 3: "Marzo", 4: "Abril", 5: "Mayo", 6: "Junio",
-        7: "Julio", 8: "Agosto", 9: "Septiembre", 10: "Octubre", 11: "Noviembre", 12: "Diciembre"
-    }
-
-    # Crear un diccionario para mapear semanas a rangos de fechas
+def comparar_semanas(df, titulo="Comparación Semanal de Consumo de Gas", df_diario=None):
+    """
+    Compara el consumo por día de la semana de varias semanas elegidas por el usuario (por defecto las dos últimas).
 
-    semanas_disponibles = sorted(df_diario["Semana"].unique())
-    rango_fechas = {
-        semana: f"Semana del {df_diario[df_diario['Semana'] == semana]['fecha'].min().strftime('%d')} de {meses[df_diario[df_diario['Semana'] == semana]['fecha'].min().month]} "
-                f"al {df_diario[df_diario['Semana'] == semana]['fecha'].max().strftime('%d')} de {meses[df_diario[df_diario['Semana'] == semana]['fecha'].max().month]}"
-        for semana in semanas_disponibles
-    }
+    Parámetros:
+    - df: DataFrame con 'fecha' y 'vol_corregido' (solo se usa si no llega df_diario)
+    - titulo: título de la gráfica
+    - df_diario: consumo diario ya calculado (opcional)
+    """
+    if df_diario is None:
+        # Usar el método calcular_consumo_diario para obtener el consumo diario (df ya viene tipado de procesar_datos)
+        df_diario = calcular_consumo_diario(df)
+    df_diario = df_diario.sort_values("fecha").reset_index(drop=True)
 
-    # Lista con los rangos formateados
-    semanas_mapeadas = [rango_fechas[semana] for semana in semanas_disponibles]
+    # Índice de semanas: etiqueta, fechas y filas de cada semana
+    semanas = metrica_derivada("indice_semanas", indice_semanas, df_diario)
+    semanas_mapeadas = semanas["etiqueta"].tolist()
+    semana_por_etiqueta = dict(zip(semanas["etiqueta"], semanas.index))
 
     # Verificar si hay al menos dos semanas disponibles
     if len(semanas_mapeadas) < 2:
         st.warning("⚠ No hay suficientes semanas disponibles para la comparación. Intenta ampliar el rango de fechas.")
         return
 
-    # Definir la semana actual y la anterior como predeterminadas
-    semana_actual = semanas_mapeadas[-1]
-    semana_anterior = semanas_mapeadas[-2]
-
-    # Inicializar o validar session_state
-    if 'semana_1' not in st.session_state or st.session_state.semana_1 not in semanas_mapeadas:
-        st.session_state.semana_1 = semana_anterior
-
-    if 'semana_2' not in st.session_state or st.session_state.semana_2 not in semanas_mapeadas:
-        st.session_state.semana_2 = semana_actual
-
-    # Obtener índices de forma segura
-    index_semana_1 = semanas_mapeadas.index(
-        st.session_state.semana_1) if st.session_state.semana_1 in semanas_mapeadas else 0
-    index_semana_2 = semanas_mapeadas.index(
-        st.session_state.semana_2) if st.session_state.semana_2 in semanas_mapeadas else 1
+    # Por defecto la semana anterior y la actual; se descartan selecciones de otro rango de fechas. Una selección que
+    # el usuario dejó vacía se respeta
+    guardada = st.session_state.get("semanas_comparadas")
+    seleccion = [semana for semana in guardada or [] if semana in semana_por_etiqueta]
+    if guardada is None or (guardada and not seleccion):
+        st.session_state.semanas_comparadas = semanas_mapeadas[-2:]
+    elif len(seleccion) != len(guardada):
+        st.session_state.semanas_comparadas = seleccion
 
     # Formulario de selección de semanas
     with st.form(key="formulario_semanas"):
-        semana_1 = st.selectbox(
-            "Selecciona la primera semana",
+        st.multiselect(
+            "Selecciona las semanas a comparar",
             semanas_mapeadas,
-            index=index_semana_1,
-            key="semana_1"
-        )
-        semana_2 = st.selectbox(
-            "Selecciona la segunda semana",
-            semanas_mapeadas,
-            index=index_semana_2,
-            key="semana_2"
-        )
-        confirmar = st.form_submit_button(label="Confirmar")
-
-    # Graficar automáticamente si las semanas predeterminadas están establecidas o si se presiona confirmar
-    if confirmar or (st.session_state.semana_1 == semana_anterior and st.session_state.semana_2 == semana_actual):
-        semana_1_original = next(key for key, value in rango_fechas.items() if value == st.session_state.semana_1)
-        semana_2_original = next(key for key, value in rango_fechas.items() if value == st.session_state.semana_2)
-
-        df_semanal = df_diario[df_diario["Semana"].isin([semana_1_original, semana_2_original])]
-
-        if df_semanal.empty:
-            st.warning("⚠ No hay suficientes datos para la comparación. Intenta ampliar el rango de fechas.")
-            return
-
-        # Agrupar por día de la semana y semana
-        df_semanal = df_semanal.groupby(["DiaSemana", "Semana"])["vol_dias"].mean().reset_index()
-
-        # Ordenar días de la semana correctamente en español
-        orden_dias = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
-        df_semanal["DiaSemana"] = pd.Categorical(df_semanal["DiaSemana"], categories=orden_dias, ordered=True)
-
-        # Pivotear para comparación semanal
-        df_pivot = df_semanal.pivot(index="DiaSemana", columns="Semana", values="vol_dias")
-
-        # Crear la gráfica con barras
-        fig = go.Figure()
-        colores = ['#05669D', '#F0F3BD']
-
-        for i, semana in enumerate(df_pivot.columns):
-            fig.add_trace(go.Bar(
-                x=df_pivot.index,
-                y=df_pivot[semana],
-                name=f"Semana {semana}",
-                marker=dict(color=colores[i], opacity=0.75, line=dict(color='black', width=0.3)),
-            ))
-
-        # Configuración de diseño
-        fig.update_layout(
-            title=titulo,
-            xaxis_title="Día de la Semana",
-            yaxis_title="Consumo Promedio (M³)",
-            barmode="group",
-            template="plotly_white",
-            font=dict(size=15, family="Arial"),
-            legend=dict(title="Semana", orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5),
-            margin=dict(l=40, r=40, t=40, b=40)
+            key="semanas_comparadas"
         )
+        st.form_submit_button(label="Confirmar")
+
+    seleccion = st.session_state.semanas_comparadas
+    if len(seleccion) == 0:
+        st.warning("⚠ Selecciona al menos una semana para la comparación.")
+        return
+
+    # Ordenar días de la semana correctamente en español
+    orden_dias = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
+
+    # Crear la gráfica con barras: promedio por día de la semana de las filas de cada semana
+    fig = go.Figure()
+    colores = ['#05669D', '#F0F3BD', '#02C39A', '#028090', '#00A896', '#f4e04d', '#34495e']
+
+    for i, etiqueta in enumerate(seleccion):
+        semana = semanas.loc[semana_por_etiqueta[etiqueta]]
+        filas = df_diario.iloc[semana["desde"]:semana["hasta"]]
+        dia_semana = filas["fecha"].dt.dayofweek.to_numpy()
+        conteo = np.bincount(dia_semana, minlength=7)
+        with np.errstate(invalid="ignore"):
+            promedio = np.bincount(dia_semana, weights=filas["vol_dias"].to_numpy(dtype=float), minlength=7) / conteo
+
+        fig.add_trace(go.Bar(
+            x=orden_dias,
+            y=promedio,
+            name=etiqueta,
+            marker=dict(color=colores[i % len(colores)], opacity=0.75, line=dict(color='black', width=0.3)),
+        ))
 
-        st.plotly_chart(fig)
-        st.success(f"Comparando: {st.session_state.semana_1} 🆚 {st.session_state.semana_2}")
+    # Configuración de diseño
+    fig.update_layout(
+        title=titulo,
+        xaxis_title="Día de la Semana",
+        yaxis_title="Consumo Promedio (M³)",
+        barmode="group",
+        template="plotly_white",
+        font=dict(size=15, family="Arial"),
+        legend=dict(title="Semana", orientation="h", yanchor="bottom", y=-0.3, xanchor="center", x=0.5),
+        margin=dict(l=40, r=40, t=40, b=40)
+    )
+
+    st.plotly_chart(fig)
+    st.success("Comparando: " + " 🆚 ".join(seleccion))
 
 
 #------------------------------------------------------------Grafica promedio -----------------------------------------------------------------
@@ -766,22 +1097,33 @@ def generar_graficos_promedios(df_byc_dia, df_pisos_dia, df_horno_dia, df_erm_di
 
 #----------------------------------------------------- Grafica de temperatura y presion ---------------------------------------------
 
-def temperatura_presion(df, titulo, key=None):
+def temperatura_presion(df, titulo, key, webgl=None):
     """
-    Función para graficar temperatura y presión en el tiempo.
+    Función para graficar temperatura y presión en el tiempo. Las series se reducen a PUNTOS_GRAFICA puntos y al
+    seleccionar una ventana con la caja se dibuja esa ventana con todo el detalle disponible.
 
     Parámetros:
         df: DataFrame con columnas 'fecha', 'temperatura' y 'presion'.
         titulo: Título de la gráfica.
+        key: Clave de la gráfica en Streamlit (guarda la ventana seleccionada).
+        webgl: None usa el modo global (MODO_WEBGL según el total de puntos), True o False lo reemplazan.
     """
     fig = make_subplots(specs=[[{"secondary_y": True}]])
+    desde, hasta = ventana_seleccionada(key)
+    x_temperatura, temperatura, reducida_t = reducir_serie(df['fecha'], df['temperatura'], desde=desde, hasta=hasta)
+    x_presion, presion, reducida_p = reducir_serie(df['fecha'], df['presion'], desde=desde, hasta=hasta)
+    webgl = usar_webgl(len(x_temperatura) + len(x_presion), webgl)
+    traza = go.Scattergl if webgl else go.Scatter
+    # La curva spline solo tiene sentido con todos los registros, no con mínimos y máximos por cubeta (y WebGL no la
+    # dibuja)
+    forma = 'linear' if reducida_t or reducida_p or webgl else 'spline'
 
     # Graficar temperatura
     fig.add_trace(
-        go.Scatter(
-            line_shape='spline',
-            x=df['fecha'],
-            y=df['temperatura'],
+        traza(
+            line_shape=forma,
+            x=x_temperatura,
+            y=temperatura,
             name="Temperatura",
             mode="lines",
             line=dict(color='#3498db')
@@ -791,10 +1133,10 @@ def temperatura_presion(df, titulo, key=None):
 
     # Graficar presión
     fig.add_trace(
-        go.Scatter(
-            line_shape='spline',
-            x=df['fecha'],
-            y=df['presion'],
+        traza(
+            line_shape=forma,
+            x=x_presion,
+            y=presion,
             name="Presión",
             mode="lines",
             line=dict(color='#e74c3c')
@@ -829,14 +1171,51 @@ def temperatura_presion(df, titulo, key=None):
     )
     fig.update_yaxes(title_text="Presión (mbar)", secondary_y=True)
 
-    return st.plotly_chart(fig, use_container_width=True, key=key)
+    evento = st.plotly_chart(fig, use_container_width=True, key=key, on_select="rerun", selection_mode="box")
+    st.caption(AYUDA_VENTANA)
+    return evento
+
+
+@st.fragment
+def comparacion_semanas_seccion(diarios, medidores):
+    """
+    Contenido de la pestaña de comparaciones. Es un fragmento: cambiar la sección o las semanas vuelve a ejecutar solo
+    esta pestaña y no el resto del análisis.
+
+    Parámetros:
+    - diarios: diccionario {sección: consumo diario}
+    - medidores: diccionario {sección: DataFrame del medidor}
+    """
+    st.divider()
+    st.subheader("Comparación de Días de Semana")
+    if 'comparacion' not in st.session_state:
+        st.session_state['comparacion'] = 'Baños y Cocina'
+
+    seccion2 = st.radio("Escoge la sección que quieres comparar",
+                        ['Baños y Cocina', 'PyP', 'ERM', 'Interno', 'Horno 5'],
+                        key="comparacion")
+
+    seccion2 = st.session_state['comparacion']
+
+    titulos = {
+        'Baños y Cocina': 'Comparación de Semanas de Baños y Cocina',
+        'PyP': 'Comparación de Semanas de Pisos y Paredes',
+        'ERM': 'Comparación de Semanas de ERM',
+        'Interno': 'Comparación de Semanas de Interno',
+        'Horno 5': 'Comparación de Semanas de Horno 5',
+    }
+    comparar_semanas(medidores[seccion2], titulos[seccion2], diarios[seccion2])
 
 
 def mostrar_tabs(data, fecha_inicio, fecha_final, tipo):
+    """
+    Muestra las pestañas del análisis. Solo se calcula y se dibuja la pestaña abierta (al cambiar de pestaña la
+    aplicación se vuelve a ejecutar); las tablas que usa cada pestaña salen de la cache de métricas derivadas.
+    """
     # Tabs --------------------------------------------------------------------------------------------------------------------------------------------------------------------
     tab1, tab2, tab3, tab4, tab5, tab6,tab7 = st.tabs(
         [" ⚡ Indice energetico"," 🔬Análisis", " ⚖️Comparaciones", " ⏳ Consumo por Hora", " 📉Fluctuación"," 🔥Temperatura y Presión",
-         " 🧩Dataframes"])
+         " 🧩Dataframes"], key="pestana_activa", on_change="rerun")
 
     df_byc = data["byc"]
     df_pisos = data["pisos"]
@@ -849,115 +1228,106 @@ def mostrar_tabs(data, fecha_inicio, fecha_final, tipo):
     df_interno_dia = data["interno_dia"]
     df_horno_dia = data["horno_dia"]
 
+    dataframes = {
+        "Baños y Cocina": df_byc,
+        "PyP": df_pisos,
+        "ERM": df_erm,
+        "Interno": df_interno,
+        "Horno 5": df_horno
+    }
 
+    # En rangos largos solo hay resúmenes de la base de datos, sin registros crudos
+    agregado = data.get("modo") == "agregado"
+    aviso_agregado = f"Disponible para rangos de hasta {DIAS_MODO_AGREGADO} días."
 
 
 
-    with tab1:
-        st.title("M³ ➟ Energia")
-        st.divider()
-        st.warning("En Producción")
+    if tab1.open:
+        with tab1:
+            st.title("M³ ➟ Energia")
+            st.divider()
+            st.warning("En Producción")
 
 
     # tab 1 -------------------------------------------------------------------------------------------------------------------------------------------------------------------
-    with tab2:
-        dataframes = {
-            "Baños y Cocina": df_byc,
-            "PyP": df_pisos,
-            "ERM": df_erm,
-            "Interno": df_interno,
-            "Horno 5": df_horno
-        }
-        st.title("Consumos")
-        st.subheader("Consumo Mensual")
-        st.plotly_chart(generar_grafico_total(df_byc, df_pisos, fecha_inicio, fecha_final))
-
-        st.subheader("Consumo Total de Gas en el Rango Seleccionado")
-        fig_total = grafico_consumo_total(df_byc_dia, df_pisos_dia, df_erm_dia, df_interno_dia, df_horno_dia)
-        st.plotly_chart(fig_total, use_container_width=True)
-
-        st.divider()
-
-        st.title("Promedios")
-        st.subheader("Promedio Diario de Consumo de Gas ")
-        fig1, fig2 = generar_graficos_promedios(df_byc_dia, df_pisos_dia, df_horno_dia, df_erm_dia, df_interno_dia,tipo,fecha_inicio, fecha_final)
-        col1, col2 = st.columns(2)
-        with col1:
-            st.plotly_chart(fig1, use_container_width=True)
-        with col2:
-            st.plotly_chart(fig2, use_container_width=True)
-
-        st.subheader("Promedios por Día de la Semana")
-        fig = generar_grafico(dataframes)
-        st.plotly_chart(fig)
+    if tab2.open:
+        with tab2:
+            st.title("Consumos")
+            st.subheader("Consumo Mensual")
+            st.plotly_chart(figura_cacheada("consumo_salud", generar_grafico_total, df_byc, df_pisos, fecha_inicio,
+                                            fecha_final, df_byc_dia, df_pisos_dia, data.get("salud_dia")))
+
+            st.subheader("Consumo Total de Gas en el Rango Seleccionado")
+            fig_total = figura_cacheada("consumo_total", grafico_consumo_total, df_byc_dia, df_pisos_dia, df_erm_dia,
+                                        df_interno_dia, df_horno_dia)
+            st.plotly_chart(fig_total, use_container_width=True)
+
+            st.divider()
+
+            st.title("Promedios")
+            st.subheader("Promedio Diario de Consumo de Gas ")
+            fig1, fig2 = figura_cacheada("promedios", generar_graficos_promedios, df_byc_dia, df_pisos_dia, df_horno_dia,
+                                         df_erm_dia, df_interno_dia, tipo, fecha_inicio, fecha_final)
+            col1, col2 = st.columns(2)
+            with col1:
+                st.plotly_chart(fig1, use_container_width=True)
+            with col2:
+                st.plotly_chart(fig2, use_container_width=True)
+
+            st.subheader("Promedios por Día de la Semana")
+            fig = figura_cacheada("promedio_semana", generar_grafico, dataframes, data.get("diarios_promedio"))
+            st.plotly_chart(fig)
 
     # tab 2 --------------------------------------------------------------------------------------------------------------------------------------------------------------------
-    with tab3:
-        st.divider()
-        st.subheader("Comparación de Días de Semana")
-        if 'comparacion' not in st.session_state:
-            st.session_state['comparacion'] = 'Baños y Cocina'
-
-        seccion2 = st.radio("Escoge la sección que quieres comparar",
-                            ['Baños y Cocina', 'PyP', 'ERM', 'Interno', 'Horno 5'],
-                            key="comparacion")
-
-        seccion2 = st.session_state['comparacion']
-
-        match seccion2:
-            case 'Baños y Cocina':
-                comparar_semanas(df_byc, 'Comparación de Semanas de Baños y Cocina')
-            case 'PyP':
-                comparar_semanas(df_pisos, 'Comparación de Semanas de Pisos y Paredes')
-            case 'ERM':
-                comparar_semanas(df_erm, 'Comparación de Semanas de ERM')
-            case 'Interno':
-                comparar_semanas(df_interno, 'Comparación de Semanas de Interno')
-            case 'Horno 5':
-                comparar_semanas(df_horno, 'Comparación de Semanas de Horno 5')
+    if tab3.open:
+        with tab3:
+            comparacion_semanas_seccion({"Baños y Cocina": df_byc_dia, "PyP": df_pisos_dia, "ERM": df_erm_dia,
+                                         "Interno": df_interno_dia, "Horno 5": df_horno_dia}, dataframes)
 
     # tab 3 ------------------------------------------------------- Gráfico del promedio por hora --------------------------------------------------------------------------------------
-    with tab4:
-        st.title("Consumo por Hora")
-        promedio_media_hora(dataframes, "Promedio por Hora de Consumo de Gas")
+    if tab4.open:
+        with tab4:
+            st.title("Consumo por Hora")
+            promedio_media_hora(dataframes, "Promedio por Hora de Consumo de Gas", perfiles=data.get("perfiles"))
 
     # tab 4 ------------------------------------------------------ Fluctuación --------------------------------------------------------------------------------------------------
-    with tab5:
-        st.title("Fluctuación en el Consumo de Gas")
-        fluctuacion(df_byc, df_pisos, df_erm, df_interno, df_horno, "Gráfica de Fluctuación")
+    if tab5.open:
+        with tab5:
+            st.title("Fluctuación en el Consumo de Gas")
+            if agregado:
+                st.info(aviso_agregado)
+            else:
+                fluctuacion(df_byc, df_pisos, df_erm, df_interno, df_horno, "Gráfica de Fluctuación")
 
     # tab 5 --------------------------------------------------------- Temperatura y Presión ----------------------------------------------------------------------------------------------------------------
-    with tab6:
-        temperatura_presion(df_interno, "Gráfica de Temperatura y Presión del Medidor Interno")
-        temperatura_presion(df_erm, "Gráfica de Temperatura y Presión del Medidor ERM")
+    if tab6.open:
+        with tab6:
+            if agregado:
+                st.info(aviso_agregado)
+            else:
+                temperatura_presion(df_interno, "Gráfica de Temperatura y Presión del Medidor Interno",
+                                    key="temperatura_presion_interno")
+                temperatura_presion(df_erm, "Gráfica de Temperatura y Presión del Medidor ERM",
+                                    key="temperatura_presion_erm")
 
     # tab 6 --------------------------------------------------------- Dataframes ----------------------------------------------------------------------------------------------------------------
-    with tab7:
-        st.title("Dataframes")
-        st.divider()
-        st.header("Dataframes importados")
-        st.subheader("ERM")
-        st.dataframe(df_erm)
-        st.subheader("Interno")
-        st.dataframe(df_interno)
-        st.subheader("Horno 5")
-        st.dataframe(df_horno)
-        st.divider()
-        st.header("Dataframes creados")
-        st.subheader("Baños y Cocina")
-        st.dataframe(df_byc)
-        st.subheader("Pisos y Paredes")
-        st.dataframe(df_pisos)
-
-
-
-
-
-
-
-
-
-
-
-
-
+    if tab7.open:
+        with tab7:
+            st.title("Dataframes")
+            st.divider()
+            if agregado:
+                st.info(aviso_agregado)
+                return
+            st.header("Dataframes importados")
+            st.subheader("ERM")
+            st.dataframe(df_erm)
+            st.subheader("Interno")
+            st.dataframe(df_interno)
+            st.subheader("Horno 5")
+            st.dataframe(df_horno)
+            st.divider()
+            st.header("Dataframes creados")
+            st.subheader("Baños y Cocina")
+            st.dataframe(df_byc)
+            st.subheader("Pisos y Paredes")
+            st.dataframe(df_pisos)
@@ -1,87 +1,956 @@
+import os
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
 import pandas as pd
 import numpy as np
 
-def procesar_datos(df_erm,df_interno,df_horno,df_byc,df_pisos):
-    #Eliminar duplicados ---------------------------------------------------------------------
-    df_erm.drop_duplicates(inplace=True)
-    df_interno.drop_duplicates(inplace=True)
-    df_horno.drop_duplicates(inplace=True)
+# Esquema de los medidores después de la ingesta: fecha como datetime64 al minuto y los canales numéricos
+CANALES_MEDIDOR = {
+    "vol_corregido": "float64",
+    "flujo_corregido": "float64",
+    "presion": "float64",
+    "temperatura": "float64",
+}
+# Canales de sensor que admiten float32 (vol_corregido es un acumulado grande y se deja en float64)
+CANALES_SENSOR = ["flujo_corregido", "presion", "temperatura"]
+
+
+def tipar_medidor(df, float32=False):
+    """
+    Etapa única de ingesta de un medidor: convierte la fecha una sola vez, la trunca al minuto y tipa los canales.
+    Las comas decimales se resuelven aquí; después de esta etapa ninguna función necesita volver a convertir.
+
+    Parámetros:
+    - df: DataFrame crudo de un medidor (SQL, parquet o csv)
+    - float32: si es True los canales de sensor se guardan como float32 para ahorrar memoria
+
+    Retorna:
+    - DataFrame ordenado por 'fecha' (datetime64[ns], un registro por minuto) sin columnas object
+    """
+    df = df.copy()
+    if not pd.api.types.is_datetime64_any_dtype(df["fecha"]):
+        df["fecha"] = pd.to_datetime(df["fecha"], errors="coerce")
+    df["fecha"] = df["fecha"].astype("datetime64[ns]").dt.floor("min")
+
+    for columna, tipo in CANALES_MEDIDOR.items():
+        if columna not in df.columns:
+            continue
+        if not pd.api.types.is_numeric_dtype(df[columna]):
+            # Algunos registros llegan con coma decimal
+            df[columna] = df[columna].astype(str).str.replace(",", ".")
+        if float32 and columna in CANALES_SENSOR:
+            tipo = "float32"
+        df[columna] = pd.to_numeric(df[columna], errors="coerce").astype(tipo)
+
+    # Un registro por minuto: si hay varios en el mismo minuto se queda el último
+    df = df.dropna(subset=["fecha"]).sort_values("fecha", kind="stable")
+    df = df.drop_duplicates(subset="fecha", keep="last")
+
+    return df.reset_index(drop=True)
+
+
+# Series derivadas como expresiones sobre el marco ancho de medidores (una columna por medidor)
+SERIES_DERIVADAS = {
+    "byc": "interno + horno",
+    "pisos": "erm - interno",
+}
+# Distancia máxima para emparejar registros de distintos medidores sobre la grilla común
+TOLERANCIA_UNION = pd.Timedelta(minutes=5)
+
+
+def limpiar_medidor(df):
+    """
+    Convierte la ausencia de datos (0) en NaN y llena los huecos con el valor anterior y, si no hay, con el siguiente.
+
+    Parámetros:
+    - df: DataFrame tipado de un medidor
+
+    Retorna:
+    - DataFrame con los canales sin ceros ni NaN
+    """
+    canales = [c for c in ["vol_corregido", "presion", "temperatura"] if c in df.columns]
+    df[canales] = df[canales].replace(0, np.nan).ffill().bfill()
+    return df
+
+
+def unir_medidores(medidores, columna="vol_corregido", tolerancia=TOLERANCIA_UNION):
+    """
+    Arma un marco ancho con una columna por medidor sobre una grilla común de tiempo: la unión de las fechas de
+    todos (ya truncadas al minuto en tipar_medidor), así la grilla tiene la resolución del medidor más fino.
+    Cada medidor se une con merge_asof al registro más cercano dentro de la tolerancia, así no importa que los
+    medidores tengan distinta cantidad de registros ni distinta cadencia.
+
+    Parámetros:
+    - medidores: diccionario {nombre: DataFrame tipado y ordenado por 'fecha'}
+    - columna: canal que se lleva al marco ancho
+    - tolerancia: Timedelta máxima entre la grilla y el registro del medidor
+
+    Retorna:
+    - DataFrame indexado por 'fecha' con una columna por medidor (NaN donde no hay registro cercano)
+    """
+    fechas = [df["fecha"].to_numpy(dtype="datetime64[ns]") for df in medidores.values()]
+    fechas = np.unique(np.concatenate(fechas)) if fechas else np.array([], dtype="datetime64[ns]")
+    grilla = pd.DataFrame({"fecha": fechas})
+
+    ancho = pd.DataFrame(index=pd.DatetimeIndex(grilla["fecha"], name="fecha"))
+    for nombre, df in medidores.items():
+        unido = pd.merge_asof(grilla, df[["fecha", columna]], on="fecha", direction="nearest", tolerance=tolerancia)
+        ancho[nombre] = unido[columna].to_numpy()
+
+    return ancho
+
+
+def evaluar_derivadas(ancho, derivadas=SERIES_DERIVADAS):
+    """
+    Evalúa las series derivadas como expresiones vectorizadas sobre las columnas del marco ancho.
+
+    Parámetros:
+    - ancho: DataFrame de unir_medidores
+    - derivadas: diccionario {nombre: expresión}, por ejemplo {"byc": "interno + horno"}
+
+    Retorna:
+    - diccionario {nombre: DataFrame con 'fecha' y 'vol_corregido'}
+    """
+    resultado = {}
+    for nombre, expresion in derivadas.items():
+        resultado[nombre] = pd.DataFrame({
+            "fecha": ancho.index.to_numpy(),
+            "vol_corregido": ancho.eval(expresion).to_numpy(dtype=float),
+        })
+    return resultado
+
+
+# Un paso de contador cuya tasa (por minuto) supera FACTOR_SALTO veces el percentil 99 de las tasas es un salto
+FACTOR_SALTO = 20
+
+
+def normalizar_contador(df, columna="vol_corregido", salto_maximo=None):
+    """
+    Reconstruye un acumulado monótono a partir de un contador con reinicios, cambios de medidor o saltos.
+    Los pasos negativos (reinicio o desborde) y los pasos con una tasa mayor a salto_maximo se reemplazan por un
+    incremento de 0 y el acumulado se rearma con cumsum desde el primer valor, así los días sin correcciones no cambian.
+
+    Parámetros:
+    - df: DataFrame de un medidor ordenado por 'fecha', sin NaN en la columna
+    - columna: columna acumulada a normalizar
+    - salto_maximo: tasa máxima aceptada (unidades por minuto); por defecto FACTOR_SALTO x percentil 99 de las tasas
+
+    Retorna:
+    - df: DataFrame con la columna normalizada
+    - correcciones: DataFrame con 'fecha', 'tipo' ("reinicio" o "salto"), 'valor_anterior', 'valor' y 'ajuste'
+    """
+    valores = df[columna].to_numpy(dtype=float)
+    pasos = np.diff(valores, prepend=valores[:1])
+    minutos = np.diff(df["fecha"].to_numpy(dtype="datetime64[ns]"), prepend=df["fecha"].to_numpy(dtype="datetime64[ns]")[:1])
+    minutos = np.maximum(minutos / np.timedelta64(1, "m"), 1)
+    tasas = pasos / minutos
+
+    if salto_maximo is None:
+        positivas = tasas[tasas > 0]
+        salto_maximo = FACTOR_SALTO * np.quantile(positivas, 0.99) if len(positivas) else np.inf
+
+    reinicios = pasos < 0
+    saltos = tasas > salto_maximo
+    corregidos = reinicios | saltos
+
+    df[columna] = valores[:1].sum() + np.cumsum(np.where(corregidos, 0, np.nan_to_num(pasos))) if len(valores) else valores
+
+    indices = np.flatnonzero(corregidos)
+    correcciones = pd.DataFrame({
+        "fecha": df["fecha"].to_numpy()[indices],
+        "tipo": np.where(reinicios[indices], "reinicio", "salto"),
+        "valor_anterior": valores[indices - 1],
+        "valor": valores[indices],
+        "ajuste": -pasos[indices],
+    })
+    return df, correcciones
+
+
+def procesar_datos(df_erm,df_interno,df_horno,float32=False):
+    # Tipar, ordenar, quitar duplicados y llenar huecos de cada medidor ---------------------------------------------
+    medidores = {
+        "erm": limpiar_medidor(tipar_medidor(df_erm, float32)),
+        "interno": limpiar_medidor(tipar_medidor(df_interno, float32)),
+        "horno": limpiar_medidor(tipar_medidor(df_horno, float32)),
+    }
+
+    # Corregir reinicios y saltos de los contadores ----------------------------------------------------------------------
+    correcciones = []
+    for nombre, df in medidores.items():
+        medidores[nombre], corregidos = normalizar_contador(df)
+        correcciones.append(corregidos.assign(medidor=nombre))
+    correcciones = pd.concat(correcciones, ignore_index=True)
+
+    # Calcular valores de ByC y PyP sobre la grilla común ----------------------------------------------------------------
+    ancho = unir_medidores(medidores).ffill().bfill()
+    derivadas = evaluar_derivadas(ancho)
+
+    return medidores["erm"], medidores["interno"], medidores["horno"], derivadas["byc"], derivadas["pisos"], correcciones
+
+
+def consumo_por_dia(df, inicio_dia=pd.Timedelta(hours=6, minutes=30), columnas=("vol_corregido",)):
+    """
+    Consumo por día de producción de una o varias columnas acumuladas: último menos primer registro de cada día.
+    Los días empiezan a la hora inicio_dia; las fechas se desplazan, se truncan al día y se agrupan sin apply.
+
+    Parámetros:
+    - df: DataFrame con 'fecha' y las columnas acumuladas, en el orden en que se deben tomar primero y último
+    - inicio_dia: Timedelta con la hora de inicio del día de producción (06:30 por defecto)
+    - columnas: columnas a las que se les calcula el consumo
+
+    Retorna:
+    - DataFrame indexado por día de producción (datetime64) con una columna por cada columna de entrada
+    """
+    columnas = list(columnas)
+    fechas = pd.to_datetime(df["fecha"]).to_numpy(dtype="datetime64[ns]")
+    validos = ~np.isnat(fechas)
+    un_dia = np.timedelta64(1, "D").astype("timedelta64[ns]").astype(np.int64)
+    dias = (fechas.view(np.int64) - pd.Timedelta(inicio_dia).value) // un_dia
+    posiciones = np.flatnonzero(validos)
+    dias = dias[validos]
+
+    # Posición del primer y del último registro de cada día (en el orden de df, como iloc[0] e iloc[-1])
+    if np.all(dias[1:] >= dias[:-1]):
+        # Caso habitual (df ordenado por fecha): los cortes entre días se ven con un diff, O(n)
+        cortes = np.flatnonzero(np.diff(dias)) + 1
+        inicios = np.r_[0, cortes][:len(cortes) + (len(dias) > 0)]
+        finales = np.r_[cortes - 1, len(dias) - 1][:len(inicios)]
+        primero, ultimo, unicos = posiciones[inicios], posiciones[finales], dias[inicios]
+    else:
+        grupos = pd.Series(posiciones).groupby(dias)
+        primero = grupos.min().to_numpy()
+        ultimo = grupos.max().to_numpy()
+        unicos = grupos.min().index.to_numpy()
+
+    valores = df[columnas].to_numpy(dtype=float)
+    indice = pd.DatetimeIndex((unicos * un_dia).astype("datetime64[ns]"), name="fecha_ajustada")
+    return pd.DataFrame(valores[ultimo] - valores[primero], columns=columnas, index=indice)
+
+
+# Cadencia que se asume cuando un medidor no tiene registros suficientes para inferirla
+CADENCIA_DEFECTO = pd.Timedelta(minutes=30)
+
+
+def inferir_cadencia(fechas, defecto=CADENCIA_DEFECTO):
+    """
+    Infiere el periodo de muestreo de un medidor como la mediana de los pasos entre fechas distintas.
+
+    Parámetros:
+    - fechas: arreglo o serie de fechas del medidor
+    - defecto: cadencia que se devuelve si hay menos de dos fechas distintas
+
+    Retorna:
+    - Timedelta redondeado al minuto (mínimo un minuto)
+    """
+    fechas = np.asarray(fechas, dtype="datetime64[ns]").view(np.int64)
+    if np.any(fechas[1:] < fechas[:-1]):
+        fechas = np.sort(fechas)
+    pasos = np.diff(fechas)
+    pasos = pasos[pasos > 0]
+    if len(pasos) == 0:
+        return defecto
+    return max(pd.Timedelta(int(np.median(pasos))).round("min"), pd.Timedelta(minutes=1))
+
+
+def salud_medidores(medidores, fecha_inicio, fecha_fin, inicio_dia=pd.Timedelta(hours=6), cadencias=None, hasta=None):
+    """
+    Completitud de datos por medidor y por día de producción en una sola pasada vectorizada.
+    Cada día se divide en ranuras del tamaño de la cadencia del medidor; una ranura está completa si tiene al menos
+    un registro, así las ráfagas de registros en el mismo minuto no suman de más.
+
+    Parámetros:
+    - medidores: diccionario {nombre: DataFrame con 'fecha'}
+    - fecha_inicio, fecha_fin: primer y último día de producción (inclusive)
+    - inicio_dia: hora de inicio del día de producción (06:00 por defecto)
+    - cadencias: diccionario opcional {nombre: Timedelta}; si falta un medidor se infiere con inferir_cadencia
+    - hasta: Timestamp opcional; las ranuras posteriores no se esperan (día en curso)
+
+    Retorna:
+    - Diccionario con:
+      "dia": DataFrame (días x medidores) con el porcentaje de completitud, NaN si el día no tiene ranuras esperadas
+      "general": Serie con el porcentaje de completitud de todo el rango por medidor
+      "faltantes": diccionario {nombre: DatetimeIndex con el inicio de cada ranura sin datos}
+      "cadencia": diccionario {nombre: Timedelta usada}
+    """
+    cadencias = cadencias or {}
+    inicio = (pd.Timestamp(fecha_inicio).normalize() + inicio_dia).to_datetime64().astype("datetime64[ns]")
+    n_dias = (pd.Timestamp(fecha_fin).normalize() - pd.Timestamp(fecha_inicio).normalize()).days + 1
+    un_dia = pd.Timedelta(days=1).value
+    dias = pd.date_range(pd.Timestamp(fecha_inicio).normalize(), periods=max(n_dias, 0)).date
+
+    por_dia, general, faltantes, usadas = {}, {}, {}, {}
+    for nombre, df in medidores.items():
+        fechas = df["fecha"].dropna().to_numpy(dtype="datetime64[ns]")
+        cadencia = cadencias.get(nombre) or inferir_cadencia(fechas)
+        ranuras_dia = max(int(pd.Timedelta(days=1) // cadencia), 1)
+        total = max(n_dias, 0) * ranuras_dia
+
+        # Ranura de cada registro: día de producción y posición dentro del día
+        desde_inicio = (fechas - inicio).astype(np.int64)
+        dia, resto = np.divmod(desde_inicio, un_dia)
+        ranura = resto // cadencia.value
+        validos = (desde_inicio >= 0) & (dia < n_dias) & (ranura < ranuras_dia)
+        ocupadas = np.bincount(dia[validos] * ranuras_dia + ranura[validos], minlength=total)[:total] > 0
+
+        posiciones = np.arange(total)
+        inicio_ranura = inicio + ((posiciones // ranuras_dia) * un_dia + (posiciones % ranuras_dia) * cadencia.value).astype("timedelta64[ns]")
+        esperadas = np.ones(total, dtype=bool) if hasta is None else inicio_ranura < np.datetime64(pd.Timestamp(hasta), "ns")
+
+        completas_dia = (ocupadas & esperadas).reshape(-1, ranuras_dia).sum(axis=1)
+        esperadas_dia = esperadas.reshape(-1, ranuras_dia).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            por_dia[nombre] = np.where(esperadas_dia > 0, completas_dia / esperadas_dia * 100, np.nan)
+        general[nombre] = completas_dia.sum() / esperadas_dia.sum() * 100 if esperadas_dia.sum() else np.nan
+        faltantes[nombre] = pd.DatetimeIndex(inicio_ranura[esperadas & ~ocupadas], name="fecha")
+        usadas[nombre] = cadencia
+
+    return {
+        "dia": pd.DataFrame(por_dia, index=dias),
+        "general": pd.Series(general, dtype=float),
+        "faltantes": faltantes,
+        "cadencia": usadas,
+    }
+
+
+def salud_desde_franjas(ocupacion, fecha_inicio, fecha_fin, inicio_dia=pd.Timedelta(hours=6),
+                        franja=pd.Timedelta(minutes=30), cadencias=None, hasta=None):
+    """
+    Completitud por medidor y por día de producción cuando solo se conoce la cantidad de registros de cada franja
+    (por ejemplo los resúmenes de rangos largos). Cada franja espera franja // cadencia registros y cuenta como
+    completa en la fracción que tenga de ellos (máximo 1). La cadencia de cada medidor se infiere de la mediana de
+    registros de las franjas con datos, así los medidores de 1 o 5 minutos no quedan por encima del 100 %.
+
+    Parámetros:
+    - ocupacion: diccionario {nombre: DataFrame con 'dia', 'franja' y 'filas'}
+    - fecha_inicio, fecha_fin: primer y último día de producción (inclusive)
+    - inicio_dia: hora de inicio del día de producción (06:00 por defecto)
+    - franja: tamaño de las franjas de la ocupación
+    - cadencias: diccionario opcional {nombre: Timedelta}; si falta un medidor se infiere de la ocupación
+    - hasta: Timestamp opcional; las franjas posteriores no se esperan (día en curso)
+
+    Retorna:
+    - Diccionario con "dia" (DataFrame días x medidores con el porcentaje, NaN si el día no tiene franjas esperadas),
+      "general" (porcentaje del rango por medidor) y "cadencia" ({nombre: Timedelta usada})
+    """
+    cadencias = cadencias or {}
+    franjas_dia = max(int(pd.Timedelta(days=1) // franja), 1)
+    dias = pd.date_range(pd.Timestamp(fecha_inicio).normalize(), pd.Timestamp(fecha_fin).normalize())
+    inicio_franja = (dias.to_numpy(dtype="datetime64[ns]")[:, None] + pd.Timedelta(inicio_dia).to_timedelta64()
+                     + np.arange(franjas_dia) * franja.to_timedelta64())
+    esperadas = (np.ones(inicio_franja.shape, dtype=bool) if hasta is None
+                 else inicio_franja < np.datetime64(pd.Timestamp(hasta), "ns"))
+
+    por_dia, general, usadas = {}, {}, {}
+    for nombre, df in ocupacion.items():
+        filas = np.zeros((len(dias), franjas_dia))
+        if df is not None and not df.empty:
+            fila = dias.get_indexer(pd.to_datetime(df["dia"]))
+            validas = fila >= 0
+            filas[fila[validas], df["franja"].to_numpy(dtype=np.int64)[validas]] = df["filas"].to_numpy(dtype=float)[validas]
+
+        cadencia = cadencias.get(nombre)
+        if cadencia is None:
+            ocupadas = filas[filas > 0]
+            cadencia = (max((franja / np.median(ocupadas)).round("min"), pd.Timedelta(minutes=1)) if len(ocupadas)
+                        else CADENCIA_DEFECTO)
+        completas = np.minimum(filas / max(int(franja // cadencia), 1), 1) * esperadas
+
+        esperadas_dia = esperadas.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            por_dia[nombre] = np.where(esperadas_dia > 0, completas.sum(axis=1) / esperadas_dia * 100, np.nan)
+        general[nombre] = completas.sum() / esperadas_dia.sum() * 100 if esperadas_dia.sum() else np.nan
+        usadas[nombre] = cadencia
+
+    return {
+        "dia": pd.DataFrame(por_dia, index=dias.date),
+        "general": pd.Series(general, dtype=float),
+        "cadencia": usadas,
+    }
+
+
+# Tamaño de ranura de la grilla uniforme de tiempo
+CADENCIA_GRILLA = pd.Timedelta(minutes=30)
+
+
+def etiquetas_franjas(inicio_dia=pd.Timedelta(hours=6), franja=pd.Timedelta(minutes=30)):
+    """
+    Etiquetas "HH:MM" de las franjas de un día de producción, en orden desde el inicio del día.
+    """
+    franjas_dia = max(int(pd.Timedelta(days=1) // franja), 1)
+    return [(pd.Timestamp(0) + inicio_dia + i * franja).strftime("%H:%M") for i in range(franjas_dia)]
+
+
+def grilla_medidor(df, fecha_inicio=None, fecha_fin=None, columna="vol_corregido", cadencia=CADENCIA_GRILLA,
+                   inicio_dia=pd.Timedelta(hours=6)):
+    """
+    Lleva un medidor a una grilla de cadencia fija: un arreglo denso (días x ranuras) que empieza en el inicio del
+    día de producción. Cualquier ranura se direcciona en O(1) con [día, ranura] o con indice_ranura.
+
+    El acumulado de cada borde de ranura es el último registro en o antes del borde; si ese registro tiene una cadencia
+    o más de antigüedad el borde no es válido. El consumo de una ranura es la diferencia entre sus dos bordes y la
+    máscara indica las ranuras con ambos bordes válidos.
+
+    Parámetros:
+    - df: DataFrame de un medidor ordenado por 'fecha'
+    - fecha_inicio, fecha_fin: primer y último día de producción; por defecto los que cubren los datos
+    - columna: columna acumulada
+    - cadencia: tamaño de la ranura (30 minutos por defecto)
+    - inicio_dia: hora de inicio del día de producción
+
+    Retorna:
+    - Diccionario con:
+      "dias": DatetimeIndex con los días de producción (filas)
+      "ranuras": etiquetas "HH:MM" de las ranuras (columnas)
+      "inicio", "cadencia": Timestamp de la primera ranura y Timedelta de cada ranura
+      "acumulado": arreglo (días x ranuras) con el acumulado al inicio de cada ranura (NaN si no es válido)
+      "consumo": arreglo (días x ranuras) con el consumo de cada ranura (NaN fuera de la máscara)
+      "mascara": arreglo booleano (días x ranuras)
+    """
+    fechas = df["fecha"].to_numpy(dtype="datetime64[ns]")
+    valores = df[columna].to_numpy(dtype=float)
+    if fecha_inicio is None:
+        fecha_inicio = (pd.Timestamp(fechas.min()) - inicio_dia).normalize() if len(fechas) else pd.Timestamp.today().normalize()
+    if fecha_fin is None:
+        fecha_fin = (pd.Timestamp(fechas.max()) - inicio_dia).normalize() if len(fechas) else fecha_inicio
+
+    dias = pd.date_range(pd.Timestamp(fecha_inicio).normalize(), pd.Timestamp(fecha_fin).normalize())
+    ranuras_dia = max(int(pd.Timedelta(days=1) // cadencia), 1)
+    inicio = dias[0] + inicio_dia if len(dias) else pd.Timestamp(fecha_inicio) + inicio_dia
+
+    # Bordes de todas las ranuras (uno más que ranuras para cerrar la última)
+    bordes = inicio.to_datetime64().astype("datetime64[ns]") + (np.arange(len(dias) * ranuras_dia + 1) * cadencia.value).astype("timedelta64[ns]")
+    previo = np.searchsorted(fechas, bordes, side="right") - 1
+    validos = previo >= 0
+    validos[validos] = bordes[validos] - fechas[previo[validos]] < cadencia.to_timedelta64()
+    acumulado = np.where(validos, valores[np.clip(previo, 0, None)] if len(valores) else np.nan, np.nan)
+
+    mascara = validos[:-1] & validos[1:]
+    consumo = np.where(mascara, np.diff(acumulado), np.nan)
+
+    forma = (len(dias), ranuras_dia)
+    return {
+        "dias": dias,
+        "ranuras": etiquetas_franjas(inicio_dia, cadencia),
+        "inicio": inicio,
+        "cadencia": cadencia,
+        "acumulado": acumulado[:-1].reshape(forma),
+        "consumo": consumo.reshape(forma),
+        "mascara": mascara.reshape(forma),
+    }
+
+
+def grillas_medidores(dataframes, fecha_inicio=None, fecha_fin=None, **kwargs):
+    """
+    Aplica grilla_medidor a varias series con los mismos días, para que sus arreglos se puedan combinar directamente.
+
+    Parámetros:
+    - dataframes: diccionario {nombre: DataFrame}
+
+    Retorna:
+    - diccionario {nombre: grilla}
+    """
+    if fecha_inicio is None or fecha_fin is None:
+        inicio_dia = kwargs.get("inicio_dia", pd.Timedelta(hours=6))
+        fechas = pd.concat([df["fecha"] for df in dataframes.values()]) if dataframes else pd.Series(dtype="datetime64[ns]")
+        if not fechas.dropna().empty:
+            fecha_inicio = (fechas.min() - inicio_dia).normalize() if fecha_inicio is None else fecha_inicio
+            fecha_fin = (fechas.max() - inicio_dia).normalize() if fecha_fin is None else fecha_fin
+    return {nombre: grilla_medidor(df, fecha_inicio, fecha_fin, **kwargs) for nombre, df in dataframes.items()}
+
+
+def indice_ranura(grilla, fechas):
+    """
+    Posición (día, ranura) de cada fecha en la grilla, sin búsquedas.
+
+    Parámetros:
+    - grilla: diccionario de grilla_medidor
+    - fechas: fecha o arreglo de fechas
+
+    Retorna:
+    - tupla (día, ranura) de arreglos de enteros; las fechas fuera de la grilla quedan con índices fuera de rango
+    """
+    desde_inicio = (np.asarray(fechas, dtype="datetime64[ns]") - grilla["inicio"].to_datetime64()).astype(np.int64)
+    posicion = desde_inicio // grilla["cadencia"].value
+    return np.divmod(posicion, len(grilla["ranuras"]))
+
+
+def fechas_grilla(grilla):
+    """
+    Fecha de inicio de cada ranura de la grilla, en el mismo orden que grilla["consumo"].ravel().
+    """
+    total = grilla["consumo"].size
+    return pd.DatetimeIndex(grilla["inicio"].to_datetime64() + (np.arange(total) * grilla["cadencia"].value).astype("timedelta64[ns]"))
+
+
+# Puntos máximos por traza que se envían al navegador en las series de tiempo
+PUNTOS_GRAFICA = 2000
+
+
+def reducir_serie(fechas, valores, puntos=PUNTOS_GRAFICA, desde=None, hasta=None):
+    """
+    Reduce una serie de tiempo a un número fijo de puntos conservando su forma: el eje de tiempo se divide en
+    puntos // 2 cubetas del mismo ancho (una por "píxel") y de cada cubeta se guardan el mínimo y el máximo en su orden
+    original, así los picos no desaparecen. Las cubetas solo con NaN dejan un NaN para que se vea el hueco.
+
+    Parámetros:
+    - fechas: fechas ordenadas (Series, DatetimeIndex o arreglo datetime64)
+    - valores: valores de la serie, del mismo largo
+    - puntos: máximo de puntos del resultado
+    - desde, hasta: ventana de tiempo opcional (se incluyen ambos extremos)
+
+    Retorna:
+    - (fechas, valores, reducida) con fechas y valores como arreglos numpy; si la ventana tiene como mucho 'puntos'
+      registros se devuelven todos y reducida es False
+    """
+    tiempos = pd.to_datetime(np.asarray(fechas)).to_numpy(dtype="datetime64[ns]")
+    valores = np.asarray(valores, dtype=float)
+    a = 0 if desde is None else np.searchsorted(tiempos, np.datetime64(pd.Timestamp(desde)), side="left")
+    b = len(tiempos) if hasta is None else np.searchsorted(tiempos, np.datetime64(pd.Timestamp(hasta)), side="right")
+    tiempos, valores = tiempos[a:b], valores[a:b]
+    if len(tiempos) <= puntos:
+        return tiempos, valores, False
+
+    cubetas = max(puntos // 2, 1)
+    t = tiempos.view(np.int64)
+    if t[-1] == t[0]:
+        # Todos los registros en el mismo instante: una sola cubeta
+        cubeta = np.zeros(len(t), dtype=np.int64)
+    else:
+        cubeta = np.minimum(((t - t[0]) / (t[-1] - t[0]) * cubetas).astype(np.int64), cubetas - 1)
+
+    # Mínimo y máximo de cada cubeta: orden por (cubeta, valor), el primero de cada cubeta es el mínimo y el último
+    # el máximo
+    validos = np.flatnonzero(~np.isnan(valores))
+    orden = validos[np.lexsort((valores[validos], cubeta[validos]))]
+    cambios = np.flatnonzero(np.diff(cubeta[orden])) + 1
+    primeros = orden[np.r_[0, cambios]] if len(orden) else orden
+    ultimos = orden[np.r_[cambios - 1, len(orden) - 1]] if len(orden) else orden
+
+    # Cubetas sin ningún valor: un NaN en su primer registro
+    con_datos = np.zeros(cubetas, dtype=bool)
+    con_datos[cubeta[validos]] = True
+    inicio_cubeta = np.r_[0, np.flatnonzero(np.diff(cubeta)) + 1]
+    huecos = inicio_cubeta[~con_datos[cubeta[inicio_cubeta]]]
+
+    indices = np.unique(np.concatenate([primeros, ultimos, huecos]))
+    return tiempos[indices], valores[indices], True
+
+
+# Canales con estadísticas en el resumen diario (el cero es ausencia de dato, igual que en limpiar_medidor)
+CANALES_RESUMEN = ["presion", "temperatura", "flujo_corregido"]
+
+
+def resumen_por_dia(df, inicio_dia=pd.Timedelta(hours=6), franja=CADENCIA_GRILLA):
+    """
+    Resumen por día de producción de los registros crudos de un medidor, calculado con códigos enteros de día y de
+    franja (sin apply). Es la fila que se guarda en el resumen diario persistente de la cache.
+
+    Parámetros:
+    - df: DataFrame crudo con 'fecha', 'vol_corregido' y los canales de CANALES_RESUMEN
+    - inicio_dia: hora de inicio del día de producción
+    - franja: tamaño de las franjas de los arreglos por día (30 minutos por defecto)
+
+    Retorna:
+    - DataFrame indexado por día de producción (datetime64) con:
+      filas, fecha_min, fecha_max, vol_primero, vol_ultimo, consumo y {canal}_min/_max/_media de cada canal;
+      y por franja (arreglos de largo fijo en cada celda): filas_franja, primeros y ultimos (vol_corregido distinto
+      de cero) y suma_dif/n_dif (diferencias entre registros consecutivos del mismo día, asignadas a la franja del
+      registro final)
+    """
+    franjas_dia = max(int(pd.Timedelta(days=1) // franja), 1)
+    df = df.dropna(subset=["fecha"]).sort_values("fecha", kind="stable")
+    fechas = df["fecha"].to_numpy(dtype="datetime64[ns]")
+    desde_inicio = fechas.view(np.int64) - pd.Timedelta(inicio_dia).value
+    dia, resto = np.divmod(desde_inicio, pd.Timedelta(days=1).value)
+    codigos, dias = pd.factorize(dia, sort=True)
+    celda = codigos * franjas_dia + resto // franja.value
+    n_celdas = len(dias) * franjas_dia
+
+    vol = df["vol_corregido"].to_numpy(dtype=float)
+    vol = np.where(vol == 0, np.nan, vol)
+    base = pd.DataFrame({"fecha": fechas, "vol_corregido": vol})
+    for canal in CANALES_RESUMEN:
+        valores = df[canal].to_numpy(dtype=float) if canal in df.columns else np.full(len(df), np.nan)
+        base[canal] = np.where(valores == 0, np.nan, valores)
+
+    por_dia = base.groupby(codigos)
+    resumen = pd.DataFrame({
+        "filas": por_dia.size(),
+        "fecha_min": por_dia["fecha"].min(),
+        "fecha_max": por_dia["fecha"].max(),
+        "vol_primero": por_dia["vol_corregido"].first(),
+        "vol_ultimo": por_dia["vol_corregido"].last(),
+    })
+    resumen["consumo"] = resumen["vol_ultimo"] - resumen["vol_primero"]
+    for canal in CANALES_RESUMEN:
+        estadisticas = por_dia[canal].agg(["min", "max", "mean"])
+        resumen[[canal + "_min", canal + "_max", canal + "_media"]] = estadisticas.to_numpy()
+
+    # Arreglos por franja: primer y último vol_corregido de cada celda (día, franja)
+    por_celda = pd.Series(vol).groupby(celda)
+    primeros = np.full(n_celdas, np.nan)
+    ultimos = np.full(n_celdas, np.nan)
+    primeros[por_celda.first().index] = por_celda.first().to_numpy()
+    ultimos[por_celda.last().index] = por_celda.last().to_numpy()
+    filas_franja = np.bincount(celda, minlength=n_celdas)[:n_celdas]
+
+    # Solo diferencias dentro del mismo día, así la fila no depende de los días vecinos que se leyeron con ella
+    validos = ~np.isnan(vol)
+    diferencias = np.diff(vol[validos], prepend=np.nan)
+    diferencias[1:][np.diff(codigos[validos]) != 0] = np.nan
+    con_dif = ~np.isnan(diferencias)
+    suma_dif = np.bincount(celda[validos][con_dif], weights=diferencias[con_dif], minlength=n_celdas)[:n_celdas]
+    n_dif = np.bincount(celda[validos][con_dif], minlength=n_celdas)[:n_celdas]
+
+    for nombre, arreglo in [("filas_franja", filas_franja), ("primeros", primeros), ("ultimos", ultimos),
+                            ("suma_dif", suma_dif), ("n_dif", n_dif)]:
+        resumen[nombre] = list(arreglo.reshape(len(dias), franjas_dia).astype(float))
+
+    resumen.index = pd.DatetimeIndex((np.asarray(dias, dtype=np.int64) * pd.Timedelta(days=1).value).astype("datetime64[ns]"), name="dia")
+    return resumen
+
+
+def resumen_vacio(dias, franja=CADENCIA_GRILLA):
+    """
+    Filas del resumen diario (mismas columnas que resumen_por_dia) para días sin ningún registro.
+
+    Parámetros:
+    - dias: días de producción (datetime64 o texto)
+    - franja: tamaño de las franjas de los arreglos por día
+
+    Retorna:
+    - DataFrame indexado por día con filas=0, estadísticas en NaN y arreglos por franja vacíos
+    """
+    franjas_dia = max(int(pd.Timedelta(days=1) // franja), 1)
+    dias = pd.DatetimeIndex(dias, name="dia")
+    nulos = np.full(len(dias), np.nan)
+    resumen = pd.DataFrame({
+        "filas": np.zeros(len(dias), dtype=np.int64),
+        "fecha_min": np.full(len(dias), np.datetime64("NaT"), dtype="datetime64[ns]"),
+        "fecha_max": np.full(len(dias), np.datetime64("NaT"), dtype="datetime64[ns]"),
+        "vol_primero": nulos,
+        "vol_ultimo": nulos,
+        "consumo": nulos,
+    }, index=dias)
+    for canal in CANALES_RESUMEN:
+        for estadistica in ["_min", "_max", "_media"]:
+            resumen[canal + estadistica] = nulos
+    for nombre, valor in [("filas_franja", 0.0), ("primeros", np.nan), ("ultimos", np.nan), ("suma_dif", 0.0),
+                          ("n_dif", 0.0)]:
+        resumen[nombre] = list(np.full((len(dias), franjas_dia), valor))
+    return resumen
+
+
+def extremos_franjas(primeros, ultimos):
+    """
+    Primer valor de 'primeros' y último valor de 'ultimos' distintos de NaN de cada fila de dos arreglos
+    (días x franjas).
+
+    Retorna:
+    - (primero, ultimo) como arreglos de largo igual a la cantidad de filas (NaN si la fila no tiene valores)
+    """
+    filas = np.arange(len(primeros))
+    primero = primeros[filas, np.argmax(~np.isnan(primeros), axis=1)]
+    ultimo = ultimos[filas, ultimos.shape[1] - 1 - np.argmax(~np.isnan(ultimos[:, ::-1]), axis=1)]
+    return primero, ultimo
+
+
+def resumen_desde_celdas(celdas, franja=CADENCIA_GRILLA):
+    """
+    Arma el resumen diario (mismas columnas que resumen_por_dia) a partir de un resumen por día y franja, por ejemplo
+    el que se calcula en la base de datos.
+
+    Parámetros:
+    - celdas: DataFrame con una fila por día y franja: 'dia', 'franja', 'filas', 'fecha_min', 'fecha_max', 'primero',
+      'ultimo', 'suma_dif', 'n_dif' y por cada canal de CANALES_RESUMEN {canal}_min, _max, _suma y _n
+    - franja: tamaño de las franjas
+
+    Retorna:
+    - DataFrame indexado por día de producción como el de resumen_por_dia
+    """
+    fechas_dia = pd.to_datetime(celdas["dia"])
+    dias = pd.DatetimeIndex(fechas_dia.unique(), name="dia").sort_values()
+    resumen = resumen_vacio(dias, franja)
+    if celdas.empty:
+        return resumen
+
+    fila = dias.get_indexer(fechas_dia)
+    columna_franja = celdas["franja"].to_numpy(dtype=np.int64)
+    arreglos = {}
+    for columna, nombre in [("filas", "filas_franja"), ("primero", "primeros"), ("ultimo", "ultimos"),
+                            ("suma_dif", "suma_dif"), ("n_dif", "n_dif")]:
+        arreglos[nombre] = np.stack(resumen[nombre].to_numpy())
+        valores = celdas[columna].to_numpy(dtype=float)
+        arreglos[nombre][fila, columna_franja] = valores if nombre in ("primeros", "ultimos") else np.nan_to_num(valores)
+        resumen[nombre] = list(arreglos[nombre])
+
+    por_dia = celdas.assign(fecha_min=pd.to_datetime(celdas["fecha_min"]),
+                            fecha_max=pd.to_datetime(celdas["fecha_max"])).groupby(fila)
+    resumen["filas"] = por_dia["filas"].sum().to_numpy(dtype=np.int64)
+    resumen["fecha_min"] = por_dia["fecha_min"].min().to_numpy(dtype="datetime64[ns]")
+    resumen["fecha_max"] = por_dia["fecha_max"].max().to_numpy(dtype="datetime64[ns]")
+    resumen["vol_primero"], resumen["vol_ultimo"] = extremos_franjas(arreglos["primeros"], arreglos["ultimos"])
+    resumen["consumo"] = resumen["vol_ultimo"] - resumen["vol_primero"]
+    for canal in CANALES_RESUMEN:
+        resumen[canal + "_min"] = por_dia[canal + "_min"].min().to_numpy(dtype=float)
+        resumen[canal + "_max"] = por_dia[canal + "_max"].max().to_numpy(dtype=float)
+        n = por_dia[canal + "_n"].sum().to_numpy(dtype=float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            resumen[canal + "_media"] = np.where(n > 0, por_dia[canal + "_suma"].sum().to_numpy(dtype=float) / n, np.nan)
+
+    return resumen
+
+
+def normalizar_resumen(resumen, inicio_dia=pd.Timedelta(hours=6), franja=CADENCIA_GRILLA, salto_maximo=None):
+    """
+    Aplica a un resumen diario la misma regla de normalizar_contador, a la resolución de las franjas: la secuencia
+    de primeros y últimos valores de cada franja (en orden de tiempo, de todos los días del resumen) se normaliza y
+    con ella se rearman los arreglos, los extremos del día y las sumas de diferencias por franja. Un reinicio dentro
+    de una franja descarta el consumo de esa franja hasta su último registro.
+
+    Parámetros:
+    - resumen: DataFrame de resumen_por_dia (o de resumen_desde_celdas) indexado por día
+    - inicio_dia: hora de inicio del día de producción del resumen
+    - franja: tamaño de las franjas del resumen
+    - salto_maximo: tasa máxima aceptada (unidades por minuto); por defecto la de normalizar_contador
+
+    Retorna:
+    - resumen: copia ordenada por día con los valores corregidos
+    - correcciones: DataFrame como el de normalizar_contador; la fecha es la del inicio o el final de la franja
+    """
+    resumen = resumen.sort_index().copy()
+    if resumen.empty:
+        vacio = pd.DataFrame({"fecha": pd.DatetimeIndex([]), "vol_corregido": np.array([], dtype=float)})
+        return resumen, normalizar_contador(vacio)[1]
+
+    primeros = np.stack(resumen["primeros"].to_numpy()).astype(float)
+    ultimos = np.stack(resumen["ultimos"].to_numpy()).astype(float)
+    filas = np.stack(resumen["filas_franja"].to_numpy())
+    franjas_dia = primeros.shape[1]
+
+    # Cada franja aporta su primer valor (al inicio de la franja) y su último (al final, si tiene varios registros)
+    inicio = resumen.index.to_numpy(dtype="datetime64[ns]") + pd.Timedelta(inicio_dia).to_timedelta64()
+    inicio_franja = inicio[:, None] + np.arange(franjas_dia) * franja.to_timedelta64()
+    fin_franja = inicio_franja + np.where(filas > 1, (franja - pd.Timedelta(minutes=1)).to_timedelta64(),
+                                          np.timedelta64(0, "ns"))
+    valores = np.stack([primeros, ultimos], axis=2).ravel()
+    fechas = np.stack([inicio_franja, fin_franja], axis=2).ravel()
+    validos = ~np.isnan(valores)
+    puntos, correcciones = normalizar_contador(pd.DataFrame({"fecha": fechas[validos], "vol_corregido": valores[validos]}),
+                                               salto_maximo=salto_maximo)
+    valores[validos] = puntos["vol_corregido"].to_numpy()
+    valores = valores.reshape(len(resumen), franjas_dia, 2)
+    primeros, ultimos = valores[:, :, 0], valores[:, :, 1]
+
+    # Suma de diferencias de cada franja: desde el último valor de la franja anterior con datos del mismo día
+    anterior = pd.DataFrame(ultimos).ffill(axis=1).shift(1, axis=1).to_numpy()
+    suma_dif = np.where(np.isnan(anterior), ultimos - primeros, ultimos - anterior)
+
+    resumen["primeros"] = list(primeros)
+    resumen["ultimos"] = list(ultimos)
+    resumen["suma_dif"] = list(np.nan_to_num(suma_dif))
+    resumen["vol_primero"], resumen["vol_ultimo"] = extremos_franjas(primeros, ultimos)
+    resumen["consumo"] = resumen["vol_ultimo"] - resumen["vol_primero"]
+    return resumen, correcciones
+
+
+def perfil_por_franja(dataframes, inicio_dia=pd.Timedelta(hours=6), franja=CADENCIA_GRILLA, percentiles=(10, 90)):
+    """
+    Perfil de consumo por franja del día de producción para varias series en una sola pasada. La franja de cada
+    registro es un código entero (minutos desde el inicio del día // 30) y el consumo es la diferencia de
+    vol_corregido con el registro anterior de la misma serie, asignada a la franja del registro. No modifica los
+    DataFrames de entrada.
+
+    Parámetros:
+    - dataframes: diccionario {nombre: DataFrame con 'fecha' y 'vol_corregido' ordenado por fecha}
+    - inicio_dia: hora de inicio del día de producción
+    - franja: tamaño de la franja (30 minutos por defecto)
+    - percentiles: percentiles inferior y superior de la banda
+
+    Retorna:
+    - diccionario {nombre: DataFrame indexado por franja (0 = inicio del día) con 'media', 'mediana', 'p{inferior}',
+      'p{superior}' y 'n'}
+    """
+    franjas_dia = max(int(pd.Timedelta(days=1) // franja), 1)
+    nombres = list(dataframes)
+    claves, diferencias = [], []
+    for i, df in enumerate(dataframes.values()):
+        fechas = df["fecha"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        codigo = ((fechas - pd.Timedelta(inicio_dia).value) % pd.Timedelta(days=1).value) // franja.value
+        claves.append(i * franjas_dia + codigo)
+        diferencias.append(np.diff(df["vol_corregido"].to_numpy(dtype=float), prepend=np.nan))
+
+    claves = np.concatenate(claves) if claves else np.array([], dtype=np.int64)
+    grupos = pd.Series(np.concatenate(diferencias) if diferencias else np.array([])).groupby(claves)
+    inferior, superior = [q / 100 for q in percentiles]
+    cuantiles = grupos.quantile([inferior, 0.5, superior]).unstack().reindex(columns=[inferior, 0.5, superior])
+
+    estadisticas = pd.DataFrame({
+        "media": grupos.mean(),
+        "mediana": cuantiles[0.5],
+        "p{}".format(percentiles[0]): cuantiles[inferior],
+        "p{}".format(percentiles[1]): cuantiles[superior],
+        "n": grupos.count(),
+    }).reindex(np.arange(len(nombres) * franjas_dia))
+    estadisticas["n"] = estadisticas["n"].fillna(0).astype(int)
+
+    return {nombre: estadisticas.iloc[i * franjas_dia:(i + 1) * franjas_dia].set_axis(np.arange(franjas_dia)).rename_axis("franja")
+            for i, nombre in enumerate(nombres)}
+
+
+MESES = {
+    1: "Enero", 2: "Febrero", 3: "Marzo", 4: "Abril", 5: "Mayo", 6: "Junio",
+    7: "Julio", 8: "Agosto", 9: "Septiembre", 10: "Octubre", 11: "Noviembre", 12: "Diciembre"
+}
+
+
+def indice_semanas(df_diario):
+    """
+    Índice de semanas ISO (lunes a domingo) de una tabla diaria, armado con un solo groupby.
+
+    Parámetros:
+    - df_diario: DataFrame con la columna 'fecha' ordenado por fecha (por ejemplo la salida de calcular_consumo_diario)
+
+    Retorna:
+    - DataFrame indexado por semana ("2025-W09") con 'inicio' y 'fin' (primera y última fecha con datos),
+      'etiqueta' ("Semana del 24 de Febrero al 02 de Marzo", con el año si el rango tiene varios años) y
+      'desde'/'hasta' (filas de df_diario de la semana: df_diario.iloc[desde:hasta])
+    """
+    fechas = pd.to_datetime(df_diario["fecha"]).reset_index(drop=True)
+    if fechas.empty:
+        return pd.DataFrame(columns=["inicio", "fin", "etiqueta", "desde", "hasta"])
+
+    iso = fechas.dt.isocalendar()
+    semana = iso["year"].astype(str) + "-W" + iso["week"].astype(str).str.zfill(2)
+    grupos = pd.DataFrame({"fecha": fechas, "fila": np.arange(len(fechas))}).groupby(semana.to_numpy(), sort=True)
+    indice = grupos.agg(inicio=("fecha", "min"), fin=("fecha", "max"), desde=("fila", "min"), hasta=("fila", "max"))
+    indice["hasta"] += 1
+    indice.index.name = "semana"
+
+    con_anio = fechas.dt.year.nunique() > 1
+    formato = lambda serie: (serie.dt.strftime("%d") + " de " + serie.dt.month.map(MESES)
+                             + ((" de " + serie.dt.year.astype(str)) if con_anio else ""))
+    indice["etiqueta"] = "Semana del " + formato(indice["inicio"]) + " al " + formato(indice["fin"])
+
+    return indice[["inicio", "fin", "etiqueta", "desde", "hasta"]]
+
 
-    df_erm["fecha"] = pd.to_datetime(df_erm["fecha"], errors="coerce")
-    df_interno["fecha"] = pd.to_datetime(df_interno["fecha"], errors="coerce")
-    df_horno["fecha"] = pd.to_datetime(df_horno["fecha"], errors="coerce")
+# Cache de métricas derivadas ------------------------------------------------------------------------------------------
+# Tablas calculadas a partir de los medidores procesados (consumo diario, perfiles, grillas...), compartidas por
+# main.py y todas las pestañas. La clave es la huella del contenido de los DataFrames más los parámetros de la métrica,
+# así que dos consultas con los mismos datos reutilizan el resultado. Se desalojan las menos usadas al pasar el límite
+# de memoria (MEMORIA_METRICAS_MB). Los resultados se comparten: quien los use no debe modificarlos.
+MEMORIA_METRICAS_MB = 256
 
-    # Ordenar los datos por fecha ---------------------------------------------------------------
-    df_erm.sort_values(by='fecha', ascending=True, inplace=True)
-    df_interno.sort_values(by='fecha', ascending=True, inplace=True)
-    df_horno.sort_values(by='fecha', ascending=True, inplace=True)
+_metricas = OrderedDict()
+_metricas_lock = threading.Lock()
+_metricas_estadisticas = {"aciertos": 0, "fallos": 0, "desalojos": 0, "bytes": 0}
+# Huella por objeto (id del DataFrame), se borra cuando el DataFrame deja de existir
+_huellas = {}
 
-    df_erm.reset_index(drop=True, inplace=True)
-    df_interno.reset_index(drop=True, inplace=True)
-    df_horno.reset_index(drop=True, inplace=True)
 
-    # Convertir la ausencia de datos (0) en Nan -------------------------------------------------------------------------------
+def huella(df):
+    """
+    Huella del contenido de un DataFrame (columnas, tipos, índice y valores). Se calcula una vez por objeto; los
+    DataFrames de entrada se tratan como de solo lectura.
 
-    df_erm['vol_corregido'] = df_erm['vol_corregido'].replace(0, np.nan)
-    df_interno['vol_corregido'] = df_interno['vol_corregido'].replace(0, np.nan)
-    df_horno['vol_corregido'] = df_horno['vol_corregido'].replace(0, np.nan)
+    Parámetros:
+    - df: DataFrame
 
-    df_erm['presion'] = df_erm['presion'].replace(0, np.nan)
-    df_interno['presion'] = df_interno['presion'].replace(0, np.nan)
-    df_horno['presion'] = df_horno['presion'].replace(0, np.nan)
+    Retorna:
+    - texto hexadecimal de 32 caracteres
+    """
+    clave = id(df)
+    guardada = _huellas.get(clave)
+    if guardada is not None:
+        return guardada
 
-    df_erm['temperatura'] = df_erm['temperatura'].replace(0, np.nan)
-    df_interno['temperatura'] = df_interno['temperatura'].replace(0, np.nan)
-    df_horno['temperatura'] = df_horno['temperatura'].replace(0, np.nan)
+    resumen = hashlib.blake2b(digest_size=16)
+    resumen.update(repr((df.shape, list(df.columns), [str(t) for t in df.dtypes])).encode())
+    for serie in [df.index.to_series()] + [df[c] for c in df.columns]:
+        valores = serie.to_numpy()
+        if valores.dtype == object:
+            valores = pd.util.hash_pandas_object(serie, index=False).to_numpy()
+        resumen.update(np.ascontiguousarray(valores).view(np.uint8))
+    guardada = resumen.hexdigest()
 
-    # llenar los Na con valores superiores y si no hay con inferiores ---------------------------------------------------------
-    df_erm["vol_corregido"] = df_erm["vol_corregido"].ffill().bfill()
-    df_interno["vol_corregido"] = df_interno["vol_corregido"].ffill().bfill()
-    df_horno["vol_corregido"] = df_horno["vol_corregido"].ffill().bfill()
+    _huellas[clave] = guardada
+    weakref.finalize(df, _huellas.pop, clave, None)
+    return guardada
 
-    df_erm["presion"] = df_erm["presion"].ffill().bfill()
-    df_interno["presion"] = df_interno["presion"].ffill().bfill()
-    df_horno["presion"] = df_horno["presion"].ffill().bfill()
 
-    df_erm["temperatura"] = df_erm["temperatura"].ffill().bfill()
-    df_interno["temperatura"] = df_interno["temperatura"].ffill().bfill()
-    df_horno["temperatura"] = df_horno["temperatura"].ffill().bfill()
+def tamano_objeto(valor):
+    """
+    Memoria aproximada en bytes de un resultado (DataFrame, Series, arreglo o diccionarios/listas de ellos).
+    """
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        return int(np.sum(valor.memory_usage(deep=True, index=True)))
+    if isinstance(valor, np.ndarray):
+        return valor.nbytes
+    if isinstance(valor, dict):
+        return sum(tamano_objeto(v) for v in valor.values())
+    if isinstance(valor, (list, tuple)):
+        return sum(tamano_objeto(v) for v in valor)
+    return 64
 
-    df_interno["temperatura"] = df_interno["temperatura"].astype(str)
-    df_interno["temperatura"] = df_interno["temperatura"].str.replace(",", ".").astype(float)
 
-    df_erm["temperatura"] = df_erm["temperatura"].astype(str)
-    df_erm["temperatura"] = df_erm["temperatura"].str.replace(",", ".").astype(float)
+def metrica_derivada(metrica, funcion, dataframes, **parametros):
+    """
+    Devuelve funcion(dataframes, **parametros) desde la cache de métricas o la calcula y la guarda.
 
-    df_interno["presion"] = df_interno["presion"].astype(str)
-    df_interno["presion"] = df_interno["presion"].str.replace(",", ".").astype(float)
+    Parámetros:
+    - metrica: nombre de la métrica (parte de la clave)
+    - funcion: función que recibe los DataFrames (o el diccionario) y los parámetros
+    - dataframes: DataFrame o diccionario {nombre: DataFrame}
+    - parametros: parámetros de la métrica (deben ser hashables)
 
-    df_erm["presion"] = df_erm["presion"].astype(str)
-    df_erm["presion"] = df_erm["presion"].str.replace(",", ".").astype(float)
+    Retorna:
+    - el resultado de la función (compartido, no modificar)
+    """
+    if isinstance(dataframes, dict):
+        huellas = tuple((k, huella(df)) for k, df in dataframes.items())
+    else:
+        huellas = huella(dataframes)
+    clave = (metrica, huellas, tuple(sorted(parametros.items())))
 
-    # Eliminar los segundos de los registros ------------------------------------------------------------------------------------
-    df_erm["fecha"] = pd.to_datetime(df_erm["fecha"], errors="coerce")
-    df_erm["fecha"] = df_erm["fecha"].dt.floor("min")
-    df_interno["fecha"] = pd.to_datetime(df_interno["fecha"], errors="coerce")
-    df_interno["fecha"] = df_interno["fecha"].dt.floor("min")
-    df_horno["fecha"] = pd.to_datetime(df_horno["fecha"], errors="coerce")
-    df_horno["fecha"] = df_horno["fecha"].dt.floor("min")
+    with _metricas_lock:
+        if clave in _metricas:
+            _metricas.move_to_end(clave)
+            _metricas_estadisticas["aciertos"] += 1
+            return _metricas[clave][0]
+        _metricas_estadisticas["fallos"] += 1
 
-    df_byc["fecha"] = df_interno["fecha"]
-    df_pisos["fecha"] = df_erm["fecha"]
+    resultado = funcion(dataframes, **parametros)
+    tamano = tamano_objeto(resultado)
+    limite = float(os.environ.get("MEMORIA_METRICAS_MB", MEMORIA_METRICAS_MB)) * 2**20
 
-    df_pisos = df_pisos.sort_values("fecha")
-    df_byc = df_byc.sort_values("fecha")
+    with _metricas_lock:
+        if clave not in _metricas and tamano <= limite:
+            _metricas[clave] = (resultado, tamano)
+            _metricas_estadisticas["bytes"] += tamano
+            while _metricas_estadisticas["bytes"] > limite:
+                _, (_, liberado) = _metricas.popitem(last=False)
+                _metricas_estadisticas["bytes"] -= liberado
+                _metricas_estadisticas["desalojos"] += 1
 
-    df_byc["fecha"] = pd.to_datetime(df_byc["fecha"], errors="coerce")
-    df_byc = df_byc.dropna(subset=["fecha"])
+    return resultado
 
-    df_pisos["fecha"] = pd.to_datetime(df_pisos["fecha"], errors="coerce")
-    df_pisos = df_pisos.dropna(subset=["fecha"])
 
-    # Calcular valores de ByC y PyP ----------------------------------------------------------------------------------------------------
+def estadisticas_metricas():
+    """
+    Aciertos, fallos, desalojos, bytes ocupados y número de entradas de la cache de métricas derivadas.
+    """
+    with _metricas_lock:
+        return dict(_metricas_estadisticas, entradas=len(_metricas))
 
-    df_byc["vol_corregido"] = df_interno["vol_corregido"] + df_horno["vol_corregido"]
-    df_pisos["vol_corregido"] = df_erm["vol_corregido"] - df_interno["vol_corregido"]
 
-    return df_erm , df_interno,df_horno, df_byc, df_pisos
\ No newline at end of file
+def limpiar_metricas():
+    """
+    Vacía la cache de métricas derivadas.
+    """
+    with _metricas_lock:
+        _metricas.clear()
+        _metricas_estadisticas["bytes"] = 0
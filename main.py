@@ -14,8 +14,7 @@ df_erm_sql = pd.DataFrame(columns=["fecha", "vol_corregido","flujo_corregido","p
 df_interno_sql = pd.DataFrame(columns=["fecha", "vol_corregido","flujo_corregido","presion","temperatura"])
 df_horno_sql = pd.DataFrame(columns=["fecha", "vol_corregido","flujo_corregido","presion","temperatura"])
 
-df_byc = pd.DataFrame(columns=["fecha", "vol_corregido"])
-df_pisos = pd.DataFrame(columns=["fecha", "vol_corregido"])
+agregados = None
 
 # --- Definir el rango de fechas ---
 fecha_hoy = datetime.today().date()
@@ -83,86 +82,60 @@ if submit_button:
         else:
             st.write("Ejecutando análisis del día ", fecha_final)
 
-        # --- Obtener los datos de SQL ---
-        df_erm_sql = carga_datos(tipo, fecha_inicio, fecha_final, "gas_ERM", redownload)
-        df_interno_sql = carga_datos(tipo, fecha_inicio, fecha_final, "gas_INT", redownload)
-        df_horno_sql = carga_datos(tipo, fecha_inicio, fecha_final, "gas_H5", redownload)
-
-
-df_erm,df_interno,df_horno,df_byc,df_pisos = procesar_datos(df_erm_sql,df_interno_sql,df_horno_sql,df_byc,df_pisos)
-
-# Guardar los dataframes en session_state para que persistan
-st.session_state['df_erm'] = df_erm
-st.session_state['df_interno'] = df_interno
-st.session_state['df_horno'] = df_horno
-st.session_state['df_byc'] = df_byc
-st.session_state['df_pisos'] = df_pisos
-st.session_state['datos_cargados'] = True
-
-# Verificar si los datos ya están cargados (después de presionar el botón o en recargas)
-if 'datos_cargados' in st.session_state and st.session_state['datos_cargados']:
-    # Recuperar los dataframes desde session_state
-    df_erm = st.session_state['df_erm']
-    df_interno = st.session_state['df_interno']
-    df_horno = st.session_state['df_horno']
-    df_byc = st.session_state['df_byc']
-    df_pisos = st.session_state['df_pisos']
-
-# -------------------------------------------------------------------------------------------------------------------------------------------------------------------
-# Aplicar la función a cada DataFrame
-df_byc_dia = calcular_consumo_diario(df_byc)
-df_pisos_dia = calcular_consumo_diario(df_pisos)
-df_erm_dia = calcular_consumo_diario(df_erm)
-df_interno_dia = calcular_consumo_diario(df_interno)
-df_horno_dia = calcular_consumo_diario(df_horno)
-#-----------------------------------------------------
-df_erm.drop_duplicates(inplace=True)
-df_interno.drop_duplicates(inplace=True)
-df_horno.drop_duplicates(inplace=True)
-df_byc.drop_duplicates(inplace=True)
-df_pisos.drop_duplicates(inplace=True)
-
-
-# Crear DataFrame para la suma total
-df = pd.DataFrame(columns=["vol_dias"])
-df["vol_dias"] = (
-    df_byc_dia["vol_dias"] +
-    df_pisos_dia["vol_dias"] +
-    df_erm_dia["vol_dias"] +
-    df_interno_dia["vol_dias"] +
-    df_horno_dia["vol_dias"]
-)
-
-# Formatear fechas a "Día-Mes" en cada DataFrame
-for df_seccion in [df_byc_dia, df_pisos_dia, df_erm_dia, df_interno_dia, df_horno_dia]:
-    df_seccion["fecha_label"] = df_seccion["fecha"].dt.strftime("%d-%m")
-    df_seccion["fecha_label"] = pd.Categorical(df_seccion["fecha_label"], ordered=True)
-
-#-------------------------------------------------------------------------------------------------------------------------------------
-
-
-
-st.session_state['df_byc']=df_byc
-st.session_state['df_pisos']=df_pisos
-
-data = {
-    "byc": df_byc,
-    "pisos": df_pisos,
-    "erm": df_erm,
-    "interno": df_interno,
-    "horno": df_horno,
-    "byc_dia": df_byc_dia,
-    "pisos_dia": df_pisos_dia,
-    "erm_dia": df_erm_dia,
-    "interno_dia": df_interno_dia,
-    "horno_dia": df_horno_dia
-}
-
-
-if df_byc.empty:
+        # --- Obtener los datos de SQL (las tres tablas en paralelo) ---
+        # Los rangos largos se resumen en la base de datos en lugar de traer los registros crudos
+        if tipo == "rango_planta" and (fecha_final - fecha_inicio).days + 1 > DIAS_MODO_AGREGADO:
+            st.info(f"Rango mayor a {DIAS_MODO_AGREGADO} días: se muestran los resúmenes diarios (cache local y base de datos).")
+            lote = carga_agregados(fecha_inicio, fecha_final, TABLAS_TABLERO)
+            agregados = lote["datos"]
+        else:
+            lote = carga_datos_lote(tipo, fecha_inicio, fecha_final, TABLAS_TABLERO, redownload)
+            df_erm_sql = lote["datos"]["gas_ERM"]
+            df_interno_sql = lote["datos"]["gas_INT"]
+            df_horno_sql = lote["datos"]["gas_H5"]
+
+        for table, error in lote["errores"].items():
+            st.error(f"No se pudieron cargar los datos de {table}: {error}")
+        st.caption("Tiempos de carga: " + ", ".join(f"{table} {seg:.1f} s" for table, seg in lote["tiempos"].items()))
+
+        # Guardar la consulta: cambiar de pestaña o mover un control vuelve a ejecutar el script sin pulsar el botón.
+        # Los datos quedan en los tableros compartidos entre sesiones; la sesión solo guarda la huella
+        clave = registrar_consulta({
+            "tipo": tipo, "fecha_inicio": fecha_inicio, "fecha_final": fecha_final, "agregados": agregados,
+            "erm": df_erm_sql, "interno": df_interno_sql, "horno": df_horno_sql,
+        })
+        st.session_state['consulta'] = {"tipo": tipo, "fecha_inicio": fecha_inicio, "fecha_final": fecha_final,
+                                         "clave": clave}
+
+consulta = st.session_state.get('consulta')
+if consulta is not None and not tablero_disponible(consulta["clave"]):
+    st.info("Los datos de la última consulta se liberaron de la memoria. Pulse Analizar para cargarlos de nuevo.")
+    consulta = None
+if consulta is not None:
+    tipo, fecha_inicio, fecha_final = consulta["tipo"], consulta["fecha_inicio"], consulta["fecha_final"]
+
+# Medidores procesados, tablas diarias y salud: solo se procesan con una consulta nueva
+data, correcciones = datos_tablero(consulta["clave"] if consulta is not None else None)
+df_byc = data["byc"]
+
+if df_byc.empty and data.get("modo") != "agregado":
     st.warning("⚠️ Seleccione datos para analizar ⚠️ ️")
 
 else:
-    salud = calcular_salud(df_byc, fecha_inicio, fecha_final)
-    st.metric(label="Salud de los Datos", value=f"{salud:.2f}%")
-    mostrar_tabs(data, fecha_inicio, fecha_final, tipo)
\ No newline at end of file
+    faltantes = data.get("salud_faltantes")
+    ayuda = ", ".join(f"{nombre}: {len(f)} registros faltantes" for nombre, f in faltantes.items()) if faltantes else None
+    st.metric(label="Salud de los Datos", value=f"{data['salud']:.2f}%", help=ayuda)
+    if not correcciones.empty:
+        with st.expander(f"Correcciones de contador ({len(correcciones)})"):
+            st.dataframe(correcciones, hide_index=True)
+    mostrar_tabs(data, fecha_inicio, fecha_final, tipo)
+with st.expander("Diagnóstico de conexión SQL"):
+    st.json(estadisticas_engine())
+    st.caption("Bloques diarios en memoria")
+    st.json(estadisticas_bloques())
+    st.caption("Cache de métricas derivadas")
+    st.json(estadisticas_metricas())
+    st.caption("Cache de figuras")
+    st.json(estadisticas_figuras())
+    st.caption("Consultas compartidas entre sesiones")
+    st.dataframe(pd.DataFrame(estadisticas_tableros()), hide_index=True)
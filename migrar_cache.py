@@ -0,0 +1,10 @@
+# MIGRACIÓN DE LOS CSV DIARIOS A LA CACHE COLUMNAR
+# Uso: python migrar_cache.py [directorio]
+# ----------------------------------------------------------------------------------------------------------------------
+import sys
+
+from Utils import migrar_csv_a_parquet
+
+if __name__ == "__main__":
+    directorio = sys.argv[1] if len(sys.argv) > 1 else "./data"
+    migrar_csv_a_parquet(directorio)
@@ -0,0 +1,157 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datos import (TOLERANCIA_UNION, consumo_por_dia, indice_semanas, normalizar_contador, perfil_por_franja,
+                   procesar_datos, reducir_serie, salud_desde_franjas, salud_medidores, unir_medidores)
+
+
+def medidor(fechas, inicio=1000.0, paso=1.0):
+    fechas = pd.DatetimeIndex(fechas)
+    return pd.DataFrame({
+        "fecha": fechas,
+        "vol_corregido": inicio + paso * np.arange(len(fechas), dtype=float),
+        "presion": 1.0,
+        "temperatura": 20.0,
+    })
+
+
+def totales_por_franja(perfil):
+    return (perfil["media"].fillna(0) * perfil["n"]).to_numpy()
+
+
+def test_union_registros_por_minuto_conserva_todos():
+    fechas = pd.date_range("2025-03-01 06:30", periods=600, freq="min")
+    *_, byc, pisos, _ = procesar_datos(medidor(fechas), medidor(fechas), medidor(fechas))
+
+    assert len(byc) == 600
+    assert len(pisos) == 600
+    assert np.allclose(np.diff(byc["vol_corregido"]), 2.0)
+
+
+def test_union_cadencias_mixtas_suma_de_partes():
+    # Interno cada minuto (1 m3/min), horno cada 5 minutos (2 m3/min) y ERM cada minuto (4 m3/min), tres días
+    por_minuto = pd.date_range("2025-03-01 06:00", periods=3 * 1440, freq="min")
+    cada_5 = pd.date_range("2025-03-01 06:00", periods=3 * 288, freq="5min")
+    erm, interno, horno, byc, pisos, _ = procesar_datos(medidor(por_minuto, paso=4.0), medidor(por_minuto),
+                                                        medidor(cada_5, paso=10.0))
+
+    # La grilla es la unión de las fechas: un registro por minuto
+    assert len(byc) == len(pisos) == 3 * 1440
+    perfiles = perfil_por_franja({"byc": byc, "pisos": pisos, "erm": erm, "interno": interno, "horno": horno})
+    assert np.allclose(perfiles["byc"]["media"].iloc[1:-1], 3.0)
+    assert np.allclose(perfiles["pisos"]["media"].iloc[1:-1], 3.0)
+
+    # El consumo de cada franja de la serie derivada es la suma del de sus partes
+    total_byc = totales_por_franja(perfiles["interno"]) + totales_por_franja(perfiles["horno"])
+    assert np.isclose(totales_por_franja(perfiles["byc"]).sum(), total_byc.sum())
+    assert np.allclose(totales_por_franja(perfiles["byc"])[1:-1], total_byc[1:-1])
+    total_pisos = totales_por_franja(perfiles["erm"]) - totales_por_franja(perfiles["interno"])
+    assert np.allclose(totales_por_franja(perfiles["pisos"]), total_pisos)
+
+
+def test_union_rafagas_conserva_cada_minuto():
+    # Ráfagas de 10 registros por minuto cada hora, con un medidor desfasado un minuto
+    rafagas = [pd.Timestamp("2025-03-01 00:00") + pd.Timedelta(hours=h) for h in range(24)]
+    fechas = [r + pd.Timedelta(minutes=m) for r in rafagas for m in range(10)]
+    desfasadas = [f + pd.Timedelta(minutes=1) for f in fechas]
+    ancho = unir_medidores({"erm": medidor(fechas), "interno": medidor(desfasadas)})
+
+    # Cada ráfaga cubre 11 minutos distintos y en todos hay un registro cercano de ambos medidores
+    assert len(ancho) == 24 * 11
+    assert ancho.notna().all().all()
+    assert (np.diff(ancho.index.to_numpy()) >= TOLERANCIA_UNION.to_timedelta64() / 5).all()
+
+
+def test_reducir_serie_mismo_instante():
+    fechas = np.full(5000, np.datetime64("2025-03-01T06:30", "ns"))
+    valores = np.arange(5000, dtype=float)
+    x, y, reducida = reducir_serie(fechas, valores, puntos=100)
+
+    assert reducida
+    assert list(y) == [0.0, 4999.0]
+
+
+def test_reducir_serie_avisa_si_reduce():
+    fechas = pd.date_range("2025-03-01", periods=5000, freq="min")
+    *_, reducida = reducir_serie(fechas, np.sin(np.arange(5000)), puntos=1000)
+    assert reducida
+
+    # Una serie reducida puede quedar con menos puntos que el máximo; una corta no se reduce
+    x, _, reducida = reducir_serie(fechas[:50], np.arange(50), puntos=1000)
+    assert not reducida and len(x) == 50
+
+
+def ocupacion_por_franja(fechas):
+    desde_inicio = pd.DatetimeIndex(fechas) - pd.Timedelta(hours=6)
+    celdas = pd.DataFrame({"dia": desde_inicio.normalize(),
+                           "franja": (desde_inicio - desde_inicio.normalize()) // pd.Timedelta(minutes=30)})
+    return celdas.groupby(["dia", "franja"]).size().rename("filas").reset_index()
+
+
+def test_salud_desde_franjas_usa_la_cadencia_del_medidor():
+    por_minuto = pd.date_range("2025-03-01 06:00", "2025-03-03 05:59", freq="min")
+    cada_5 = pd.date_range("2025-03-01 06:00", "2025-03-03 05:59", freq="5min")
+    cada_5 = cada_5[(cada_5 < pd.Timestamp("2025-03-02 08:00")) | (cada_5 >= pd.Timestamp("2025-03-02 14:00"))]
+    medidores = {"uno": pd.DataFrame({"fecha": por_minuto}), "cinco": pd.DataFrame({"fecha": cada_5})}
+
+    franjas = salud_desde_franjas({nombre: ocupacion_por_franja(df["fecha"]) for nombre, df in medidores.items()},
+                                  "2025-03-01", "2025-03-02")
+    crudo = salud_medidores(medidores, "2025-03-01", "2025-03-02")
+
+    assert franjas["cadencia"] == {"uno": pd.Timedelta(minutes=1), "cinco": pd.Timedelta(minutes=5)}
+    assert np.allclose(franjas["general"], crudo["general"])
+    assert np.allclose(franjas["dia"], crudo["dia"])
+    assert franjas["general"]["uno"] == 100
+
+
+def test_normalizar_contador_reinicio_y_pico():
+    df = medidor(pd.date_range("2025-03-01 06:00", periods=200, freq="30min"), inicio=5000.0, paso=10.0)
+    # Un solo registro con un pico que vuelve a la serie y después un reinicio del contador a 0
+    df.loc[100, "vol_corregido"] += 1e6
+    df.loc[150:, "vol_corregido"] -= df.loc[150, "vol_corregido"]
+
+    normalizado, correcciones = normalizar_contador(df.copy())
+
+    valores = normalizado["vol_corregido"].to_numpy()
+    assert (np.diff(valores) >= 0).all()
+    # Se pierden solo los pasos corregidos: la subida del pico, la bajada de vuelta y el reinicio
+    assert valores[-1] == 5000.0 + 10.0 * (199 - 3)
+    assert list(correcciones["tipo"]) == ["salto", "reinicio", "reinicio"]
+    assert list(correcciones["fecha"]) == list(df["fecha"].iloc[[100, 101, 150]])
+
+
+def consumo_anterior(df):
+    # Versión anterior: día ajustado con apply por fila y último menos primero con iloc
+    ajustada = df["fecha"].apply(lambda x: x.date() if x.hour > 6 or (x.hour == 6 and x.minute >= 30)
+                                 else (x - pd.Timedelta(days=1)).date())
+    return df.groupby(ajustada).agg(vol_dias=("vol_corregido", lambda x: x.iloc[-1] - x.iloc[0]))["vol_dias"]
+
+
+def test_consumo_por_dia_igual_al_groupby_anterior():
+    rng = np.random.default_rng(8)
+    fechas = pd.date_range("2025-02-27 05:00", "2025-03-04 08:00", freq="7min")
+    df = medidor(fechas[rng.random(len(fechas)) > 0.3], paso=3.0)
+    df["vol_corregido"] += rng.random(len(df))
+
+    # Ordenado por fecha y desordenado (el primero y el último se toman en el orden del DataFrame)
+    for datos in (df, df.sample(frac=1, random_state=8)):
+        anterior = consumo_anterior(datos)
+        nuevo = consumo_por_dia(datos)["vol_corregido"]
+        assert list(nuevo.index.date) == list(anterior.index)
+        assert np.allclose(nuevo.to_numpy(), anterior.to_numpy())
+
+
+def test_indice_semanas_cruza_el_cambio_de_anio():
+    diario = pd.DataFrame({"fecha": pd.date_range("2024-12-28", "2025-01-08")})
+
+    indice = indice_semanas(diario)
+
+    assert list(indice.index) == ["2024-W52", "2025-W01", "2025-W02"]
+    assert list(indice["desde"]) == [0, 2, 9]
+    assert list(indice["hasta"]) == [2, 9, 12]
+    assert indice.loc["2025-W01", "etiqueta"] == "Semana del 30 de Diciembre de 2024 al 05 de Enero de 2025"
@@ -0,0 +1,303 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("pyodbc", exc_type=ImportError)
+
+import Utils
+from datos import consumo_por_dia, normalizar_contador, normalizar_resumen, resumen_por_dia
+from Utils import HORA_INICIO_DIA, agregado_desde_resumen, agregados_tabla, estadisticas_engine, find_load
+
+
+@pytest.fixture
+def base(tmp_path):
+    """
+    Base SQLite con las tablas de los medidores y un directorio de cache propio. Devuelve una función que escribe
+    una tabla y el directorio de la cache.
+    """
+    url = "sqlite:///" + str(tmp_path / "prueba.db")
+    Utils.reiniciar_engine(url)
+
+    def escribir(table, df):
+        datos = df.assign(fecha=df["fecha"].dt.strftime("%Y-%m-%d %H:%M:%S.000"))
+        datos.to_sql(table, Utils.obtener_engine(), if_exists="replace", index=False)
+
+    yield escribir, str(tmp_path / "data")
+    Utils.reiniciar_engine()
+
+
+def consultas():
+    return estadisticas_engine().get("consultas", 0)
+
+
+def contador(inicio, dias, cadencia="30min", paso=10.0):
+    fechas = pd.date_range(inicio, periods=int(pd.Timedelta(days=dias) // pd.Timedelta(cadencia)), freq=cadencia)
+    return pd.DataFrame({
+        "fecha": fechas,
+        "vol_corregido": 5000.0 + paso * np.arange(len(fechas)),
+        "flujo_corregido": 1.0,
+        "presion": 1.0,
+        "temperatura": 20.0,
+    })
+
+
+def consumo_agregado(df, minutos_inicio=HORA_INICIO_DIA * 60 + 30):
+    resumen, correcciones = normalizar_resumen(resumen_por_dia(df))
+    diario = agregado_desde_resumen(resumen, "diario", minutos_inicio).set_index("dia")
+    return (diario["vol_ultimo"] - diario["vol_primero"]), correcciones
+
+
+def consumo_crudo(df):
+    normalizado, correcciones = normalizar_contador(df.copy())
+    return consumo_por_dia(normalizado)["vol_corregido"], correcciones
+
+
+def test_reinicio_y_salto_mismo_consumo_en_ambos_modos():
+    df = contador("2025-03-01 06:00", 4)
+    reinicio = df["fecha"] >= pd.Timestamp("2025-03-02 14:00")
+    df.loc[reinicio, "vol_corregido"] -= 5100.0
+    salto = df["fecha"] >= pd.Timestamp("2025-03-03 09:30")
+    df.loc[salto, "vol_corregido"] += 7.2e7
+
+    crudo, correcciones_crudo = consumo_crudo(df)
+    agregado, correcciones_agregado = consumo_agregado(df)
+
+    dias = crudo.index.intersection(agregado.index)
+    assert len(dias) >= 3
+    assert np.allclose(agregado[dias], crudo[dias])
+    assert (agregado[dias] >= 0).all() and agregado[dias].max() < 1000
+    assert list(correcciones_agregado["tipo"]) == list(correcciones_crudo["tipo"]) == ["reinicio", "salto"]
+
+
+def test_reinicio_registros_por_minuto_en_el_borde_de_franja():
+    df = contador("2025-03-01 06:00", 3, cadencia="1min", paso=1.0)
+    df.loc[df["fecha"] >= pd.Timestamp("2025-03-02 10:00"), "vol_corregido"] -= 9000.0
+
+    crudo, _ = consumo_crudo(df)
+    agregado, _ = consumo_agregado(df)
+
+    dias = crudo.index.intersection(agregado.index)
+    assert np.allclose(agregado[dias], crudo[dias])
+
+
+def test_dia_final_vacio_queda_resumido(base):
+    escribir, directorio = base
+    df = contador("2024-12-31 06:00", 12)
+    escribir("gas_ERM", df[(df["fecha"] < pd.Timestamp("2025-01-05 06:00")) | (df["fecha"] >= pd.Timestamp("2025-01-06 06:00"))])
+    find_load("rango_planta", "2025-01-01", "2025-01-10", "gas_ERM", False, directorio)
+
+    agregados_tabla("gas_ERM", "2025-01-01", "2025-01-09", directorio)
+    antes = consultas()
+    agregados = agregados_tabla("gas_ERM", "2025-01-01", "2025-01-09", directorio)
+
+    # Todo sale del resumen de la cache, incluido el día sin registros
+    assert consultas() == antes
+    diario = agregados["diario_6"].set_index("dia")
+    assert diario.loc["2025-01-05", "filas"] == 0
+    assert len(diario) == 9
+
+
+def test_migracion_escribe_el_manifiesto_una_vez(tmp_path, monkeypatch):
+    directorio = str(tmp_path / "data")
+    df = contador("2025-01-01 06:00", 6)
+    for day in pd.date_range("2025-01-01", "2025-01-05").strftime("%Y-%m-%d"):
+        carpeta = tmp_path / ("data" + day[:-3])
+        carpeta.mkdir(exist_ok=True)
+        dia = df[(df["fecha"] >= pd.Timestamp(day) + pd.Timedelta(hours=6))
+                 & (df["fecha"] < pd.Timestamp(day) + pd.Timedelta(days=1, hours=6))]
+        dia.to_csv(carpeta / "tabla_gas_ERM_{}.csv".format(day), index=False)
+
+    escrituras = []
+    guardar = Utils.guardar_manifiesto
+    monkeypatch.setattr(Utils, "guardar_manifiesto", lambda *args: escrituras.append(args) or guardar(*args))
+
+    assert Utils.migrar_csv_a_parquet(directorio) == 5
+    assert escrituras == [("gas_ERM", directorio)]
+    assert len(Utils.leer_manifiesto("gas_ERM", directorio)) == 5
+    assert len(Utils.leer_resumen("gas_ERM", directorio)) == 5
+
+
+def test_dos_hilos_mismo_dia_una_consulta(base, monkeypatch):
+    escribir, directorio = base
+    escribir("gas_ERM", contador("2025-02-01 06:00", 3))
+    Utils.obtener_engine()
+
+    # La consulta se demora para que el segundo hilo llegue mientras el primero descarga
+    llegada = threading.Barrier(2)
+    consultar = Utils.consultar_ventana
+
+    def consultar_lento(*args, **kwargs):
+        time.sleep(0.3)
+        return consultar(*args, **kwargs)
+
+    monkeypatch.setattr(Utils, "consultar_ventana", consultar_lento)
+
+    def cargar():
+        llegada.wait()
+        return find_load("rango_planta", "2025-02-02", "2025-02-02", "gas_ERM", False, directorio)
+
+    antes = consultas()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        resultados = list(pool.map(lambda _: cargar(), range(2)))
+
+    assert consultas() - antes == 1
+    assert len(resultados[0]) >= 48
+    pd.testing.assert_frame_equal(resultados[0].reset_index(drop=True), resultados[1].reset_index(drop=True))
+    # Las reservas se liberan y queda un solo archivo de bloqueo para el mes
+    assert Utils._vuelos == {}
+    bloqueos = os.listdir(os.path.join(Utils.ruta_cache(directorio, "gas_ERM"), Utils.BLOQUEOS))
+    assert sorted(b for b in bloqueos if b.startswith("gas_ERM_")) == ["gas_ERM_2025-02.lock"]
+
+
+def test_delta_con_particion_corrupta_descarga_el_dia_completo(base):
+    escribir, directorio = base
+    df = contador("2025-02-01 06:00", 3)
+    escribir("gas_ERM", df)
+    dia = df[(df["fecha"] >= pd.Timestamp("2025-02-02 06:00")) & (df["fecha"] < pd.Timestamp("2025-02-02 12:00"))]
+    Utils.guardar_particion(dia, "gas_ERM", "2025-02-02", directorio, final=False)
+    with open(Utils.ruta_particion(directorio, "gas_ERM", "2025-02-02"), "wb") as archivo:
+        archivo.write(b"no es parquet")
+
+    pd_sql = Utils.sql_connect_delta("2025-02-02", "gas_ERM", directorio, watermark=dia["fecha"].max())
+
+    assert pd_sql["fecha"].min() == pd.Timestamp("2025-02-02 06:00")
+    entrada = Utils.leer_manifiesto("gas_ERM", directorio)["2025-02-02"]
+    assert entrada["final"] and entrada["filas"] == len(pd_sql)
+
+
+def test_agregados_sin_cache_reusan_los_dias_cerrados(base, monkeypatch):
+    escribir, directorio = base
+    df = contador("2025-01-01 06:00", 20)
+    escribir("gas_ERM", df[(df["fecha"] < pd.Timestamp("2025-01-04 06:00")) | (df["fecha"] >= pd.Timestamp("2025-01-05 06:00"))])
+
+    antes = consultas()
+    primero = agregados_tabla("gas_ERM", "2025-01-01", "2025-01-10", directorio)
+    assert consultas() - antes == 1
+
+    # El mismo rango sale completo de memoria, incluido el día sin registros
+    antes = consultas()
+    segundo = agregados_tabla("gas_ERM", "2025-01-01", "2025-01-10", directorio)
+    assert consultas() == antes
+    for clave in ("diario", "diario_6", "media_hora", "ocupacion"):
+        pd.testing.assert_frame_equal(primero[clave], segundo[clave])
+    assert segundo["diario_6"].set_index("dia").loc["2025-01-04", "filas"] == 0
+
+    # Un rango que se solapa solo consulta los días nuevos
+    tramos = []
+    agregado = Utils.sql_agregado
+    monkeypatch.setattr(Utils, "sql_agregado", lambda table, ini, fin: tramos.append((ini, fin)) or agregado(table, ini, fin))
+    agregados_tabla("gas_ERM", "2025-01-05", "2025-01-15", directorio)
+    assert tramos == [("2025-01-12", "2025-01-16")]
+
+
+def test_un_engine_para_descargas_y_logs(base, monkeypatch):
+    escribir, directorio = base
+    escribir("gas_ERM", contador("2025-02-01 06:00", 3))
+    pd.DataFrame(columns=["fecha", "hora", "user"]).to_sql("log_uso", Utils.obtener_engine(), index=False)
+    engine = Utils.obtener_engine()
+    monkeypatch.setattr(Utils.st, "session_state", type("Sesion", (), {"user_state": {"email": "a@b.c"}})())
+
+    Utils.sql_connect("2025-02-01", "gas_ERM", directorio)
+    Utils.save_log()
+    Utils.sql_connect("2025-02-02", "gas_ERM", directorio)
+    Utils.save_log()
+
+    assert Utils.obtener_engine() is engine
+    assert estadisticas_engine()["conexiones_nuevas"] == 1
+    assert pd.read_sql_table("log_uso", engine)["user"].tolist() == ["a@b.c", "a@b.c"]
+
+
+def test_una_consulta_por_tramo_faltante(base, monkeypatch):
+    escribir, directorio = base
+    df = contador("2025-02-01 06:00", 12)
+    escribir("gas_ERM", df)
+    find_load("rango_planta", "2025-02-01", "2025-02-03", "gas_ERM", False, directorio)
+    find_load("day_planta", "2025-02-06", "2025-02-06", "gas_ERM", False, directorio)
+
+    tramos = []
+    rango = Utils.sql_connect_rango
+    monkeypatch.setattr(Utils, "sql_connect_rango",
+                        lambda ini, fin, table, directorio: tramos.append((ini, fin)) or rango(ini, fin, table, directorio))
+    antes = consultas()
+    pd_sql = find_load("rango_planta", "2025-02-01", "2025-02-10", "gas_ERM", False, directorio)
+
+    assert tramos == [("2025-02-04", "2025-02-05"), ("2025-02-07", "2025-02-10")]
+    assert consultas() - antes == 2
+    assert pd_sql["fecha"].is_unique and len(pd_sql) == 10 * 48 + 1
+
+
+def test_delta_desde_la_marca_de_agua_marca_el_dia_final(base):
+    escribir, directorio = base
+    df = contador("2025-02-01 06:00", 3)
+    escribir("gas_ERM", df)
+    parcial = df[(df["fecha"] >= pd.Timestamp("2025-02-02 06:00")) & (df["fecha"] < pd.Timestamp("2025-02-02 12:00"))]
+    Utils.guardar_particion(parcial, "gas_ERM", "2025-02-02", directorio, final=False)
+
+    antes = consultas()
+    pd_sql = find_load("day_planta", "2025-02-02", "2025-02-02", "gas_ERM", False, directorio)
+
+    # Una sola consulta que trae solo lo posterior a la marca de agua y se une a lo guardado
+    assert consultas() - antes == 1
+    esperado = df[(df["fecha"] >= pd.Timestamp("2025-02-02 06:00")) & (df["fecha"] <= pd.Timestamp("2025-02-03 06:00"))]
+    assert pd_sql["fecha"].tolist() == esperado["fecha"].tolist()
+    assert np.allclose(pd_sql["vol_corregido"], esperado["vol_corregido"])
+    assert Utils.leer_manifiesto("gas_ERM", directorio)["2025-02-02"]["final"]
+
+    antes = consultas()
+    find_load("day_planta", "2025-02-02", "2025-02-02", "gas_ERM", False, directorio)
+    assert consultas() == antes
+
+
+def test_manifiesto_se_concilia_y_el_archivo_danado_se_descarga(base, monkeypatch):
+    escribir, directorio = base
+    escribir("gas_ERM", contador("2025-02-01 06:00", 6))
+    completo = find_load("rango_planta", "2025-02-01", "2025-02-04", "gas_ERM", False, directorio)
+
+    # Otro proceso sin el manifiesto en memoria: se borra el archivo y se daña una partición
+    os.remove(os.path.join(Utils.ruta_cache(directorio, "gas_ERM"), Utils.MANIFIESTO))
+    with open(Utils.ruta_particion(directorio, "gas_ERM", "2025-02-03"), "wb") as archivo:
+        archivo.write(b"no es parquet")
+    monkeypatch.setattr(Utils, "_manifiestos", {})
+    monkeypatch.setattr(Utils, "_bloques", Utils.OrderedDict())
+
+    dias = Utils.cargar_manifiesto("gas_ERM", directorio)["dias"]
+    assert sorted(dias) == ["2025-02-01", "2025-02-02", "2025-02-04"]
+    assert sorted(Utils.leer_manifiesto("gas_ERM", directorio)) == sorted(dias)
+
+    antes = consultas()
+    pd_sql = find_load("rango_planta", "2025-02-01", "2025-02-04", "gas_ERM", False, directorio)
+    assert consultas() - antes == 1
+    pd.testing.assert_frame_equal(pd_sql.reset_index(drop=True), completo.reset_index(drop=True))
+
+    # Un archivo que se daña con el manifiesto ya cargado se detecta al leerlo y se vuelve a descargar
+    with open(Utils.ruta_particion(directorio, "gas_ERM", "2025-02-02"), "wb") as archivo:
+        archivo.write(b"no es parquet")
+    monkeypatch.setattr(Utils, "_bloques", Utils.OrderedDict())
+    antes = consultas()
+    pd_sql = find_load("rango_planta", "2025-02-01", "2025-02-04", "gas_ERM", False, directorio)
+    assert consultas() - antes == 1
+    pd.testing.assert_frame_equal(pd_sql.reset_index(drop=True), completo.reset_index(drop=True))
+
+
+def test_agregados_desde_la_base_y_desde_la_cache_coinciden(base):
+    escribir, directorio = base
+    df = contador("2025-01-01 06:00", 12)
+    df.loc[df["fecha"] >= pd.Timestamp("2025-01-03 14:00"), "vol_corregido"] -= 5100.0
+    escribir("gas_ERM", df[(df["fecha"] < pd.Timestamp("2025-01-05 06:00")) | (df["fecha"] >= pd.Timestamp("2025-01-06 06:00"))])
+
+    desde_base = agregados_tabla("gas_ERM", "2025-01-01", "2025-01-09", directorio)
+    find_load("rango_planta", "2025-01-01", "2025-01-10", "gas_ERM", False, directorio)
+    Utils.reiniciar_engine(Utils.obtener_engine().url)
+    desde_cache = agregados_tabla("gas_ERM", "2025-01-01", "2025-01-09", directorio)
+
+    assert estadisticas_engine().get("consultas", 0) == 0
+    for clave in ("diario", "diario_6", "media_hora", "ocupacion", "correcciones"):
+        pd.testing.assert_frame_equal(desde_base[clave], desde_cache[clave], check_dtype=False)